@@ -0,0 +1,58 @@
+if __name__ == "__main__":
+    import contextlib
+    import os
+    import shutil
+    import tempfile
+    import time
+    import numpy as np
+
+    from gcforest.gc_forest import GrainedCascadeForest
+    from gcforest import datasets
+
+    # ------------------------------------------------------------
+    # Benchmark: latency of single-example prediction
+    # ------------------------------------------------------------
+    # This example fits a gcForest model on the YEAST data set and compares latency (p50 and p99, per example) of
+    # predicting one example at a time with the trained model (original forests) and with the model, saved with
+    # `save(...)` and loaded with `GrainedCascadeForest.load(...)` (compiled node arrays, as used when serving).
+
+    def latencies(predict_fn, examples, n_repeats=3):
+        times = []
+        for _ in range(n_repeats):
+            for example in examples:
+                start = time.perf_counter()
+                predict_fn(example)
+                times.append(time.perf_counter() - start)
+
+        return np.array(times) * 1e6
+
+    train_X, train_y, test_X, test_y = datasets.prep_yeast()
+    gcf = GrainedCascadeForest(n_rf_cascade=2,
+                               n_crf_cascade=2,
+                               n_estimators_rf=100,
+                               n_estimators_crf=100,
+                               k_cv=3,
+                               random_state=1)
+    gcf.fit(train_X, train_y)
+    examples = test_X[:200]
+
+    model_dir = tempfile.mkdtemp()
+    try:
+        gcf.save(model_dir)
+        loaded_gcf = GrainedCascadeForest.load(model_dir)
+
+        results = []
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results.append(("predict_proba(...)", latencies(lambda example: gcf.predict_proba(example[np.newaxis]),
+                                                             examples)))
+            results.append(("predict_proba(..., verbose=False)",
+                            latencies(lambda example: gcf.predict_proba(example[np.newaxis], verbose=False),
+                                      examples)))
+            results.append(("loaded predict_proba(..., verbose=False)",
+                            latencies(lambda example: loaded_gcf.predict_proba(example[np.newaxis], verbose=False),
+                                      examples)))
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+
+    for name, times in results:
+        print("[%-45s] p50: %10.1f us, p99: %10.1f us" % (name, np.percentile(times, 50), np.percentile(times, 99)))
@@ -7,10 +7,335 @@ from gcforest.xofn import RandomXOfNForest
 from gcforest import common_utils
 
 
+class CascadeInputBuffer:
+    def __init__(self, base_feats):
+        """ Inputs of cascade layers, laid out as [base features | class vectors of previous layer]. A buffer is
+        allocated (and base features are copied into it) only once for each distinct block of base features, after
+        that only the class vector columns get overwritten for each layer.
+
+        Parameters
+        ----------
+        :param base_feats: list
+                Blocks of base features (numpy.ndarrays) - transformed features for each grain (in
+                MultiGrainedScanning) or raw features. Layer `i` uses block `i % len(base_feats)`.
+        """
+        self.base_feats = base_feats
+        self._buffers = [None] * len(base_feats)
+
+    def layer_input(self, idx_block, class_vectors):
+        """ Writes `class_vectors` next to base features of block `idx_block % len(base_feats)` and returns the
+        combined input. WARNING: returned array is overwritten by the next call that uses the same block.
+
+        Parameters
+        ----------
+        :param idx_block: int
+                Index of block of base features.
+        :param class_vectors: numpy.ndarray
+                Class vectors, produced by previous layer.
+        :return: numpy.ndarray
+                Input for next layer.
+        """
+        idx_block %= len(self.base_feats)
+        base = self.base_feats[idx_block]
+        buffer = self._buffers[idx_block]
+        n_base_cols = base.shape[1]
+
+        if buffer is None or buffer.shape[1] != n_base_cols + class_vectors.shape[1]:
+            buffer = np.empty((base.shape[0], n_base_cols + class_vectors.shape[1]),
+                              dtype=np.result_type(base, class_vectors))
+            buffer[:, :n_base_cols] = base
+            self._buffers[idx_block] = buffer
+
+        buffer[:, n_base_cols:] = class_vectors
+        return buffer
+
+
+def exit_confidence(class_vectors, n_classes, criterion="confidence"):
+    """ Averages class vectors of all forests in a layer (as EndingLayerAverage does) and computes how confident the
+    averaged prediction is, which determines whether an example can exit the cascade early.
+
+    Parameters
+    ----------
+    :param class_vectors: numpy.ndarray
+            Concatenated class vectors of all forests in a layer for each example.
+    :param n_classes: int
+            Number of classes.
+    :param criterion: str (default: "confidence")
+            "confidence" (highest averaged probability) or "margin" (difference between two highest averaged
+            probabilities).
+    :return: tuple
+            (averaged class vectors, confidence for each example)
+    """
+    avg_proba = np.mean(np.reshape(class_vectors, [class_vectors.shape[0], -1, n_classes]), axis=1)
+
+    if criterion == "confidence":
+        confidence = np.max(avg_proba, axis=1)
+    elif criterion == "margin":
+        if n_classes < 2:
+            return avg_proba, np.ones(avg_proba.shape[0], dtype=avg_proba.dtype)
+        top_two = np.partition(avg_proba, n_classes - 2, axis=1)[:, -2:]
+        confidence = top_two[:, 1] - top_two[:, 0]
+    else:
+        raise NotImplementedError("'criterion' must be one of {%s}" % ",".join(["confidence", "margin"]))
+
+    return avg_proba, confidence
+
+
+def truncated_n_trees(n_estimators, n_trees):
+    """ Number of trees of a forest with `n_estimators` trees that are used for prediction when it is truncated to
+    `n_trees` trees (int, first `n_trees` trees) or to a fraction of its trees (float in (0, 1], rounded up). If
+    `n_trees` is None, all trees are used. At least one tree is always used. """
+    if n_trees is None:
+        return n_estimators
+    if isinstance(n_trees, (float, np.floating)):
+        if not 0.0 < n_trees <= 1.0:
+            raise Exception("Fraction of trees must be in (0, 1] (got %s)!" % str(n_trees))
+        return max(1, min(n_estimators, int(np.ceil(n_trees * n_estimators))))
+    if n_trees < 1:
+        raise Exception("Number of trees must be at least 1 (got %d)!" % n_trees)
+
+    return min(n_estimators, int(n_trees))
+
+
+def forest_trees(forest):
+    """ Trained trees of `forest` (sklearn forest, RandomSubspaceForest or RandomXOfNForest). """
+    return forest.estimators if isinstance(forest, (RandomSubspaceForest, RandomXOfNForest)) else forest.estimators_
+
+
+def truncate_forest(forest, n_trees):
+    """ Removes all but the first `n_trees` trees (or fraction of trees, see `truncated_n_trees(...)`) of trained
+    `forest` in place. """
+    n_used = truncated_n_trees(len(forest_trees(forest)), n_trees)
+    if isinstance(forest, (RandomSubspaceForest, RandomXOfNForest)):
+        forest.estimators = forest.estimators[:n_used]
+        if isinstance(forest, RandomSubspaceForest):
+            forest._chosen_features = forest._chosen_features[:n_used]
+    else:
+        forest.estimators_ = forest.estimators_[:n_used]
+    forest.n_estimators = n_used
+
+
+def forest_predict_proba(forest, feats, n_trees=None):
+    """ Predicts class probabilities of `forest` (sklearn forest, RandomSubspaceForest or RandomXOfNForest) with only
+    its first trees (see `truncated_n_trees(...)`), over classes of the forest (`forest.classes_`). Probabilities of
+    used trees are averaged in double precision, as in the forests themselves. """
+    trees = forest_trees(forest)
+    n_used = truncated_n_trees(len(trees), n_trees)
+    if n_used == len(trees):
+        return forest.predict_proba(feats)
+
+    proba_preds = np.zeros((feats.shape[0], forest.classes_.shape[0]), dtype=np.float64)
+    for idx_tree in range(n_used):
+        if isinstance(forest, RandomSubspaceForest):
+            proba_preds[:, trees[idx_tree].classes_] += \
+                trees[idx_tree].predict_proba(feats[:, forest._chosen_features[idx_tree, :]])
+        else:
+            proba_preds += trees[idx_tree].predict_proba(feats)
+
+    return proba_preds / n_used
+
+
+def calibrate_exit_threshold(layer_confidences, layer_preds, final_preds, labels, max_acc_loss, n_candidates=100):
+    """ Finds the lowest confidence threshold for early exit (an example exits after the first layer, where its
+    confidence reaches the threshold) for which accuracy drops by at most `max_acc_loss` compared to running all
+    examples through all layers. Accuracies are estimated on out-of-fold (k-fold cross-validation) class vectors of
+    training examples.
+
+    Parameters
+    ----------
+    :param layer_confidences: numpy.ndarray
+            Confidence of each training example (columns) after each layer but the last one (rows).
+    :param layer_preds: numpy.ndarray
+            Predicted class index (argmax of averaged class vector) in the same layout as `layer_confidences`.
+    :param final_preds: numpy.ndarray
+            Predicted class index of the whole cascade (ending layer) for each training example.
+    :param labels: numpy.ndarray
+            Encoded labels of training examples.
+    :param max_acc_loss: float
+            Maximum allowed drop of accuracy (e.g. 0.01 for 1 percentage point).
+    :param n_candidates: int (default: 100)
+            Maximum number of candidate thresholds (quantiles of confidences).
+    :return: float
+            Threshold or None if no threshold satisfies the constraint (or there is only one layer).
+    """
+    if layer_confidences.shape[0] == 0:
+        return None
+
+    full_acc = np.mean(final_preds == labels)
+    idx_examples = np.arange(labels.shape[0])
+    # candidates are (evenly spaced in rank) confidences of training examples
+    candidates = np.unique(layer_confidences)
+    if candidates.shape[0] > n_candidates:
+        candidates = np.unique(candidates[np.linspace(0, candidates.shape[0] - 1, n_candidates).astype(np.int64)])
+
+    best_thresh = None
+    # lower thresholds let more examples exit, so candidates are checked from the highest one down
+    for thresh in candidates[::-1]:
+        exits = layer_confidences >= thresh
+        has_exit = np.any(exits, axis=0)
+        preds = np.where(has_exit, layer_preds[np.argmax(exits, axis=0), idx_examples], final_preds)
+
+        if np.mean(preds == labels) >= full_acc - max_acc_loss:
+            best_thresh = float(thresh)
+        else:
+            break
+
+    return best_thresh
+
+
+class CascadeRouter:
+    def __init__(self, split_transformed_feats, n_classes, threshold=None, criterion="confidence", dtype=np.float32):
+        """ Routes examples through cascade layers: after each layer, examples whose averaged class vector is confident
+        enough (see `exit_confidence(...)`) exit the cascade and only the remaining ones are passed to the next layer.
+        Used with the same rule during training (deeper layers train on a shrinking subset of examples) and
+        prediction. If `threshold` is None, all examples are passed to all layers.
+
+        Parameters
+        ----------
+        :param split_transformed_feats: list
+                List, containing transformed features (numpy.ndarrays) for each grain (in MultiGrainedScanning) or list,
+                containing numpy.ndarray with raw features (if no grains are used).
+        :param n_classes: int
+                Number of classes.
+        :param threshold: float (default: None)
+                Confidence threshold for exit.
+        :param criterion: str (default: "confidence")
+                How confidence is computed (see `exit_confidence(...)`).
+        :param dtype: numpy.dtype (default: numpy.float32)
+                Data type of class probabilities of exited examples.
+        """
+        self.n_classes = n_classes
+        self.threshold = threshold
+        self.criterion = criterion
+
+        self._all_feats = split_transformed_feats
+        self.remaining = np.arange(split_transformed_feats[0].shape[0])
+        # averaged class vectors of exited examples (rows of remaining examples are not used)
+        self.exit_proba = np.zeros((split_transformed_feats[0].shape[0], n_classes), dtype=dtype)
+        self.inputs = CascadeInputBuffer(split_transformed_feats)
+
+    @property
+    def n_remaining(self):
+        return self.remaining.shape[0]
+
+    def first_input(self):
+        """ Input of first layer for remaining examples. """
+        return self.inputs.base_feats[0]
+
+    def state(self):
+        """ Copy of routing state (indices of remaining examples and probabilities of exited ones), e.g. for
+        checkpoints. """
+        return {"remaining": self.remaining.copy(), "exit_proba": self.exit_proba.copy()}
+
+    def load_state(self, state):
+        self.remaining = state["remaining"]
+        self.exit_proba = state["exit_proba"].copy()
+        self.inputs = CascadeInputBuffer([feats[self.remaining] for feats in self._all_feats])
+
+    def release_inputs(self):
+        """ Drops base features and layer inputs (e.g. so that a trained model does not keep its training data).
+        Routing state and `predictions(...)` remain usable, but examples can not be routed any more. """
+        self._all_feats, self.inputs = None, None
+
+    def restart(self):
+        """ New router for all examples with the same base features and routing rule (i.e. with routing state before
+        the first layer). """
+        if self._all_feats is None:
+            raise Exception("Base features of examples were released, router can not be restarted!")
+
+        return CascadeRouter(self._all_feats, self.n_classes, threshold=self.threshold, criterion=self.criterion,
+                             dtype=self.exit_proba.dtype)
+
+    def copy(self):
+        router = CascadeRouter(self._all_feats, self.n_classes, threshold=self.threshold, criterion=self.criterion,
+                               dtype=self.exit_proba.dtype)
+        # (base features of remaining examples are never modified, so they can be shared)
+        router.remaining, router.exit_proba, router.inputs = self.remaining, self.exit_proba.copy(), self.inputs
+        return router
+
+    def predictions(self, class_vectors):
+        """ Predicted class index of all examples if the layer, that produced `class_vectors` (for remaining
+        examples), was the last one (averaged class vectors are used for remaining examples). """
+        preds = np.argmax(self.exit_proba, axis=1)
+        preds[self.remaining] = np.argmax(np.reshape(class_vectors, [class_vectors.shape[0], -1, self.n_classes]).sum(
+            axis=1), axis=1)
+        return preds
+
+    def route(self, idx_layer, class_vectors):
+        """ Lets confident examples exit after layer `idx_layer` and forms the input of next layer for the remaining
+        ones.
+
+        Parameters
+        ----------
+        :param idx_layer: int
+                Index of layer that produced `class_vectors`.
+        :param class_vectors: numpy.ndarray
+                Class vectors of remaining examples.
+        :return: numpy.ndarray
+                Input of next layer for examples that remain in cascade (WARNING: see
+                `CascadeInputBuffer.layer_input(...)`).
+        """
+        if self.threshold is not None:
+            avg_proba, confidence = exit_confidence(class_vectors, self.n_classes, criterion=self.criterion)
+            exits = confidence >= self.threshold
+
+            if np.any(exits):
+                self.exit_proba[self.remaining[exits]] = avg_proba[exits]
+
+                stays = ~exits
+                self.remaining = self.remaining[stays]
+                class_vectors = class_vectors[stays]
+                # base features of remaining examples only
+                self.inputs = CascadeInputBuffer([feats[stays] for feats in self.inputs.base_feats])
+
+        return self.inputs.layer_input(idx_layer, class_vectors)
+
+
+def predict_proba_early_exit(layer_transforms, ending_layer, split_transformed_feats, n_classes, exit_threshold,
+                             exit_criterion="confidence", dtype=np.float32):
+    """ Predicts probabilities with a cascade of layers, where examples, whose confidence after a layer (see
+    `exit_confidence(...)`) reaches `exit_threshold`, exit the cascade - their averaged class vector of that layer
+    is used as prediction. Only the remaining examples are passed on to the next layer (see `CascadeRouter`).
+
+    Parameters
+    ----------
+    :param layer_transforms: list
+            Functions that transform features into class vectors, one for each layer (e.g. `CascadeLayer.transform`).
+    :param ending_layer: EndingLayerAverage or EndingLayerStacking
+            Ending layer, used for examples that reach the last layer.
+    :param split_transformed_feats: list
+            List, containing transformed features (numpy.ndarrays) for each grain (in MultiGrainedScanning) or list,
+            containing numpy.ndarray with raw features (if no grains are used).
+    :param n_classes: int
+            Number of classes.
+    :param exit_threshold: float
+            Confidence threshold for early exit.
+    :param exit_criterion: str (default: "confidence")
+            How confidence is computed (see `exit_confidence(...)`).
+    :param dtype: numpy.dtype (default: np.float32)
+            Data type of predicted probabilities.
+    :return: numpy.ndarray
+            Class probabilities for each instance.
+    """
+    router = CascadeRouter(split_transformed_feats, n_classes, threshold=exit_threshold, criterion=exit_criterion,
+                           dtype=dtype)
+
+    curr_input = router.first_input()
+    for idx_layer in range(len(layer_transforms) - 1):
+        curr_input = router.route(idx_layer, layer_transforms[idx_layer](curr_input))
+        if router.n_remaining == 0:
+            return router.exit_proba
+
+    proba_preds = router.exit_proba
+    proba_preds[router.remaining] = ending_layer.predict_proba(layer_transforms[-1](curr_input))
+    return proba_preds
+
+
 class CascadeForest:
-    def __init__(self, classes_=None, ending_layer="avg", model=None, k_cv=3):
+    def __init__(self, classes_=None, ending_layer="avg", model=None, k_cv=3, dtype=np.float32):
         self.classes_ = np.array(classes_) if classes_ is not None else None
         self.layers = []
+        self.dtype = dtype
 
         self.idx_fit_next = 0
 
@@ -21,15 +346,21 @@ class CascadeForest:
         if ending_layer == options[0]:
             self.ending_layer = EndingLayerAverage(classes_=self.classes_)
         elif ending_layer == options[1]:
-            self.ending_layer = EndingLayerStacking(classes_=self.classes_, model=model, k_cv=k_cv)
+            self.ending_layer = EndingLayerStacking(classes_=self.classes_, model=model, k_cv=k_cv, dtype=dtype)
         else:
             raise NotImplementedError("'ending_layer' must be one of {%s}" % ",".join(options))
 
-    def add_layer(self, layer):
+    def add_layer(self, layer, is_trained=False):
         if not isinstance(layer, CascadeLayer):
             raise Exception("'layer' must be an object of type CascadeLayer!")
 
+        # already trained layers (e.g. loaded from disk) can only be added after other trained layers
+        if is_trained and self.idx_fit_next != len(self.layers):
+            raise Exception("Trained layer can not be added after layers that are not trained yet!")
+
         self.layers.append(layer)
+        if is_trained:
+            self.idx_fit_next += 1
 
     def remove_last_layer(self):
         num_layers = len(self.layers)
@@ -71,27 +402,48 @@ class CascadeForest:
 
         return preds
 
-    def _pred_proba(self, split_transformed_feats):
+    def _pred_proba(self, split_transformed_feats, exit_threshold=None, exit_criterion="confidence", verbose=True,
+                    n_trees=None):
         """ Internal method to predict probabilities for specifically shaped 'split_transformed_feats' list.
         :param split_transformed_feats: list
                 List, containing transformed features (numpy.ndarrays) for each grain (in MultiGrainedScanning) or list,
                 containing numpy.ndarray with raw features (if no grains are used). Each of these feature arrays needs
                 to have same number of columns.
+        :param exit_threshold: float (default: None)
+                If not None, examples exit the cascade after the first layer where their confidence reaches this
+                threshold (see `predict_proba_early_exit(...)`).
+        :param exit_criterion: str (default: "confidence")
+                How confidence for early exit is computed (see `exit_confidence(...)`).
+        :param verbose: bool (default: True)
+                Whether to print shapes of layer inputs.
+        :param n_trees: int or float (default: None)
+                If not None, only first `n_trees` trees (or fraction of trees) of each forest are used (see
+                `CascadeLayer.transform(...)`).
         :return: numpy.ndarray
                 Class probabilities for each instance.
         """
+        if exit_threshold is not None:
+            return predict_proba_early_exit([lambda feats, layer=layer: layer.transform(feats, n_trees=n_trees)
+                                             for layer in self.layers], self.ending_layer,
+                                            split_transformed_feats, n_classes=self.classes_.shape[0],
+                                            exit_threshold=exit_threshold, exit_criterion=exit_criterion,
+                                            dtype=self.dtype)
+
         num_layers = len(self.layers)
+        val_inputs = CascadeInputBuffer(split_transformed_feats)
 
         curr_val_input = split_transformed_feats[0]
         for idx_layer in range(num_layers - 1):
-            print("Layer %d... features shape: %s" % (idx_layer, str(curr_val_input.shape)))
-            curr_val_feats = self.layers[idx_layer].transform(curr_val_input)
+            if verbose:
+                print("Layer %d... features shape: %s" % (idx_layer, str(curr_val_input.shape)))
+            curr_val_feats = self.layers[idx_layer].transform(curr_val_input, n_trees=n_trees)
 
-            curr_val_input = np.hstack((split_transformed_feats[idx_layer % len(split_transformed_feats)], curr_val_feats))
+            curr_val_input = val_inputs.layer_input(idx_layer, curr_val_feats)
 
-        print("Layer %d... features shape: %s" % (num_layers - 1, str(curr_val_input.shape)))
+        if verbose:
+            print("Layer %d... features shape: %s" % (num_layers - 1, str(curr_val_input.shape)))
         # do not concatenate features from multi-grained scanning on last layer
-        curr_val_feats = self.layers[num_layers - 1].transform(curr_val_input)
+        curr_val_feats = self.layers[num_layers - 1].transform(curr_val_input, n_trees=n_trees)
 
         return self.ending_layer.predict_proba(curr_val_feats)
 
@@ -109,7 +461,8 @@ class CascadeLayer:
                  classes_=None,
                  random_state=None,
                  labels_encoded=False,
-                 keep_models=True):
+                 keep_models=True,
+                 dtype=np.float32):
         """
         Parameters
         ----------
@@ -131,6 +484,8 @@ class CascadeLayer:
         :param keep_models: bool (default: True)
                 Whether to keep trained models or not. An example of when you do not need to keep models is
                 when determining number of optimal layers in the cascade forest.
+        :param dtype: numpy.dtype (default: numpy.float32)
+                Data type of class vectors, produced by this layer.
         """
         self.n_rf, self.rf_estimators = n_rf, []
         self.n_crf, self.crf_estimators = n_crf, []
@@ -147,11 +502,40 @@ class CascadeLayer:
             np.random.seed(random_state)
         self.labels_encoded = labels_encoded
         self.keep_models = keep_models
+        self.dtype = dtype
 
         self.idx_fit_next = 0
 
         self.kfold_acc = None
 
+    def forests(self):
+        """ Trained forests of layer, in the same order as their class vectors in output of `transform(...)`. """
+        return self.crf_estimators + self.rf_estimators + self.rsf_estimators + self.xonf_estimators
+
+    def _forest_slot(self, idx_forest):
+        """ (list of forests of the same kind, index in it, name of kind) of forest `idx_forest` (see `forests()`). """
+        for kind in ("crf", "rf", "rsf", "xonf"):
+            estimators = getattr(self, "%s_estimators" % kind)
+            if idx_forest < len(estimators):
+                return estimators, idx_forest, kind
+            idx_forest -= len(estimators)
+
+        raise Exception("Layer has no forest with index %d!" % idx_forest)
+
+    def replace_forest(self, idx_forest, forest):
+        """ Replaces forest `idx_forest` (see `forests()`) with `forest` (e.g. with its copy with fewer trees). """
+        estimators, idx, _ = self._forest_slot(idx_forest)
+        estimators[idx] = forest
+
+    def remove_forest(self, idx_forest):
+        """ Removes forest `idx_forest` (see `forests()`), together with its class vector in output of the layer. """
+        if len(self.forests()) == 1:
+            raise Exception("Last forest of a layer can not be removed!")
+
+        estimators, idx, kind = self._forest_slot(idx_forest)
+        setattr(self, "n_%s" % kind, getattr(self, "n_%s" % kind) - 1)
+        return estimators.pop(idx)
+
     def train_layer(self, feats, labels):
         """
             This method is currently not the main focus because caching is not yet implemented - `fit_transform(...)`
@@ -175,7 +559,8 @@ class CascadeLayer:
                                                                                    labels=labels,
                                                                                    model=crf_model,
                                                                                    num_all_classes=self.classes_.shape[0],
-                                                                                   k_cv=self.k_cv)
+                                                                                   k_cv=self.k_cv,
+                                                                                   dtype=self.dtype)
 
             layer_acc += curr_acc
 
@@ -195,7 +580,8 @@ class CascadeLayer:
                                                                                    labels=labels,
                                                                                    model=rf_model,
                                                                                    num_all_classes=self.classes_.shape[0],
-                                                                                   k_cv=self.k_cv)
+                                                                                   k_cv=self.k_cv,
+                                                                                   dtype=self.dtype)
 
             layer_acc += curr_acc
 
@@ -217,7 +603,8 @@ class CascadeLayer:
                                                                                    model=rsf_model,
                                                                                    num_all_classes=
                                                                                    self.classes_.shape[0],
-                                                                                   k_cv=self.k_cv)
+                                                                                   k_cv=self.k_cv,
+                                                                                   dtype=self.dtype)
 
             layer_acc += curr_acc
 
@@ -240,7 +627,8 @@ class CascadeLayer:
                                                                                    model=xonf_model,
                                                                                    num_all_classes=
                                                                                    self.classes_.shape[0],
-                                                                                   k_cv=self.k_cv)
+                                                                                   k_cv=self.k_cv,
+                                                                                   dtype=self.dtype)
 
             layer_acc += curr_acc
 
@@ -277,9 +665,10 @@ class CascadeLayer:
                                                                                          labels=train_labels,
                                                                                          model=curr_model,
                                                                                          num_all_classes=self.classes_.shape[0],
-                                                                                         k_cv=self.k_cv)
+                                                                                         k_cv=self.k_cv,
+                                                                                         dtype=self.dtype)
 
-            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = curr_model.classes_
             curr_test_feats[:, class_indices] = curr_model.predict_proba(test_feats)
 
@@ -303,9 +692,10 @@ class CascadeLayer:
                                                                                          labels=train_labels,
                                                                                          model=curr_model,
                                                                                          num_all_classes=self.classes_.shape[0],
-                                                                                         k_cv=self.k_cv)
+                                                                                         k_cv=self.k_cv,
+                                                                                         dtype=self.dtype)
 
-            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = curr_model.classes_
             curr_test_feats[:, class_indices] = curr_model.predict_proba(test_feats)
 
@@ -334,9 +724,10 @@ class CascadeLayer:
                                                                                          labels=train_labels,
                                                                                          model=curr_model,
                                                                                          num_all_classes=self.classes_.shape[0],
-                                                                                         k_cv=self.k_cv)
+                                                                                         k_cv=self.k_cv,
+                                                                                         dtype=self.dtype)
 
-            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = curr_model.classes_
             curr_test_feats[:, class_indices] = curr_model.predict_proba(test_feats)
 
@@ -366,9 +757,10 @@ class CascadeLayer:
                                                                                          model=curr_model,
                                                                                          num_all_classes=
                                                                                          self.classes_.shape[0],
-                                                                                         k_cv=self.k_cv)
+                                                                                         k_cv=self.k_cv,
+                                                                                         dtype=self.dtype)
 
-            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((test_feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = curr_model.classes_
             curr_test_feats[:, class_indices] = curr_model.predict_proba(test_feats)
 
@@ -397,7 +789,10 @@ class CascadeLayer:
 
         return all_train, all_test
 
-    def transform(self, feats):
+    def transform(self, feats, n_trees=None):
+        """ Produces concatenated class vectors of all forests in the layer for each example in `feats`. If `n_trees`
+        is not None, only first `n_trees` trees (int) or fraction of trees (float in (0, 1]) of each forest are used
+        (see `truncated_n_trees(...)`), which trades accuracy for lower latency. """
         if not self.keep_models:
             raise Exception("Models were not saved during training. Argument 'keep_models' should be set to True "
                             "when creating a CascadeLayer...")
@@ -406,9 +801,10 @@ class CascadeLayer:
         all_test = None
 
         for idx_crf in range(self.n_crf):
-            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.crf_estimators[idx_crf].classes_
-            curr_proba_preds[:, class_indices] = self.crf_estimators[idx_crf].predict_proba(feats)
+            curr_proba_preds[:, class_indices] = forest_predict_proba(self.crf_estimators[idx_crf], feats,
+                                                                      n_trees=n_trees)
 
             feats_crf.append(curr_proba_preds)
 
@@ -417,9 +813,10 @@ class CascadeLayer:
             all_test = feats_crf
 
         for idx_rf in range(self.n_rf):
-            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.rf_estimators[idx_rf].classes_
-            curr_proba_preds[:, class_indices] = self.rf_estimators[idx_rf].predict_proba(feats)
+            curr_proba_preds[:, class_indices] = forest_predict_proba(self.rf_estimators[idx_rf], feats,
+                                                                      n_trees=n_trees)
 
             feats_rf.append(curr_proba_preds)
 
@@ -428,9 +825,10 @@ class CascadeLayer:
             all_test = feats_rf if all_test is None else np.hstack((all_test, feats_rf))
 
         for idx_rsf in range(self.n_rsf):
-            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.rsf_estimators[idx_rsf].classes_
-            curr_proba_preds[:, class_indices] = self.rsf_estimators[idx_rsf].predict_proba(feats)
+            curr_proba_preds[:, class_indices] = forest_predict_proba(self.rsf_estimators[idx_rsf], feats,
+                                                                      n_trees=n_trees)
 
             feats_rsf.append(curr_proba_preds)
 
@@ -439,9 +837,10 @@ class CascadeLayer:
             all_test = feats_rsf if all_test is None else np.hstack((all_test, feats_rsf))
 
         for idx_xonf in range(self.n_xonf):
-            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.xonf_estimators[idx_xonf].classes_
-            curr_proba_preds[:, class_indices] = self.xonf_estimators[idx_xonf].predict_proba(feats)
+            curr_proba_preds[:, class_indices] = forest_predict_proba(self.xonf_estimators[idx_xonf], feats,
+                                                                      n_trees=n_trees)
 
             feats_xonf.append(curr_proba_preds)
 
@@ -459,12 +858,11 @@ class EndingLayerAverage:
     def predict_proba(self, feats):
         num_examples = feats.shape[0]
 
-        # reshape features so that predicted probabilities for same class are in same column
-        # e.g. [p11, p12, p13, p21, p22, p23] -> [[p11, p12, p13], [p21, p22, p23]]
-        reshaped_feats = np.reshape(feats, [-1, self.classes_.shape[0]])
-        split_feats = np.split(reshaped_feats, num_examples)
+        # reshape features so that predicted probabilities of each example for same class are in same column
+        # e.g. [p11, p12, p13, p21, p22, p23] -> [[p11, p12, p13], [p21, p22, p23]] (data type of `feats` is kept)
+        reshaped_feats = np.reshape(feats, [num_examples, -1, self.classes_.shape[0]])
 
-        return np.mean(split_feats, axis=1)
+        return np.mean(reshaped_feats, axis=1)
 
     def predict(self, feats):
         proba_preds = self.predict_proba(feats)
@@ -479,8 +877,9 @@ class EndingLayerAverage:
 
 
 class EndingLayerStacking:
-    def __init__(self, classes_, model=None, k_cv=3):
+    def __init__(self, classes_, model=None, k_cv=3, dtype=np.float32):
         self.classes_ = classes_
+        self.dtype = dtype
 
         self._stacking_model = model if model is not None else LogisticRegression()
         self.k_cv = k_cv
@@ -490,7 +889,7 @@ class EndingLayerStacking:
         if not self._is_fitted:
             raise Exception("Stacking model is not fitted...")
 
-        proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]))
+        proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
         class_indices = self._stacking_model.classes_
         proba_preds[:, class_indices] = self._stacking_model.predict_proba(feats)
 
@@ -505,7 +904,8 @@ class EndingLayerStacking:
                                                                                 labels=labels,
                                                                                 model=self._stacking_model,
                                                                                 num_all_classes=self.classes_.shape[0],
-                                                                                k_cv=self.k_cv)
+                                                                                k_cv=self.k_cv,
+                                                                                dtype=self.dtype)
 
         print("Final layer average accuracy: %.5f..." % curr_acc)
         self._is_fitted = True
@@ -517,9 +917,10 @@ class EndingLayerStacking:
                                                                  labels=train_labels,
                                                                  model=self._stacking_model,
                                                                  num_all_classes=self.classes_.shape[0],
-                                                                 k_cv=self.k_cv)
+                                                                 k_cv=self.k_cv,
+                                                                 dtype=self.dtype)
 
-        proba_preds = np.zeros((test_feats.shape[0], self.classes_.shape[0]))
+        proba_preds = np.zeros((test_feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
         class_indices = model.classes_
         proba_preds[:, class_indices] = model.predict_proba(test_feats)
 
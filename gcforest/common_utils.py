@@ -1,11 +1,12 @@
 import numpy as np
 from sklearn.model_selection import KFold, StratifiedKFold
 from sklearn.externals import joblib
+import hashlib
 import os
 import shutil
 
 
-def get_class_distribution(feats, labels, model, num_all_classes, k_cv=3):
+def get_class_distribution(feats, labels, model, num_all_classes, k_cv=3, dtype=np.float32):
     """ Gets predicted probabilities for 'feats' using k-fold cross validation and trains a model on entire data set
     afterwards.
 
@@ -22,6 +23,8 @@ def get_class_distribution(feats, labels, model, num_all_classes, k_cv=3):
             which does not include all unique labels.
     :param k_cv: int (default: 3)
             Parameter for k-fold cross validation.
+    :param dtype: numpy.dtype (default: numpy.float32)
+            Data type of class distribution.
     :return: tuple
             (trained model, class distribution, average accuracy) where class distribution has same number of rows as
             'feats' and (num_all_classes) columns.
@@ -29,7 +32,7 @@ def get_class_distribution(feats, labels, model, num_all_classes, k_cv=3):
 
     kf = StratifiedKFold(n_splits=k_cv, shuffle=True)
 
-    class_distrib = np.zeros((feats.shape[0], num_all_classes))
+    class_distrib = np.zeros((feats.shape[0], num_all_classes), dtype=dtype)
 
     avg_acca = 0.0
 
@@ -42,7 +45,8 @@ def get_class_distribution(feats, labels, model, num_all_classes, k_cv=3):
         curr_part[:, model.classes_] = model.predict_proba(feats[test_indices])
         class_distrib[test_indices, :] = curr_part
 
-        avg_acca += np.sum(model.classes_[np.argmax(curr_part, axis=1)] == labels[test_indices]) / test_indices.shape[0]
+        # (columns of class distribution are indexed by class, also when some classes are missing in 'labels')
+        avg_acca += np.sum(np.argmax(curr_part, axis=1) == labels[test_indices]) / test_indices.shape[0]
 
     avg_acca /= k_cv
     print("Average k-fold cross-validation accuracy of a SINGLE ENSEMBLE is %f..." % avg_acca)
@@ -53,6 +57,28 @@ def get_class_distribution(feats, labels, model, num_all_classes, k_cv=3):
     return model, class_distrib, avg_acca
 
 
+def data_fingerprint(*objs):
+    """ Computes a fingerprint of 'objs', used to check whether cached data belongs to the same data and configuration.
+
+    Parameters
+    ----------
+    :param objs:
+            Objects to be fingerprinted - numpy.ndarrays are hashed by their data type, shape and contents, other
+            objects by their repr(...).
+    :return: str
+            Hexadecimal SHA-1 digest.
+    """
+    fingerprint = hashlib.sha1()
+    for obj in objs:
+        if isinstance(obj, np.ndarray):
+            fingerprint.update(repr((obj.dtype.str, obj.shape)).encode())
+            fingerprint.update(np.ascontiguousarray(obj).data)
+        else:
+            fingerprint.update(repr(obj).encode())
+
+    return fingerprint.hexdigest()
+
+
 def create_cache_dir(dir_path):
     # creates directory if it doesn't yet exist - if it does exist, it preserves original directory
     os.makedirs(dir_path, exist_ok=True)
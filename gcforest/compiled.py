@@ -0,0 +1,726 @@
+import numpy as np
+import json
+import os
+
+from gcforest.cascade_forest import CascadeInputBuffer, EndingLayerAverage, EndingLayerStacking, \
+    predict_proba_early_exit, truncated_n_trees
+from gcforest.random_subspace import RandomSubspaceForest
+from gcforest.xofn import RandomXOfNForest
+
+# maximum number of (example, tree, class) values that get gathered from leaves at once - examples are routed through
+# a layer in chunks of rows so that memory use stays bounded for large batches
+_MAX_BATCH_ELEMS = 2**22
+# max. number of (example, tree) pairs that get routed through trees of a layer at once (see `CompiledLayer.apply(...)`)
+_BLOCK_PAIRS = 2**15
+# (example, tree) pairs that reached leaves are dropped every `_COMPACT_LEVELS` levels, if at least half of them did
+_COMPACT_LEVELS = 4
+
+# node arrays of a compiled layer and arrays, derived from them for traversal (both are stored in saved models)
+_NODE_ARRAYS = ("children_left", "children_right", "split_val", "attr_ptr", "attr_idx", "thresh_val", "leaf_vals",
+                "roots", "forest_ptr")
+_TRAVERSAL_ARRAYS = ("children", "first_attr", "first_thresh", "n_extra_conds", "needs_count")
+
+# on-disk format of saved models (see `save_compiled(...)`) - version gets increased on incompatible changes
+FORMAT_NAME = "gcforest-compiled"
+FORMAT_VERSION = 1
+_MANIFEST_FILE = "manifest.json"
+
+
+def _float32_split_thresholds(threshold):
+    """ Thresholds `T` (float64), for which `x < T` holds exactly when sklearn's split condition `float32(x) <= t`
+    holds (sklearn trees cast examples to float32 before comparing them with float64 thresholds `t`), for any float64
+    `x`. Float32 values up to `t` are the ones up to `a = largest float32 <= t`, so `T` lies at the midpoint between
+    `a` and the next float32 value (midpoint itself rounds to the one of them with even mantissa). """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    lower = threshold.astype(np.float32)
+    lower = np.where(lower.astype(np.float64) > threshold, np.nextafter(lower, np.float32(-np.inf)), lower)
+
+    with np.errstate(over="ignore"):
+        upper = np.nextafter(lower, np.float32(np.inf)).astype(np.float64)
+    lower64 = lower.astype(np.float64)
+    # (above the largest float32 value, values round up to infinity at the same spacing as below it)
+    upper = np.where(np.isinf(upper), 2 * lower64 - np.nextafter(lower, np.float32(-np.inf)).astype(np.float64), upper)
+    midpoint = lower64 + (upper - lower64) / 2
+
+    rounds_down = (lower.view(np.int32) & 1) == 0
+    return np.where(rounds_down, np.nextafter(midpoint, np.inf), midpoint)
+
+
+def _sklearn_tree_nodes(tree, feature_map=None):
+    """ Converts a fitted sklearn tree into X-of-N node arrays (see `FlatXOfNTree` in gcforest.xofn). Split
+    `x[f] <= t` becomes a single condition `x[f] < T` (see `_float32_split_thresholds(...)`, examples are compared in
+    float32 as in sklearn) with split value 1 - examples with 0 true conditions go to the (new) left child, so
+    children get swapped.
+
+    Parameters
+    ----------
+    tree: sklearn.tree.DecisionTreeClassifier
+        Fitted tree
+
+    feature_map: np.array, optional
+        Column of original features for each feature that `tree` was trained on (e.g. features, chosen for a tree in
+        RandomSubspaceForest). If None, features are not remapped
+
+    Returns
+    -------
+    tuple
+        (children_left, children_right, split_val, attr_ptr, attr_idx, thresh_val, probas)
+    """
+    nodes = tree.tree_
+    is_internal = nodes.children_left != -1
+
+    children_left = np.where(is_internal, nodes.children_right, -1)
+    children_right = np.where(is_internal, nodes.children_left, -1)
+    split_val = is_internal.astype(np.int32)
+    attr_ptr = np.concatenate(([0], np.cumsum(is_internal)))
+    attr_idx = nodes.feature[is_internal].astype(np.int64)
+    if feature_map is not None:
+        attr_idx = np.asarray(feature_map, dtype=np.int64)[attr_idx]
+    thresh_val = _float32_split_thresholds(nodes.threshold[is_internal])
+
+    # depending on the version of sklearn, `value` holds either class counts or class fractions
+    values = nodes.value[:, 0, :]
+    probas = values / np.maximum(np.sum(values, axis=1, keepdims=True), np.finfo(np.float64).tiny)
+
+    return children_left, children_right, split_val, attr_ptr, attr_idx, thresh_val, probas
+
+
+class CompiledLayer:
+    def __init__(self, children_left, children_right, split_val, attr_ptr, attr_idx, thresh_val, leaf_vals, roots,
+                 forest_ptr, n_classes, dtype=np.float32, traversal_arrays=None):
+        """ Trained cascade layer, compiled into a single set of contiguous node arrays. All trees of all forests in
+        the layer are stored as X-of-N trees (an axis-aligned split is an X-of-N attribute with a single condition),
+        so that a batch of examples is routed through every tree of the layer at once, level by level.
+
+        Parameters
+        ----------
+        :param children_left: numpy.ndarray
+                Index of left child for each node (-1 for leaves). Examples with less than `split_val` true conditions
+                go to the left child.
+        :param children_right: numpy.ndarray
+                Index of right child for each node (-1 for leaves).
+        :param split_val: numpy.ndarray
+                Split point for each internal node.
+        :param attr_ptr: numpy.ndarray
+                Offsets of conditions of each node in `attr_idx` and `thresh_val` (of length `n_nodes + 1`).
+        :param attr_idx: numpy.ndarray
+                Feature indices of conditions (`x[attr_idx] < thresh_val`) of all nodes.
+        :param thresh_val: numpy.ndarray
+                Thresholds of conditions of all nodes.
+        :param leaf_vals: numpy.ndarray
+                Class probabilities for each node (only meaningful for leaves), placed at the layer's class indices.
+                Class vector of a forest is the average of probabilities in leaves of its trees.
+        :param roots: numpy.ndarray
+                Root node index of each tree. Trees of the same forest are consecutive.
+        :param forest_ptr: numpy.ndarray
+                Index of first tree of each forest (forests in the same order as their class vectors in layer output).
+        :param n_classes: int
+                Number of classes (length of a single class vector).
+        :param dtype: numpy.dtype (default: np.float32)
+                Data type of produced class vectors.
+        :param traversal_arrays: dict (default: None)
+                Arrays, derived from node arrays for traversal (see `traversal_arrays(...)`). If None, they get
+                computed from node arrays.
+        """
+        self.children_left = children_left
+        self.children_right = children_right
+        self.split_val = split_val
+        self.attr_ptr = attr_ptr
+        self.attr_idx = attr_idx
+        self.thresh_val = thresh_val
+        self.leaf_vals = leaf_vals
+        self.roots = roots
+        self.forest_ptr = forest_ptr
+        self.n_classes = n_classes
+        self.dtype = dtype
+
+        self._n_forest_trees = np.diff(np.append(self.forest_ptr, self.roots.shape[0]))
+
+        if traversal_arrays is None:
+            traversal_arrays = CompiledLayer.traversal_arrays(children_left, children_right, split_val, attr_ptr,
+                                                              attr_idx, thresh_val)
+        self._children = traversal_arrays["children"]
+        self._first_attr = traversal_arrays["first_attr"]
+        self._first_thresh = traversal_arrays["first_thresh"]
+        self._n_extra_conds = traversal_arrays["n_extra_conds"]
+        self._needs_count = traversal_arrays["needs_count"]
+        self._single_cond = not np.any(self._needs_count)
+
+        # truncated tree sets (see `truncation(...)`), cached by `n_trees`
+        self._truncations = {}
+
+    @staticmethod
+    def traversal_arrays(children_left, children_right, split_val, attr_ptr, attr_idx, thresh_val):
+        """ Derives arrays, used for traversal, from node arrays:
+        - `children`... children of node `i` are at `2 * i` (left) and `2 * i + 1` (right) and leaves point to
+        themselves, so that examples can keep being routed after they reach a leaf,
+        - `first_attr`, `first_thresh`... first condition of each node, which is looked up directly by node,
+        - `n_extra_conds`... number of remaining conditions of each node (only X-of-N nodes have them),
+        - `needs_count`... whether number of true conditions needs to be counted for node (for splits on a single
+        condition with split value 1, e.g. all splits of non X-of-N trees, the first condition alone decides the
+        child).
+        """
+        is_leaf = children_left == -1
+        node_ids = np.arange(children_left.shape[0])
+        children = np.empty(2 * children_left.shape[0], dtype=np.int64)
+        children[0::2] = np.where(is_leaf, node_ids, children_left)
+        children[1::2] = np.where(is_leaf, node_ids, children_right)
+
+        n_conds = np.diff(attr_ptr)
+        first_cond = np.where(n_conds > 0, attr_ptr[:-1], 0)
+        first_attr = np.where(n_conds > 0, attr_idx[first_cond] if attr_idx.shape[0] > 0 else 0, 0)
+        first_thresh = np.where(n_conds > 0, thresh_val[first_cond] if thresh_val.shape[0] > 0 else 0, 0.0)
+        n_extra_conds = np.maximum(n_conds - 1, 0)
+        needs_count = ~is_leaf & ((n_extra_conds > 0) | (split_val != 1))
+
+        return {"children": children, "first_attr": first_attr, "first_thresh": first_thresh,
+                "n_extra_conds": n_extra_conds, "needs_count": needs_count}
+
+    def arrays(self):
+        """ Returns all arrays of compiled layer (node arrays and arrays, derived for traversal) by name. """
+        arrays = {name: getattr(self, name) for name in _NODE_ARRAYS}
+        arrays.update({name: getattr(self, "_" + name) for name in _TRAVERSAL_ARRAYS})
+
+        return arrays
+
+    @staticmethod
+    def from_layer(layer):
+        """ Compiles a trained CascadeLayer (which needs to be trained with `keep_models=True`) or Grain. """
+        if not getattr(layer, "keep_models", True):
+            raise Exception("Models were not saved during training. Argument 'keep_models' should be set to True "
+                            "when creating a CascadeLayer...")
+
+        # same order of forests as in `CascadeLayer.transform(...)` and `Grain.transform(...)`
+        return CompiledLayer.from_forests(layer.crf_estimators + layer.rf_estimators + layer.rsf_estimators +
+                                          layer.xonf_estimators, n_classes=layer.classes_.shape[0], dtype=layer.dtype)
+
+    @staticmethod
+    def from_forests(forests, n_classes, dtype=np.float32):
+        """ Compiles trained forests (sklearn forests, RandomSubspaceForest and RandomXOfNForest objects), trained on
+        labels, encoded as indices of `n_classes` classes. Class vectors of forests are concatenated in given order. """
+        # (node arrays, layer class index of each column of tree's probabilities) for each tree
+        trees, forest_ptr = [], []
+        for forest in forests:
+            forest_ptr.append(len(trees))
+            forest_cols = np.asarray(forest.classes_, dtype=np.int64)
+
+            if isinstance(forest, RandomSubspaceForest):
+                for idx_tree, tree in enumerate(forest.estimators):
+                    trees.append((_sklearn_tree_nodes(tree, forest._chosen_features[idx_tree]),
+                                  forest_cols[tree.classes_.astype(np.int64)]))
+            elif isinstance(forest, RandomXOfNForest):
+                for tree in forest.estimators:
+                    flat_tree = tree.tree_
+                    trees.append(((flat_tree.children_left, flat_tree.children_right, flat_tree.split_val,
+                                   flat_tree.attr_ptr, flat_tree.attr_idx, flat_tree.thresh_val, flat_tree.probas),
+                                  forest_cols))
+            else:
+                # sklearn forest - probabilities of its trees are already over all classes of the forest
+                for tree in forest.estimators_:
+                    trees.append((_sklearn_tree_nodes(tree), forest_cols))
+
+        children_left, children_right, split_val, attr_ptr, attr_idx, thresh_val, leaf_vals, roots = \
+            [], [], [], [np.zeros(1, dtype=np.int64)], [], [], [], []
+        node_offset, cond_offset = 0, 0
+        for (t_left, t_right, t_split, t_ptr, t_attr, t_thresh, t_probas), cols in trees:
+            n_nodes = t_left.shape[0]
+            roots.append(node_offset)
+            children_left.append(np.where(t_left != -1, t_left + node_offset, -1))
+            children_right.append(np.where(t_right != -1, t_right + node_offset, -1))
+            split_val.append(t_split)
+            attr_ptr.append(np.asarray(t_ptr[1:], dtype=np.int64) + cond_offset)
+            attr_idx.append(t_attr)
+            thresh_val.append(t_thresh)
+
+            curr_vals = np.zeros((n_nodes, n_classes), dtype=np.float64)
+            curr_vals[:, cols] = t_probas
+            leaf_vals.append(curr_vals)
+
+            node_offset += n_nodes
+            cond_offset += t_attr.shape[0]
+
+        return CompiledLayer(children_left=np.concatenate(children_left).astype(np.int64),
+                             children_right=np.concatenate(children_right).astype(np.int64),
+                             split_val=np.concatenate(split_val).astype(np.int32),
+                             attr_ptr=np.concatenate(attr_ptr),
+                             attr_idx=np.concatenate(attr_idx).astype(np.int64),
+                             thresh_val=np.concatenate(thresh_val).astype(np.float64),
+                             leaf_vals=np.concatenate(leaf_vals),
+                             roots=np.array(roots, dtype=np.int64),
+                             forest_ptr=np.array(forest_ptr, dtype=np.int64),
+                             n_classes=n_classes,
+                             dtype=dtype)
+
+    @property
+    def n_trees(self):
+        return self.roots.shape[0]
+
+    @property
+    def n_forests(self):
+        return self.forest_ptr.shape[0]
+
+    def truncation(self, n_trees):
+        """ Trees of the layer that are used when each forest is truncated to its first `n_trees` trees (int) or
+        fraction of trees (float in (0, 1]), see `gcforest.cascade_forest.truncated_n_trees(...)`.
+
+        Returns
+        -------
+        tuple
+            (root node index of each used tree, index of first used tree of each forest among them, number of used
+            trees of each forest)
+        """
+        if n_trees is None:
+            return self.roots, self.forest_ptr, self._n_forest_trees
+
+        # (1 tree and fraction 1.0 are different truncations)
+        key = (isinstance(n_trees, (float, np.floating)), n_trees)
+        if key not in self._truncations:
+            n_used = np.array([truncated_n_trees(int(n_forest_trees), n_trees)
+                               for n_forest_trees in self._n_forest_trees], dtype=np.int64)
+            used_trees = np.concatenate([np.arange(start, start + n) for start, n in zip(self.forest_ptr, n_used)])
+            self._truncations[key] = (self.roots[used_trees], np.cumsum(n_used) - n_used, n_used)
+
+        return self._truncations[key]
+
+    def apply(self, feats, roots=None):
+        """ Routes every example in `feats` through every tree in the layer.
+
+        Parameters
+        ----------
+        :param feats: numpy.ndarray
+                2D array of examples.
+        :param roots: numpy.ndarray (default: None)
+                Root nodes of trees to route examples through. If None, all trees of the layer are used.
+        :return: numpy.ndarray
+                Leaf (node) index for each example and tree, of shape [n_examples, n_trees].
+        """
+        roots = self.roots if roots is None else roots
+        n_examples, n_feats = feats.shape
+        n_trees = roots.shape[0]
+        # (thresholds are double precision, so features are converted once instead of in every comparison)
+        flat_feats = np.ascontiguousarray(feats, dtype=np.float64).reshape(-1)
+        leaf_idx = np.empty((n_trees, n_examples), dtype=np.int64)
+
+        # examples are routed through blocks of trees (and examples) of at most `_BLOCK_PAIRS` (example, tree) pairs,
+        # so that arrays of a block stay in cache and nodes, visited by consecutive pairs, lie close together
+        block_rows = max(1, min(n_examples, _BLOCK_PAIRS))
+        block_trees = max(1, _BLOCK_PAIRS // block_rows)
+        for start_row in range(0, n_examples, block_rows):
+            end_row = min(start_row + block_rows, n_examples)
+            row_offsets = np.arange(start_row, end_row, dtype=np.int64) * n_feats
+            for start_tree in range(0, n_trees, block_trees):
+                end_tree = min(start_tree + block_trees, n_trees)
+                block_leaves = self._apply_block(flat_feats, roots[start_tree: end_tree], row_offsets)
+                leaf_idx[start_tree: end_tree, start_row: end_row] = block_leaves.reshape(end_tree - start_tree, -1)
+
+        return leaf_idx.T
+
+    def _apply_block(self, flat_feats, roots, row_offsets):
+        """ Routes examples (given by offsets of their rows in flattened features `flat_feats`) through trees with
+        roots `roots`, level by level. Returns leaf index of every (example, tree) pair - pair `p` is example
+        `p % n_examples` in tree `p // n_examples`. """
+        node_idx = np.repeat(roots, row_offsets.shape[0])
+        row_offsets = np.tile(row_offsets, roots.shape[0])
+        # positions of pairs that are still routed (None while all of them are)
+        active = None
+
+        idx_level = 0
+        while node_idx.shape[0] > 0:
+            go_right = np.less(flat_feats[row_offsets + self._first_attr[node_idx]], self._first_thresh[node_idx])
+            if not self._single_cond:
+                # X-of-N nodes with more conditions or split value other than 1 need the number of true conditions
+                counted = np.flatnonzero(self._needs_count[node_idx])
+                if counted.shape[0] > 0:
+                    counted_nodes = node_idx[counted]
+                    xon_vals = go_right[counted].astype(np.int64)
+
+                    # expand (pair, condition) pairs for remaining conditions of nodes that pairs are currently in
+                    n_extra = self._n_extra_conds[counted_nodes]
+                    cond_pair = np.repeat(np.arange(counted.shape[0]), n_extra)
+                    cond_idx = np.arange(cond_pair.shape[0]) - np.repeat(np.cumsum(n_extra) - n_extra, n_extra) + \
+                        np.repeat(self.attr_ptr[counted_nodes] + 1, n_extra)
+
+                    true_conds = np.less(flat_feats[row_offsets[counted][cond_pair] + self.attr_idx[cond_idx]],
+                                         self.thresh_val[cond_idx])
+                    xon_vals += np.bincount(cond_pair, weights=true_conds, minlength=counted.shape[0]).astype(np.int64)
+                    go_right[counted] = xon_vals >= self.split_val[counted_nodes]
+
+            node_idx = self._children[2 * node_idx + go_right]
+            idx_level += 1
+
+            if idx_level % _COMPACT_LEVELS == 0:
+                is_internal = self._children[2 * node_idx] != node_idx
+                n_internal = np.count_nonzero(is_internal)
+                if 2 * n_internal <= is_internal.shape[0]:
+                    # store leaves of all pairs that are routed so far and continue only with unfinished ones
+                    if active is None:
+                        leaf_idx, active = node_idx, np.flatnonzero(is_internal)
+                    else:
+                        leaf_idx[active] = node_idx
+                        active = active[is_internal]
+                    node_idx, row_offsets = node_idx[is_internal], row_offsets[is_internal]
+
+        if active is None:
+            leaf_idx = node_idx
+        return leaf_idx
+
+    def transform(self, feats, n_trees=None):
+        """ Equivalent of `CascadeLayer.transform(...)` - produces concatenated class vectors of all forests in the
+        layer for each example in `feats` (using only first `n_trees` trees of each forest if `n_trees` is not None,
+        see `truncation(...)`). """
+        n_examples = feats.shape[0]
+        class_vectors = np.empty((n_examples, self.n_forests * self.n_classes), dtype=self.dtype)
+        roots, forest_ptr, n_forest_trees = self.truncation(n_trees)
+
+        batch_size = max(1, _MAX_BATCH_ELEMS // (roots.shape[0] * self.n_classes))
+        for start in range(0, n_examples, batch_size):
+            end = min(start + batch_size, n_examples)
+            # (leaves of all examples in a tree are in a row, trees of a forest are consecutive)
+            leaf_idx = self.apply(feats[start: end], roots=roots).T
+            for idx_forest in range(self.n_forests):
+                first_tree = forest_ptr[idx_forest]
+                # average probabilities of trees of forest (summed tree by tree) - in double precision, same as the
+                # forests themselves, so that class vectors match the ones of the original layer
+                forest_vals = np.sum(self.leaf_vals[leaf_idx[first_tree: first_tree + n_forest_trees[idx_forest]]],
+                                     axis=0) / n_forest_trees[idx_forest]
+                class_vectors[start: end, idx_forest * self.n_classes: (idx_forest + 1) * self.n_classes] = forest_vals
+
+        return class_vectors
+
+
+class CompiledCascade:
+    def __init__(self, layers, ending_layer, exit_threshold=None, exit_criterion="confidence"):
+        """ Trained cascade forest with compiled layers (see CompiledLayer), used for prediction with saved models.
+
+        Parameters
+        ----------
+        :param layers: list
+                CompiledLayer objects, one for each layer of cascade forest.
+        :param ending_layer: EndingLayerAverage or CompiledStacking
+                Trained ending layer of cascade forest.
+        :param exit_threshold: float (default: None)
+                Confidence threshold for early exit of examples from cascade (see
+                `cascade_forest.predict_proba_early_exit(...)`). If None, all examples go through all layers.
+        :param exit_criterion: str (default: "confidence")
+                How confidence for early exit is computed (see `cascade_forest.exit_confidence(...)`).
+        """
+        self.layers = layers
+        self.ending_layer = ending_layer
+        self.exit_threshold = exit_threshold
+        self.exit_criterion = exit_criterion
+
+    @staticmethod
+    def from_cascade_forest(casc_forest, exit_threshold=None, exit_criterion="confidence"):
+        """ Compiles all layers (and stacking ending layer) of a trained CascadeForest. """
+        if len(casc_forest.layers) == 0:
+            raise Exception("There are no layers in CascadeForest!")
+
+        ending_layer = casc_forest.ending_layer
+        if isinstance(ending_layer, EndingLayerStacking):
+            ending_layer = CompiledStacking.from_ending_layer(ending_layer)
+
+        return CompiledCascade(layers=[CompiledLayer.from_layer(layer) for layer in casc_forest.layers],
+                               ending_layer=ending_layer,
+                               exit_threshold=exit_threshold,
+                               exit_criterion=exit_criterion)
+
+    def predict_proba(self, split_transformed_feats, n_trees=None):
+        """ Equivalent of `CascadeForest._pred_proba(...)`.
+
+        Parameters
+        ----------
+        :param split_transformed_feats: list
+                List, containing transformed features (numpy.ndarrays) for each grain (in MultiGrainedScanning) or
+                list, containing numpy.ndarray with raw features (if no grains are used).
+        :param n_trees: int or float (default: None)
+                If not None, only first `n_trees` trees (or fraction of trees) of each forest are used (see
+                `CompiledLayer.truncation(...)`).
+        :return: numpy.ndarray
+                Class probabilities for each instance.
+        """
+        if self.exit_threshold is not None:
+            return predict_proba_early_exit([lambda feats, layer=layer: layer.transform(feats, n_trees=n_trees)
+                                             for layer in self.layers], self.ending_layer,
+                                            split_transformed_feats, n_classes=self.layers[0].n_classes,
+                                            exit_threshold=self.exit_threshold, exit_criterion=self.exit_criterion,
+                                            dtype=self.layers[0].dtype)
+
+        inputs = CascadeInputBuffer(split_transformed_feats)
+        curr_input = split_transformed_feats[0]
+        for idx_layer in range(len(self.layers) - 1):
+            curr_input = inputs.layer_input(idx_layer, self.layers[idx_layer].transform(curr_input, n_trees=n_trees))
+
+        return self.ending_layer.predict_proba(self.layers[-1].transform(curr_input, n_trees=n_trees))
+
+class CompiledGrain:
+    def __init__(self, slice_idx, window_len, layer):
+        """ Trained grain of multi-grained scanning with compiled forests.
+
+        Parameters
+        ----------
+        :param slice_idx: numpy.ndarray
+                Indices of features, covered by sliding window, for each position of window (see
+                `Grain.slice_indices()`).
+        :param window_len: int
+                Number of features, covered by sliding window.
+        :param layer: CompiledLayer
+                Compiled forests of grain.
+        """
+        self.slice_idx = slice_idx
+        self.window_len = window_len
+        self.layer = layer
+
+    @staticmethod
+    def from_grain(grain):
+        return CompiledGrain(slice_idx=grain.slice_indices(),
+                             window_len=int(grain.wind_size[0] * grain.wind_size[1]),
+                             layer=CompiledLayer.from_layer(grain))
+
+    def transform(self, feats):
+        """ Equivalent of `Grain.transform(...)`. """
+        if feats.ndim == 1:
+            feats = np.expand_dims(feats, 0)
+
+        n_examples = feats.shape[0]
+        sliced_feats = feats[:, self.slice_idx].reshape([-1, self.window_len])
+        slice_vectors = self.layer.transform(sliced_feats)
+
+        # [example, slice, forest, class] -> class vectors of all slices of same example are consecutive for each forest
+        slice_vectors = slice_vectors.reshape([n_examples, -1, self.layer.n_forests, self.layer.n_classes])
+        return slice_vectors.transpose([0, 2, 1, 3]).reshape([n_examples, -1])
+
+
+class CompiledMultiGrainedScanning:
+    def __init__(self, grains):
+        """ Trained multi-grained scanning with compiled grains (see CompiledGrain). """
+        self.grains = grains
+
+    @staticmethod
+    def from_mg_scanning(mg_scan):
+        return CompiledMultiGrainedScanning(grains=[CompiledGrain.from_grain(grain) for grain in mg_scan.grains])
+
+    def transform_all_grains(self, feats):
+        """ Equivalent of `MultiGrainedScanning.transform_all_grains(...)`. """
+        return [grain.transform(feats) for grain in self.grains]
+
+
+class CompiledStacking:
+    def __init__(self, coef, intercept, model_classes, classes_, multinomial, dtype=np.float32):
+        """ Stacking ending layer with a trained logistic regression model, stored as its weights.
+
+        Parameters
+        ----------
+        :param coef: numpy.ndarray
+                Coefficients of logistic regression (`coef_`).
+        :param intercept: numpy.ndarray
+                Intercepts of logistic regression (`intercept_`).
+        :param model_classes: numpy.ndarray
+                Class indices that model was trained on (`classes_` of model).
+        :param classes_: numpy.ndarray
+                Mapping of classes to indices in probability vectors.
+        :param multinomial: bool
+                If True, probabilities are softmax of decision values, otherwise they are (normalized) one-vs-rest
+                probabilities.
+        :param dtype: numpy.dtype (default: np.float32)
+                Data type of predicted probabilities.
+        """
+        self.coef = coef
+        self.intercept = intercept
+        self.model_classes = model_classes
+        self.classes_ = classes_
+        self.multinomial = multinomial
+        self.dtype = dtype
+
+    @staticmethod
+    def from_ending_layer(ending_layer):
+        """ Converts trained EndingLayerStacking (only logistic regression stacking models are supported). """
+        model = ending_layer._stacking_model
+        if not hasattr(model, "coef_") or not hasattr(model, "predict_proba"):
+            raise NotImplementedError("Only logistic regression stacking models can be compiled!")
+
+        # probabilities of multiclass models are computed in the same way as in sklearn
+        multi_class = getattr(model, "multi_class", "auto")
+        is_ovr = model.classes_.shape[0] <= 2 or multi_class == "ovr" or \
+            (multi_class == "auto" and getattr(model, "solver", None) == "liblinear")
+
+        return CompiledStacking(coef=model.coef_,
+                                intercept=np.asarray(model.intercept_),
+                                model_classes=np.asarray(model.classes_, dtype=np.int64),
+                                classes_=ending_layer.classes_,
+                                multinomial=not is_ovr,
+                                dtype=ending_layer.dtype)
+
+    def predict_proba(self, feats):
+        """ Equivalent of `EndingLayerStacking.predict_proba(...)`. """
+        decision = np.dot(feats, self.coef.T) + self.intercept
+        if self.multinomial:
+            decision -= np.max(decision, axis=1, keepdims=True)
+            np.exp(decision, out=decision)
+            model_proba = decision / np.sum(decision, axis=1, keepdims=True)
+        else:
+            model_proba = 1.0 / (1.0 + np.exp(-decision))
+            if model_proba.shape[1] == 1:
+                model_proba = np.hstack((1 - model_proba, model_proba))
+            else:
+                proba_sum = np.sum(model_proba, axis=1, keepdims=True)
+                model_proba = np.divide(model_proba, proba_sum, out=np.full_like(model_proba, 1.0 / proba_sum.shape[1]),
+                                        where=proba_sum != 0)
+
+        proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=self.dtype)
+        proba_preds[:, self.model_classes] = model_proba
+
+        return proba_preds
+
+    def predict(self, feats):
+        return self.classes_[np.argmax(self.predict_proba(feats), axis=1)]
+
+
+def _save_arrays(dir_path, prefix, arrays):
+    for name, array in arrays.items():
+        np.save(os.path.join(dir_path, "%s.%s.npy" % (prefix, name)), np.ascontiguousarray(array), allow_pickle=False)
+
+
+def _load_arrays(dir_path, prefix, names, mmap_mode):
+    return {name: np.load(os.path.join(dir_path, "%s.%s.npy" % (prefix, name)), mmap_mode=mmap_mode,
+                          allow_pickle=False) for name in names}
+
+
+def _json_value(obj):
+    """ Converts numpy arrays and scalars in manifest to JSON values (used as `default` of `json.dump(...)`). """
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def save_compiled(dir_path, compiled_cascade, compiled_mg_scan, classes_, params=None):
+    """ Saves a compiled model into directory `dir_path` - every array is stored in its own .npy file and a JSON
+    manifest (written last) describes how they make up the model.
+
+    Parameters
+    ----------
+    :param dir_path: str
+            Directory to save the model into (created if it does not exist).
+    :param compiled_cascade: CompiledCascade
+            Compiled cascade forest.
+    :param compiled_mg_scan: CompiledMultiGrainedScanning
+            Compiled multi-grained scanning or None if it is not used.
+    :param classes_: numpy.ndarray
+            Mapping of classes to indices in probability vectors (needs to have a numeric or string data type).
+    :param params: dict (default: None)
+            Additional (JSON serializable) parameters of model, stored in manifest.
+    """
+    params = params if params is not None else {}
+    for name, value in params.items():
+        try:
+            json.dumps(value, default=_json_value)
+        except (TypeError, ValueError):
+            raise Exception("Parameter '%s' (%r) can not be saved, only JSON serializable parameters are supported!" %
+                            (name, value))
+
+    os.makedirs(dir_path, exist_ok=True)
+    dtype = compiled_cascade.layers[0].dtype
+    manifest = {"format": FORMAT_NAME,
+                "format_version": FORMAT_VERSION,
+                "dtype": np.dtype(dtype).name,
+                "params": params,
+                "grains": [],
+                "layers": [],
+                "early_exit": {"threshold": compiled_cascade.exit_threshold,
+                               "criterion": compiled_cascade.exit_criterion}}
+
+    np.save(os.path.join(dir_path, "classes.npy"), np.asarray(classes_), allow_pickle=False)
+
+    grains = compiled_mg_scan.grains if compiled_mg_scan is not None else []
+    for idx_grain, grain in enumerate(grains):
+        prefix = "grain_%d" % idx_grain
+        _save_arrays(dir_path, prefix, dict(grain.layer.arrays(), slice_idx=grain.slice_idx))
+        manifest["grains"].append({"prefix": prefix, "window_len": grain.window_len,
+                                   "n_classes": grain.layer.n_classes})
+
+    for idx_layer, layer in enumerate(compiled_cascade.layers):
+        prefix = "layer_%d" % idx_layer
+        _save_arrays(dir_path, prefix, layer.arrays())
+        manifest["layers"].append({"prefix": prefix, "n_classes": layer.n_classes})
+
+    ending_layer = compiled_cascade.ending_layer
+    if isinstance(ending_layer, EndingLayerAverage):
+        manifest["ending_layer"] = {"type": "avg"}
+    else:
+        _save_arrays(dir_path, "ending_layer", {"coef": ending_layer.coef, "intercept": ending_layer.intercept,
+                                                "model_classes": ending_layer.model_classes})
+        manifest["ending_layer"] = {"type": "stack", "prefix": "ending_layer", "multinomial": ending_layer.multinomial}
+
+    # manifest is written last (and atomically), so that a partially saved model can not be loaded
+    manifest_path = os.path.join(dir_path, _MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f_manifest:
+        json.dump(manifest, f_manifest, indent=2, default=_json_value)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _load_manifest(dir_path):
+    with open(os.path.join(dir_path, _MANIFEST_FILE)) as f_manifest:
+        manifest = json.load(f_manifest)
+
+    if manifest.get("format") != FORMAT_NAME or manifest.get("format_version") != FORMAT_VERSION:
+        raise Exception("Unsupported model format (%s, version %s), expected %s, version %d!" %
+                        (manifest.get("format"), manifest.get("format_version"), FORMAT_NAME, FORMAT_VERSION))
+
+    return manifest
+
+
+def load_classes(dir_path):
+    """ Loads only mapping of classes to indices in probability vectors of a model, saved with `save_compiled(...)`
+    (e.g. to prepare outputs for its predictions without loading the model). """
+    _load_manifest(dir_path)
+    return np.load(os.path.join(dir_path, "classes.npy"), allow_pickle=False)
+
+
+def load_compiled(dir_path, mmap_mode="r"):
+    """ Loads a model, saved with `save_compiled(...)`. Arrays are memory-mapped by default, so loading is fast and
+    processes that load the same model (or are forked after loading it) share its memory.
+
+    Parameters
+    ----------
+    :param dir_path: str
+            Directory with saved model.
+    :param mmap_mode: str (default: "r")
+            Memory-mapping mode for numpy.load(...). If None, arrays are read into memory.
+    :return: tuple
+            (compiled cascade forest, compiled multi-grained scanning (None if not used), classes_, params)
+    """
+    manifest = _load_manifest(dir_path)
+    dtype = np.dtype(manifest["dtype"]).type
+    classes_ = np.load(os.path.join(dir_path, "classes.npy"), allow_pickle=False)
+
+    def _load_layer(layer_info, extra_names=()):
+        arrays = _load_arrays(dir_path, layer_info["prefix"], _NODE_ARRAYS + _TRAVERSAL_ARRAYS + extra_names,
+                              mmap_mode)
+        layer = CompiledLayer(**{name: arrays[name] for name in _NODE_ARRAYS}, n_classes=layer_info["n_classes"],
+                              dtype=dtype, traversal_arrays={name: arrays[name] for name in _TRAVERSAL_ARRAYS})
+        return layer, arrays
+
+    grains = []
+    for grain_info in manifest["grains"]:
+        layer, arrays = _load_layer(grain_info, extra_names=("slice_idx",))
+        grains.append(CompiledGrain(slice_idx=arrays["slice_idx"], window_len=grain_info["window_len"], layer=layer))
+
+    layers = [_load_layer(layer_info)[0] for layer_info in manifest["layers"]]
+
+    ending_info = manifest["ending_layer"]
+    if ending_info["type"] == "avg":
+        ending_layer = EndingLayerAverage(classes_=classes_)
+    else:
+        arrays = _load_arrays(dir_path, ending_info["prefix"], ("coef", "intercept", "model_classes"), mmap_mode)
+        ending_layer = CompiledStacking(coef=arrays["coef"], intercept=arrays["intercept"],
+                                        model_classes=arrays["model_classes"], classes_=classes_,
+                                        multinomial=ending_info["multinomial"], dtype=dtype)
+
+    # (early exit settings are optional in manifest)
+    early_exit = manifest.get("early_exit", {})
+    compiled_cascade = CompiledCascade(layers=layers, ending_layer=ending_layer,
+                                       exit_threshold=early_exit.get("threshold"),
+                                       exit_criterion=early_exit.get("criterion", "confidence"))
+
+    compiled_mg_scan = CompiledMultiGrainedScanning(grains) if len(grains) > 0 else None
+    return compiled_cascade, compiled_mg_scan, classes_, manifest["params"]
@@ -1,7 +1,20 @@
+import copy
+import multiprocessing
+import multiprocessing.pool
 import numpy as np
+import os
+import time
+from sklearn.base import clone
 
+from gcforest import common_utils
+from gcforest.compiled import CompiledCascade, CompiledMultiGrainedScanning, save_compiled, load_compiled
 from gcforest.mg_scanning import Grain, MultiGrainedScanning
-from gcforest.cascade_forest import CascadeLayer, CascadeForest, EndingLayerAverage, EndingLayerStacking
+from gcforest.xofn import prediction_pool
+from gcforest.cascade_forest import CascadeLayer, CascadeForest, CascadeRouter, EndingLayerAverage, \
+    EndingLayerStacking, exit_confidence, calibrate_exit_threshold, truncated_n_trees, truncate_forest, forest_trees
+
+# file with original models in directory of a saved model (see `GrainedCascadeForest.save(...)`)
+_MODELS_FILE = "models.pkl"
 
 
 class GrainedCascadeForest:
@@ -88,6 +101,45 @@ class GrainedCascadeForest:
         Specifies whether labels provided to `fit(...)` (or similar methods) are already encoded as specified by
         `classes_`. **Should not be set to True without providing `classes_`**.
 
+    dtype: np.dtype, optional
+        Data type of features and class vectors throughout the model (inputs, multi-grained scanning outputs, class
+        vectors of cascade layers). Features are converted to it once, at the start of `fit(...)`, `fit_predict(...)`
+        and `predict_proba(...)`. Default is np.float32, which is also what tree models use internally.
+
+    cache_dir: str, optional
+        Directory for training checkpoints. If not None, `fit(...)` and `fit_predict(...)` save the results of every
+        completed stage (multi-grained scanning outputs, cascade layers with their class vectors and k-fold accuracies
+        and the state of cascade growth) into a subdirectory of `cache_dir`, determined by the model configuration
+        and training data. Rerunning training with the same configuration and data resumes from the last completed
+        stage. Checkpoints are kept after training and can be removed with `common_utils.remove_cache_dir(...)`.
+
+    early_exit_loss: float, optional
+        If not None, examples exit the cascade in `predict_proba(...)` after the first layer whose averaged class vector
+        is confident enough (and are not passed to deeper layers). Confidence threshold is calibrated at the end of
+        `fit(...)` on k-fold cross-validation class vectors of training data, as the lowest threshold for which
+        accuracy drops by at most `early_exit_loss` (e.g. 0.005 for half a percentage point). Can be recalibrated
+        after training with `calibrate_early_exit(...)`.
+
+    exit_criterion: str, optional
+        How confidence of averaged class vector is computed for early exit (and routing). Default setting is
+        "confidence" (highest probability), the other currently available option is "margin" (difference between two
+        highest probabilities).
+
+    routing_threshold: float, optional
+        If not None, training examples whose averaged k-fold cross-validation class vector of a layer reaches this
+        confidence are not passed to the next layer, so deeper layers are trained on a shrinking subset of examples.
+        The same rule is used in `predict_proba(...)` (the threshold replaces the one calibrated with
+        `early_exit_loss`) and for test examples in `fit_predict(...)`. Cascade growth is then determined by accuracy of
+        the whole cascade on all training examples instead of accuracy of the last layer. Training cost (number of
+        examples and time) and accuracy of each layer are reported at the end of training.
+
+    n_trees_predict: int or float, optional
+        If not None, only the first `n_trees_predict` trees (int) or fraction of trees (float in (0, 1], rounded up) of
+        each forest in cascade layers are used in `predict_proba(...)` and `predict(...)`, which trades accuracy for
+        lower latency without retraining (e.g. to shed compute under peak load). Can be changed at any time or
+        overridden with argument `n_trees` of these methods; `calibrate_n_trees(...)` picks the smallest value within a
+        tolerance of full accuracy on validation data.
+
     Notes
     -----
         Parameters `classes_` and `labels_encoded` will probably be removed from class parameters in the future as
@@ -113,7 +165,13 @@ class GrainedCascadeForest:
                  early_stop_iters=1,
                  classes_=None,
                  random_state=None,
-                 labels_encoded=False):
+                 labels_encoded=False,
+                 dtype=np.float32,
+                 cache_dir=None,
+                 early_exit_loss=None,
+                 exit_criterion="confidence",
+                 routing_threshold=None,
+                 n_trees_predict=None):
 
         # multi-grained scanning parameters
         self.n_rf_grain = n_rf_grain
@@ -139,17 +197,38 @@ class GrainedCascadeForest:
         self.k_cv = k_cv
         self.early_stop_iters = early_stop_iters
         self.classes_ = classes_
+        # (kept, so that checkpoints of training with different seeds are not mixed)
+        self.random_state = random_state
         if random_state is not None:
             np.random.seed(random_state)
         self.labels_encoded = labels_encoded
-
-        # TODO: implement caching and general saving to disk
-        self.cache_dir = "tmp/"
+        self.dtype = dtype
+        self.cache_dir = cache_dir
+        self.early_exit_loss = early_exit_loss
+        self.exit_criterion = exit_criterion
+        self.routing_threshold = routing_threshold
+        self.n_trees_predict = n_trees_predict
 
         # miscellaneous
         self._grains = []
         self._mgscan = None
         self._casc_forest = None
+        self._compiled = None
+        self._compiled_mgscan = None
+        # routing state (with inputs of cascade layers if `fit(..., keep_train_inputs=True)` was used) and class vectors
+        # of last layer for training data (used for warm start, early exit calibration and pruning)
+        self._train_router = None
+        self._train_class_vectors = None
+        # class vectors of all layers for training data (only kept together with inputs of cascade layers, used for
+        # pruning of forests that are not in the last layer)
+        self._train_layer_class_vectors = None
+        # training cost and accuracy of each layer
+        self._train_layer_stats = []
+        # confidences and predictions of layers for training data (k-fold cross-validation) and encoded labels, used
+        # to calibrate early exit
+        self._train_exit_stats = []
+        self._train_labels = None
+        self._exit_threshold = None
 
     def _assign_labels(self, labels_train):
         if self.classes_ is None:
@@ -162,6 +241,55 @@ class GrainedCascadeForest:
 
         return encoded_labels
 
+    def _checkpoint_dir(self, method_name, *arrays):
+        """ Creates (if needed) and returns the directory for checkpoints of `method_name`, determined by the model
+        configuration and data in `arrays`. Returns None if checkpointing is disabled. """
+        if self.cache_dir is None:
+            return None
+
+        # cache directory, early exit and inference settings do not affect training (exit criterion does only when
+        # examples are routed)
+        ignored = ("cache_dir", "early_exit_loss", "n_trees_predict") if self.routing_threshold is not None \
+            else ("cache_dir", "early_exit_loss", "n_trees_predict", "exit_criterion")
+        config = sorted((name, value) for name, value in vars(self).items()
+                        if not name.startswith("_") and name not in ignored)
+        ckpt_dir = os.path.join(self.cache_dir, "%s_%s" % (method_name, common_utils.data_fingerprint(config, *arrays)))
+        common_utils.create_cache_dir(ckpt_dir)
+
+        return ckpt_dir
+
+    @staticmethod
+    def _save_checkpoint(ckpt_dir, stage, **stage_data):
+        if ckpt_dir is None:
+            return
+
+        # state of random generator is saved so that resumed training continues as if it was never interrupted
+        stage_data["random_state"] = np.random.get_state()
+        # write to a temporary file first so that an interruption while saving does not leave a broken checkpoint
+        path = os.path.join(ckpt_dir, "%s.pkl" % stage)
+        common_utils.save_data(stage_data, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _load_checkpoint(ckpt_dir, stage):
+        if ckpt_dir is None or not os.path.exists(os.path.join(ckpt_dir, "%s.pkl" % stage)):
+            return None
+
+        stage_data = common_utils.load_data(os.path.join(ckpt_dir, "%s.pkl" % stage))
+        np.random.set_state(stage_data["random_state"])
+
+        return stage_data
+
+    @staticmethod
+    def _last_checkpoint(ckpt_dir, stage_format):
+        # index of last consecutive checkpoint of stage, formatted with `stage_format` (-1 if there is none)
+        idx_stage = -1
+        while ckpt_dir is not None and os.path.exists(os.path.join(ckpt_dir, "%s.pkl" % (stage_format %
+                                                                                            (idx_stage + 1)))):
+            idx_stage += 1
+
+        return idx_stage
+
     def _prepare_grains(self):
         # TODO: check if 'window_sizes' and 'strides' is a list/numpy.ndarray/int/tuple
         # ...
@@ -188,21 +316,50 @@ class GrainedCascadeForest:
                                k_cv=self.k_cv,
                                classes_=self.classes_,
                                random_state=None,
-                               labels_encoded=True)
+                               labels_encoded=True,
+                               dtype=self.dtype)
 
             self._grains.append(curr_grain)
 
-    def fit(self, feats, labels):
+    @prediction_pool()
+    def fit(self, feats, labels, warm_start=False, keep_train_inputs=False):
+        """ Trains multi-grained scanning and cascade forest (with as many layers as determined by k-fold
+        cross-validation accuracy).
+
+        If `warm_start` is True and the model is already trained, grains and layers are kept and cascade forest
+        continues to grow from its current depth (e.g. after increasing `early_stop_iters`), starting from the cached
+        input of the last layer. Only the new layers and the ending layer get trained. `feats` and `labels` must be
+        the same as in the previous call, which needs to be made with `keep_train_inputs=True` - otherwise inputs of
+        cascade layers (i.e. transformed training data) are not kept on the model after training. Kept inputs (and
+        k-fold cross-validation class vectors of all layers) also allow `prune(...)` to remove forests from all layers.
+        """
+        self._compiled, self._compiled_mgscan = None, None
+        if warm_start and self._casc_forest is not None:
+            return self._fit_warm_start(feats, labels, keep_train_inputs=keep_train_inputs)
+
         print("[fit(...)] TRAINING...")
         if not self.labels_encoded:
             labels = self._assign_labels(labels)
+        feats = np.asarray(feats, dtype=self.dtype)
+        ckpt_dir = self._checkpoint_dir("fit", feats, labels)
 
         self._prepare_grains()
-        mg_scan = MultiGrainedScanning(grains=self._grains) if len(self._grains) > 0 else None
+        ckpt = self._load_checkpoint(ckpt_dir, "grains")
+        if ckpt is not None:
+            print("[fit(...)] Loaded multi-grained scanning from checkpoint...")
+            mg_scan = ckpt["mg_scan"]
+            self._grains = mg_scan.grains if mg_scan is not None else []
+            transformed_feats = ckpt["transformed_feats"] if mg_scan is not None else [feats]
+        else:
+            mg_scan = MultiGrainedScanning(grains=self._grains) if len(self._grains) > 0 else None
+
+            # features that will be used in cascade forest - if multi-grained scanning was not requested,
+            # use only raw features
+            transformed_feats = mg_scan.train_all_grains(feats=feats, labels=labels) if mg_scan is not None \
+                else [feats]
+            self._save_checkpoint(ckpt_dir, "grains", mg_scan=mg_scan,
+                                  transformed_feats=transformed_feats if mg_scan is not None else None)
 
-        # features that will be used in cascade forest - if multi-grained scanning was not requested,
-        # use only raw features
-        transformed_feats = mg_scan.train_all_grains(feats=feats, labels=labels) if mg_scan is not None else [feats]
         print("[fit(...)] Multi-grained scanning shapes...")
         for feats in transformed_feats:
             print("[fit(...)] -> %s" % str(feats.shape))
@@ -211,12 +368,28 @@ class GrainedCascadeForest:
         idx_curr_layer = 0
         num_opt_layers = 0
 
-        # curr_input, curr_labels = train_transformed_X[0], train_transformed_y[0]
-        curr_input, curr_labels = transformed_feats[0], labels
+        # inputs of layers for examples that are still routed through cascade (base features of these examples get
+        # copied into input buffers once)
+        router = self._new_router(transformed_feats)
+        curr_input = router.first_input()
         # TODO: add options for switching models in last layer
-        cascade_forest = CascadeForest(classes_=self.classes_, ending_layer=self.end_layer_cascade, k_cv=self.k_cv)
+        cascade_forest = CascadeForest(classes_=self.classes_, ending_layer=self.end_layer_cascade, k_cv=self.k_cv,
+                                       dtype=self.dtype)
+
+        # resume growth of cascade from last checkpoint (layers are not kept in this pass, so only the growth state,
+        # routing state and class vectors of last layer are needed)
+        idx_curr_layer = max(self._last_checkpoint(ckpt_dir, "search_layer_%d"), 0)
+        ckpt = self._load_checkpoint(ckpt_dir, "search_layer_%d" % idx_curr_layer)
+        if ckpt is not None:
+            print("[fit(...)] Loaded cascade layer %d from checkpoint..." % idx_curr_layer)
+            prev_acc, num_opt_layers = ckpt["prev_acc"], ckpt["num_opt_layers"]
+            if ckpt.get("router_state") is not None:
+                router.load_state(ckpt["router_state"])
+            curr_input = router.route(idx_curr_layer, ckpt["class_vectors"])
+            idx_curr_layer += 1
 
-        while True:
+        # (if loaded layer was the last one, growth of cascade had already stopped)
+        while idx_curr_layer - num_opt_layers <= self.early_stop_iters and router.n_remaining >= self.k_cv:
             print("[fit(...)] Adding cascade layer %d..." % idx_curr_layer)
             cascade_forest.add_layer(CascadeLayer(n_rf=self.n_rf_cascade,
                                                   n_crf=self.n_crf_cascade,
@@ -229,14 +402,13 @@ class GrainedCascadeForest:
                                                   k_cv=self.k_cv,
                                                   classes_=self.classes_,
                                                   labels_encoded=True,
-                                                  keep_models=False))
+                                                  keep_models=False,
+                                                  dtype=self.dtype))
 
-            curr_feats = cascade_forest.train_next_layer(feats=curr_input, labels=curr_labels)
+            curr_feats = cascade_forest.train_next_layer(feats=curr_input, labels=labels[router.remaining])
 
             # k-fold cross-validation accuracy to determine optimal number of layers
-            curr_acc = cascade_forest.layers[-1].kfold_acc
-
-            curr_input = np.hstack((transformed_feats[idx_curr_layer % len(transformed_feats)], curr_feats))
+            curr_acc = self._growth_acc(self._layer_stats(cascade_forest.layers[-1], router, curr_feats, labels))
 
             if curr_acc <= prev_acc:
                 print("[fit(...)] Current accuracy <= previous accuracy... (%.5f <= %.5f)" %
@@ -246,62 +418,197 @@ class GrainedCascadeForest:
                 prev_acc = curr_acc
                 num_opt_layers = idx_curr_layer
 
+            self._save_checkpoint(ckpt_dir, "search_layer_%d" % idx_curr_layer, class_vectors=curr_feats,
+                                  kfold_acc=curr_acc, prev_acc=prev_acc, num_opt_layers=num_opt_layers,
+                                  router_state=router.state())
+
             # early stopping: if the accuracy (validation if early_stop_val=True or training if early_stop_val=False)
             # doesn't improve for early_stop_iters in a row, stop trying to grow cascade forest
             if idx_curr_layer - num_opt_layers == self.early_stop_iters:
                 print("[fit(...)] Accuracy has not increased for %d rounds in a row..." % self.early_stop_iters)
                 break
 
+            curr_input = router.route(idx_curr_layer, curr_feats)
             idx_curr_layer += 1
 
+        if router.n_remaining < self.k_cv:
+            print("[fit(...)] Only %d examples remain in cascade, stopping growth..." % router.n_remaining)
+
         print("[fit(...)] Number of optimal layers was determined to be %d..." % (num_opt_layers + 1))
         del cascade_forest
 
         self._mgscan = mg_scan
-        self._casc_forest = CascadeForest(classes_=self.classes_, ending_layer=self.end_layer_cascade, k_cv=self.k_cv)
+        self._casc_forest = CascadeForest(classes_=self.classes_, ending_layer=self.end_layer_cascade, k_cv=self.k_cv,
+                                          dtype=self.dtype)
 
         # retrain using entire data set
-        curr_input = transformed_feats[0]
+        router = self._new_router(transformed_feats)
+        curr_input = router.first_input()
+        self._train_exit_stats = []
+        self._train_layer_stats = []
+        layer_class_vectors = []
 
         # (num_opt_layers + 1) because num_opt_layers holds index of last useful layer (0-based)
         for idx_layer in range(num_opt_layers + 1):
-            print("[fit(...)] Retraining layer %d..." % idx_layer)
-            self._casc_forest.add_layer(CascadeLayer(n_rf=self.n_rf_cascade,
-                                                     n_crf=self.n_crf_cascade,
-                                                     n_rsf=self.n_rsf_cascade,
-                                                     n_xonf=self.n_xonf_cascade,
-                                                     n_estimators_rf=self.n_estimators_rf,
-                                                     n_estimators_crf=self.n_estimators_crf,
-                                                     n_estimators_rsf=self.n_estimators_rsf,
-                                                     n_estimators_xonf=self.n_estimators_xonf,
-                                                     k_cv=self.k_cv,
-                                                     classes_=self.classes_,
-                                                     labels_encoded=True))
-
-            curr_feats = self._casc_forest.train_next_layer(feats=curr_input, labels=labels)
-            print("[fit(...)] Concatenating features of layer %d with new feats..." % (idx_layer % len(transformed_feats)))
-            curr_input = np.hstack((transformed_feats[idx_layer % len(transformed_feats)], curr_feats))
-
-        self._casc_forest.ending_layer.fit(curr_input, labels)
+            if idx_layer > 0:
+                print("[fit(...)] Concatenating features of layer %d with new feats..." %
+                      ((idx_layer - 1) % len(transformed_feats)))
+                prev_router = router.copy()
+                curr_input = router.route(idx_layer - 1, curr_feats)
+
+                # (class vectors of retrained layers differ from the ones in search for optimal number of layers)
+                if router.n_remaining < self.k_cv:
+                    print("[fit(...)] Only %d examples remain in cascade, stopping at %d layers..." %
+                          (router.n_remaining, idx_layer))
+                    router = prev_router
+                    break
+
+            ckpt = self._load_checkpoint(ckpt_dir, "layer_%d" % idx_layer)
+            if ckpt is not None:
+                print("[fit(...)] Loaded retrained layer %d from checkpoint..." % idx_layer)
+                self._casc_forest.add_layer(ckpt["layer"], is_trained=True)
+                curr_feats, train_time = ckpt["class_vectors"], ckpt.get("train_time")
+            else:
+                print("[fit(...)] Retraining layer %d..." % idx_layer)
+                self._casc_forest.add_layer(self._new_layer())
+
+                start_time = time.time()
+                curr_feats = self._casc_forest.train_next_layer(feats=curr_input, labels=labels[router.remaining])
+                train_time = time.time() - start_time
+                self._save_checkpoint(ckpt_dir, "layer_%d" % idx_layer, layer=self._casc_forest.layers[-1],
+                                      class_vectors=curr_feats, kfold_acc=self._casc_forest.layers[-1].kfold_acc,
+                                      train_time=train_time)
+
+            layer_class_vectors.append(curr_feats)
+            self._train_exit_stats.append(self._exit_stats(curr_feats))
+            self._train_layer_stats.append(self._layer_stats(self._casc_forest.layers[-1], router, curr_feats, labels,
+                                                             train_time=train_time))
+
+        # ending layer combines class vectors of last layer (same as in `predict_proba(...)` and `fit_predict(...)`)
+        self._casc_forest.ending_layer.fit(curr_feats, labels[router.remaining])
+        if not keep_train_inputs:
+            router.release_inputs()
+        self._train_router = router
+        self._train_class_vectors = curr_feats
+        self._train_layer_class_vectors = layer_class_vectors if keep_train_inputs else None
+        self._train_labels = labels
+        self._print_layer_stats("fit")
+
+        self._exit_threshold = self.routing_threshold
+        if self.routing_threshold is None and self.early_exit_loss is not None:
+            self.calibrate_early_exit(self.early_exit_loss)
+
+        print("[fit(...)] Done training!\n")
+
+    def _fit_warm_start(self, feats, labels, keep_train_inputs=False):
+        print("[fit(...)] WARM START TRAINING...")
+        if self._train_router is None or self._train_router.inputs is None:
+            raise Exception("Warm start requires inputs of cascade layers, kept by previous call to "
+                            "fit(..., keep_train_inputs=True) (and forests not truncated by prune(...))!")
+        if not self.labels_encoded:
+            labels = self._assign_labels(labels)
+
+        if np.shape(feats)[0] != self._train_labels.shape[0]:
+            raise Exception("Warm start requires the same training data as the previous call to fit(...)!")
+
+        num_trained_layers = len(self._casc_forest.layers)
+        # last trained layer is the optimal one
+        prev_acc = self._growth_acc(self._train_layer_stats[-1])
+        num_opt_layers = num_trained_layers - 1
+        opt_feats = curr_feats = self._train_class_vectors
+        # routing state of cached training inputs is only replaced if cascade gets deeper
+        opt_router = self._train_router
+        router = opt_router.copy()
+        layer_class_vectors = list(self._train_layer_class_vectors) if self._train_layer_class_vectors is not None \
+            else None
+        idx_curr_layer = num_trained_layers
+
+        while True:
+            # input of new layer is formed in the same way as in `fit(...)`
+            curr_input = router.route(idx_curr_layer - 1, curr_feats)
+            if router.n_remaining < self.k_cv:
+                print("[fit(...)] Only %d examples remain in cascade, stopping growth..." % router.n_remaining)
+                break
+
+            print("[fit(...)] Adding cascade layer %d..." % idx_curr_layer)
+            self._casc_forest.add_layer(self._new_layer())
+
+            start_time = time.time()
+            curr_feats = self._casc_forest.train_next_layer(feats=curr_input, labels=labels[router.remaining])
+            train_time = time.time() - start_time
+
+            if layer_class_vectors is not None:
+                layer_class_vectors.append(curr_feats)
+            self._train_exit_stats.append(self._exit_stats(curr_feats))
+            self._train_layer_stats.append(self._layer_stats(self._casc_forest.layers[-1], router, curr_feats, labels,
+                                                             train_time=train_time))
+            curr_acc = self._growth_acc(self._train_layer_stats[-1])
+
+            if curr_acc <= prev_acc:
+                print("[fit(...)] Current accuracy <= previous accuracy... (%.5f <= %.5f)" %
+                      (curr_acc, prev_acc))
+            else:
+                print("[fit(...)] Current accuracy > previous accuracy... (%.5f > %.5f)" % (curr_acc, prev_acc))
+                prev_acc = curr_acc
+                num_opt_layers = idx_curr_layer
+                opt_feats = curr_feats
+                opt_router = router.copy()
+
+            if idx_curr_layer - num_opt_layers == self.early_stop_iters:
+                print("[fit(...)] Accuracy has not increased for %d rounds in a row..." % self.early_stop_iters)
+                break
+
+            idx_curr_layer += 1
+
+        # layers after the optimal one were trained only to check for improvement
+        while len(self._casc_forest.layers) > num_opt_layers + 1:
+            self._casc_forest.remove_last_layer()
+        del self._train_exit_stats[num_opt_layers + 1:]
+        del self._train_layer_stats[num_opt_layers + 1:]
+        print("[fit(...)] Number of optimal layers was determined to be %d..." % (num_opt_layers + 1))
+
+        if num_opt_layers + 1 > num_trained_layers:
+            self._casc_forest.ending_layer.fit(opt_feats, labels[opt_router.remaining])
+        if not keep_train_inputs:
+            opt_router.release_inputs()
+        self._train_router = opt_router
+        self._train_class_vectors = opt_feats
+        self._train_layer_class_vectors = layer_class_vectors[:num_opt_layers + 1] \
+            if keep_train_inputs and layer_class_vectors is not None else None
+        self._print_layer_stats("fit")
+
+        self._exit_threshold = self.routing_threshold
+        if self.routing_threshold is None and self.early_exit_loss is not None:
+            self.calibrate_early_exit(self.early_exit_loss)
 
         print("[fit(...)] Done training!\n")
 
     # simultaneously fit layers on training data and predict for new data (using trained layer)
     # done in an attempt to try to avoid having to save all models to disk and then re-loading them and predicting
+    @prediction_pool()
     def fit_predict(self, train_feats, train_labels, test_feats):
         if not self.labels_encoded:
             train_labels = self._assign_labels(train_labels)
+        train_feats = np.asarray(train_feats, dtype=self.dtype)
+        test_feats = np.asarray(test_feats, dtype=self.dtype)
+        ckpt_dir = self._checkpoint_dir("fit_predict", train_feats, train_labels, test_feats)
 
         self._prepare_grains()
         mg_scan = MultiGrainedScanning(grains=self._grains) if len(self._grains) > 0 else None
 
         # features that will be used in cascade forest - if multi-grained scanning was not requested,
         # use only raw features
-        if mg_scan is not None:
+        ckpt = self._load_checkpoint(ckpt_dir, "grains") if mg_scan is not None else None
+        if ckpt is not None:
+            print("[fit_predict(...)] Loaded multi-grained scanning outputs from checkpoint...")
+            train_transformed_feats, test_transformed_feats = ckpt["train_feats"], ckpt["test_feats"]
+        elif mg_scan is not None:
             print("[fit_predict(...)] Performing multi-grained scanning...")
             train_transformed_feats, test_transformed_feats = mg_scan.fit_transform_all_grains(train_feats=train_feats,
                                                                                                train_labels=train_labels,
                                                                                                test_feats=test_feats)
+            self._save_checkpoint(ckpt_dir, "grains", train_feats=train_transformed_feats,
+                                  test_feats=test_transformed_feats)
         else:
             print("[fit_predict(...)] Multi-grained scanning was not requested so defaulting to raw features...")
             train_transformed_feats, test_transformed_feats = [train_feats], [test_feats]
@@ -313,7 +620,7 @@ class GrainedCascadeForest:
         if self.end_layer_cascade == "avg":
             end_layer = EndingLayerAverage(classes_=self.classes_)
         elif self.end_layer_cascade == "stack":
-            end_layer = EndingLayerStacking(classes_=self.classes_, k_cv=self.k_cv)
+            end_layer = EndingLayerStacking(classes_=self.classes_, k_cv=self.k_cv, dtype=self.dtype)
         else:
             raise NotImplementedError("'ending_layer' must be one of {%s}" % ",".join(["avg", "stack"]))
 
@@ -321,10 +628,30 @@ class GrainedCascadeForest:
         idx_curr_layer = 0
         num_opt_layers = 0
 
-        curr_train_input, curr_train_labels = train_transformed_feats[0], train_labels
-        curr_test_input = test_transformed_feats[0]
+        # training and test examples are routed through cascade by the same rule
+        train_router = self._new_router(train_transformed_feats)
+        test_router = self._new_router(test_transformed_feats)
+        curr_train_input, curr_test_input = train_router.first_input(), test_router.first_input()
+        layer_stats = []
+
+        # resume growth of cascade from last checkpoint (layers are not kept, so only the growth state, routing state,
+        # predictions and class vectors of last layer are needed)
+        idx_curr_layer = max(self._last_checkpoint(ckpt_dir, "layer_%d"), 0)
+        ckpt = self._load_checkpoint(ckpt_dir, "layer_%d" % idx_curr_layer)
+        if ckpt is not None:
+            print("[fit_predict(...)] Loaded cascade layer %d from checkpoint..." % idx_curr_layer)
+            prev_acc, num_opt_layers, preds = ckpt["prev_acc"], ckpt["num_opt_layers"], ckpt["preds"]
+            if ckpt.get("train_router_state") is not None:
+                train_router.load_state(ckpt["train_router_state"])
+                test_router.load_state(ckpt["test_router_state"])
+            curr_train_input = train_router.route(idx_curr_layer, ckpt["train_class_vectors"])
+            curr_test_input = test_router.route(idx_curr_layer, ckpt["test_class_vectors"])
+            idx_curr_layer += 1
 
-        while True:
+        # (if loaded layer was the last one, growth of cascade had already stopped; once all test examples exit the
+        # cascade, deeper layers can not change their predictions)
+        while idx_curr_layer - num_opt_layers <= self.early_stop_iters and train_router.n_remaining >= self.k_cv \
+                and test_router.n_remaining > 0:
             curr_layer = CascadeLayer(n_rf=self.n_rf_cascade,
                                       n_crf=self.n_crf_cascade,
                                       n_rsf=self.n_rsf_cascade,
@@ -336,53 +663,610 @@ class GrainedCascadeForest:
                                       k_cv=self.k_cv,
                                       classes_=self.classes_,
                                       labels_encoded=True,
-                                      keep_models=False)
+                                      keep_models=False,
+                                      dtype=self.dtype)
 
+            curr_train_labels = train_labels[train_router.remaining]
+            start_time = time.time()
             curr_train_feats, curr_test_feats = curr_layer.fit_transform(train_feats=curr_train_input,
                                                                          train_labels=curr_train_labels,
                                                                          test_feats=curr_test_input)
+            layer_stats.append(self._layer_stats(curr_layer, train_router, curr_train_feats, train_labels,
+                                                 train_time=time.time() - start_time))
 
             # k-fold cross-validation accuracy to determine optimal number of layers
-            curr_acc = curr_layer.kfold_acc
-
-            curr_train_input = np.hstack((train_transformed_feats[idx_curr_layer % len(train_transformed_feats)],
-                                          curr_train_feats))
-            curr_test_input = np.hstack((test_transformed_feats[idx_curr_layer % len(test_transformed_feats)],
-                                         curr_test_feats))
+            curr_acc = self._growth_acc(layer_stats[-1])
 
             if curr_acc <= prev_acc:
                 print("[fit_predict(...)] Current accuracy <= previous accuracy... (%.5f <= %.5f)" %
                       (curr_acc, prev_acc))
             else:
                 print("[fit_predict(...)] Current accuracy > previous accuracy... (%.5f > %.5f)" % (curr_acc, prev_acc))
-                # act as if every layer with higher accuracy is the last layer
-                preds = end_layer.fit_predict(train_feats=curr_train_feats,
-                                              train_labels=curr_train_labels,
-                                              test_feats=curr_test_feats)
+                # act as if every layer with higher accuracy is the last layer (test examples that exited the cascade
+                # keep predictions of layer where they exited)
+                preds = self.classes_[np.argmax(test_router.exit_proba, axis=1)]
+                preds[test_router.remaining] = end_layer.fit_predict(train_feats=curr_train_feats,
+                                                                     train_labels=curr_train_labels,
+                                                                     test_feats=curr_test_feats)
 
                 prev_acc = curr_acc
                 num_opt_layers = idx_curr_layer
 
+            self._save_checkpoint(ckpt_dir, "layer_%d" % idx_curr_layer, train_class_vectors=curr_train_feats,
+                                  test_class_vectors=curr_test_feats, kfold_acc=curr_acc, prev_acc=prev_acc,
+                                  num_opt_layers=num_opt_layers, preds=preds,
+                                  train_router_state=train_router.state(), test_router_state=test_router.state())
+
             # early stopping: if the accuracy doesn't improve for 'early_stop_iters' in a row, finish the process
             if idx_curr_layer - num_opt_layers == self.early_stop_iters:
                 print("[fit_predict(...)] Accuracy has not increased for %d rounds in a row..." % self.early_stop_iters)
                 break
 
+            curr_train_input = train_router.route(idx_curr_layer, curr_train_feats)
+            curr_test_input = test_router.route(idx_curr_layer, curr_test_feats)
             idx_curr_layer += 1
 
+        self._print_layer_stats("fit_predict", layer_stats)
         return preds
 
-    def predict_proba(self, feats):
-        print("[predict_proba(...)] Predicting probabilities...")
+    def _new_layer(self):
+        return CascadeLayer(n_rf=self.n_rf_cascade,
+                            n_crf=self.n_crf_cascade,
+                            n_rsf=self.n_rsf_cascade,
+                            n_xonf=self.n_xonf_cascade,
+                            n_estimators_rf=self.n_estimators_rf,
+                            n_estimators_crf=self.n_estimators_crf,
+                            n_estimators_rsf=self.n_estimators_rsf,
+                            n_estimators_xonf=self.n_estimators_xonf,
+                            k_cv=self.k_cv,
+                            classes_=self.classes_,
+                            labels_encoded=True,
+                            dtype=self.dtype)
+
+    def _new_router(self, split_transformed_feats):
+        return CascadeRouter(split_transformed_feats, self.classes_.shape[0], threshold=self.routing_threshold,
+                             criterion=self.exit_criterion, dtype=self.dtype)
+
+    def _layer_stats(self, layer, router, class_vectors, labels, train_time=None):
+        """ Training cost and accuracy of a cascade layer - number of examples it was trained on, training time (in
+        seconds, None if unknown), k-fold cross-validation accuracy of layer on these examples and accuracy of the
+        whole cascade (if the layer was the last one) on all training examples, estimated from k-fold
+        cross-validation class vectors. """
+        return {"n_examples": router.n_remaining,
+                "train_time": train_time,
+                "kfold_acc": layer.kfold_acc,
+                "cascade_acc": np.mean(router.predictions(class_vectors) == labels)}
+
+    def _growth_acc(self, layer_stats):
+        """ Accuracy that determines growth of cascade. When examples are routed (see `routing_threshold`), layers are
+        trained on different subsets of examples, so accuracy of whole cascade is used instead of accuracy of layer.
+        """
+        return layer_stats["kfold_acc"] if self.routing_threshold is None else layer_stats["cascade_acc"]
+
+    def _print_layer_stats(self, method_name, layer_stats=None):
+        layer_stats = self._train_layer_stats if layer_stats is None else layer_stats
+        print("[%s(...)] Training cost and accuracy of layers..." % method_name)
+        for idx_layer, stats in enumerate(layer_stats):
+            train_time = "%.2f s" % stats["train_time"] if stats["train_time"] is not None else "unknown time"
+            print("[%s(...)] -> layer %d: %d examples, %s, layer accuracy %.5f, cascade accuracy %.5f" %
+                  (method_name, idx_layer, stats["n_examples"], train_time, stats["kfold_acc"], stats["cascade_acc"]))
+
+    def _exit_stats(self, class_vectors):
+        """ Confidence and predicted class index of averaged class vectors of a layer (see
+        `cascade_forest.exit_confidence(...)`). """
+        avg_proba, confidence = exit_confidence(class_vectors, self.classes_.shape[0], criterion=self.exit_criterion)
+        return confidence, np.argmax(avg_proba, axis=1)
+
+    def calibrate_early_exit(self, max_acc_loss):
+        """ Calibrates confidence threshold for early exit of examples from cascade in `predict_proba(...)` (see
+        `early_exit_loss`) on k-fold cross-validation class vectors of training data.
+
+        Parameters
+        ----------
+        max_acc_loss: float
+            Maximum allowed drop of accuracy on training data (k-fold cross-validation estimate). If None, early exit
+            is disabled.
+
+        Returns
+        -------
+        float
+            Calibrated threshold or None if early exit is disabled (also when there is only one layer or no
+            threshold satisfies `max_acc_loss`).
+        """
+        if self._casc_forest is None:
+            raise Exception("GrainedCascadeForest is not trained yet!")
+        if self.routing_threshold is not None:
+            raise Exception("Early exit threshold is determined by 'routing_threshold' when examples are routed!")
+        if self._train_class_vectors is None:
+            raise Exception("Early exit calibration requires k-fold cross-validation class vectors of training data, "
+                            "which are not kept by loaded models and models with forests truncated by prune(...)!")
+
+        self.early_exit_loss = max_acc_loss
+        self._exit_threshold = None
+        self._compiled = None
+        if max_acc_loss is None:
+            return None
+
+        final_preds = np.argmax(self._casc_forest.ending_layer.predict_proba(self._train_class_vectors), axis=1)
+        # last layer always passes its class vectors to ending layer
+        layer_stats = self._train_exit_stats[:-1]
+        self._exit_threshold = calibrate_exit_threshold(
+            np.array([confidence for confidence, _ in layer_stats]).reshape((len(layer_stats), -1)),
+            np.array([preds for _, preds in layer_stats]).reshape((len(layer_stats), -1)),
+            final_preds, self._train_labels, max_acc_loss)
+        print("[calibrate_early_exit(...)] Early exit threshold was determined to be %s..." % self._exit_threshold)
+        return self._exit_threshold
+
+    def compile(self):
+        """ Compiles trained cascade forest and multi-grained scanning into flat node arrays (see
+        `gcforest.compiled.CompiledCascade`), which get saved by `save(...)`. Models, loaded with `load(...)`, predict
+        with them - each layer (and grain) is evaluated in a single vectorized pass over all of its trees instead of
+        model by model. Trained models keep predicting with their original models, as sklearn's tree traversal is
+        faster for large batches of examples. Training the model again discards the compiled cascade.
+
+        Returns
+        -------
+        CompiledCascade
+            Compiled cascade forest
+        """
         if self._casc_forest is None:
             raise Exception("GrainedCascadeForest is not trained yet!")
 
-        transformed_feats = self._mgscan.transform_all_grains(feats=feats) if self._mgscan is not None else [feats]
-        print("[predict_proba(...)] Multi-grained scanning shapes...")
-        for feats in transformed_feats:
-            print("[predict_proba(...)] -> %s" % str(feats.shape))
+        self._compiled = CompiledCascade.from_cascade_forest(self._casc_forest, exit_threshold=self._exit_threshold,
+                                                             exit_criterion=self.exit_criterion)
+        self._compiled_mgscan = CompiledMultiGrainedScanning.from_mg_scanning(self._mgscan) \
+            if self._mgscan is not None else None
+        return self._compiled
+
+    def save(self, dir_path, include_models=False):
+        """ Saves trained model into directory `dir_path` in a compact format - node arrays of compiled model (see
+        `compile()`) in .npy files and a JSON manifest with model parameters. Unlike pickling, the model can then be
+        loaded in milliseconds with `GrainedCascadeForest.load(...)`.
+
+        Loaded model predicts with compiled model only. If `include_models` is True, original models of cascade forest
+        and multi-grained scanning are saved as well (pickled), so that they can be loaded with
+        `load(..., load_models=True)`.
+        """
+        if self._compiled is None:
+            self.compile()
+        if include_models and self._casc_forest is None:
+            raise Exception("Original models are not available (model was loaded without them)!")
+
+        models_path = os.path.join(dir_path, _MODELS_FILE)
+        if os.path.exists(models_path):
+            # (models of a model, previously saved into the same directory, do not match the new one)
+            os.remove(models_path)
+
+        # (random state is not saved, so that loading a model does not reseed the random generator)
+        params = {name: value for name, value in vars(self).items()
+                  if not name.startswith("_") and name not in ("classes_", "dtype", "random_state")}
+        save_compiled(dir_path, self._compiled, self._compiled_mgscan, classes_=self.classes_, params=params)
+
+        if include_models:
+            common_utils.save_data((self._casc_forest, self._mgscan), models_path + ".tmp")
+            os.replace(models_path + ".tmp", models_path)
+
+    @staticmethod
+    def load(dir_path, mmap_mode="r", load_models=False):
+        """ Loads model, saved with `save(...)`, for prediction. Node arrays are memory-mapped by default, so processes
+        that load the same model (or are forked after loading it) share their memory.
+
+        Parameters
+        ----------
+        dir_path: str
+            Directory with saved model.
+
+        mmap_mode: str, optional
+            Memory-mapping mode for numpy.load(...). If None, arrays are read into memory.
+
+        load_models: bool, optional
+            If True, original models (saved with `save(..., include_models=True)`) are loaded as well and used for
+            prediction instead of compiled model (faster for large batches, but every process holds its own copy).
+
+        Returns
+        -------
+        GrainedCascadeForest
+            Model that can be used for prediction (but not for warm start or pruning, as training data is not kept).
+        """
+        compiled_cascade, compiled_mg_scan, classes_, params = load_compiled(dir_path, mmap_mode=mmap_mode)
+
+        model = GrainedCascadeForest(**params, classes_=classes_, dtype=compiled_cascade.layers[0].dtype)
+        model._compiled, model._compiled_mgscan = compiled_cascade, compiled_mg_scan
+        model._exit_threshold = compiled_cascade.exit_threshold
+        if load_models:
+            models_path = os.path.join(dir_path, _MODELS_FILE)
+            if not os.path.exists(models_path):
+                raise Exception("Model in '%s' was saved without original models!" % dir_path)
+            model._casc_forest, model._mgscan = common_utils.load_data(models_path)
+        return model
+
+    @prediction_pool()
+    def predict_proba(self, feats, verbose=True, batch_size=None, n_jobs=1, out=None, n_trees=None):
+        """ Predicts class probabilities for `feats` (columns are ordered as in `classes_`). If `verbose` is False,
+        progress (e.g. shapes of multi-grained scanning outputs) is not printed, which is useful when serving the
+        model.
+
+        If `batch_size` is given, examples are streamed through grains and cascade layers in chunks of `batch_size`
+        rows, so memory needed for multi-grained scanning features and layer inputs stays bounded by the chunk size
+        instead of growing with number of examples. Chunks are scored concurrently by `n_jobs` threads (tree
+        traversal in sklearn and in the compiled model releases the GIL) and written into `out`, which can be a
+        preallocated (e.g. memory-mapped, see `numpy.lib.format.open_memmap`) array of shape
+        [`feats.shape[0]`, number of classes]. `feats` can be memory-mapped as well - only a chunk of rows at a time
+        is converted to `dtype`.
+
+        If `n_trees` is not None, it overrides `n_trees_predict` (number or fraction of first trees of each forest in
+        cascade layers that are used).
+        """
+        if self._casc_forest is None and self._compiled is None:
+            raise Exception("GrainedCascadeForest is not trained yet!")
+        n_trees = self.n_trees_predict if n_trees is None else n_trees
+
+        if batch_size is None and out is None:
+            return self._predict_proba_chunk(np.asarray(feats, dtype=self.dtype), verbose=verbose, n_trees=n_trees)
+
+        if not isinstance(feats, np.ndarray):
+            feats = np.asarray(feats, dtype=self.dtype)
+        n_examples = feats.shape[0]
+        batch_size = max(1, n_examples) if batch_size is None else batch_size
+        if batch_size < 1:
+            raise Exception("'batch_size' must be at least 1!")
+        n_jobs = max(1, n_jobs) if n_jobs != -1 else multiprocessing.cpu_count()
+        chunk_starts = list(range(0, n_examples, batch_size))
+        if verbose:
+            print("[predict_proba(...)] Predicting probabilities for %d examples in %d chunks (%d threads)..."
+                  % (n_examples, len(chunk_starts), n_jobs))
+
+        def predict_chunk(start):
+            chunk_feats = np.asarray(feats[start: start + batch_size], dtype=self.dtype)
+            out[start: start + chunk_feats.shape[0]] = self._predict_proba_chunk(chunk_feats, verbose=False,
+                                                                                 n_trees=n_trees)
+
+        n_classes = self.classes_.shape[0]
+        if out is None:
+            # (dtype of predictions is that of the non-chunked prediction)
+            first_preds = self._predict_proba_chunk(np.asarray(feats[:batch_size], dtype=self.dtype), verbose=False,
+                                                    n_trees=n_trees)
+            out = np.empty((n_examples, n_classes), dtype=first_preds.dtype)
+            out[:first_preds.shape[0]] = first_preds
+            chunk_starts = chunk_starts[1:]
+        elif out.shape != (n_examples, n_classes):
+            raise Exception("'out' must be of shape %s (got %s)!" % (str((n_examples, n_classes)), str(out.shape)))
+
+        if n_jobs == 1 or len(chunk_starts) <= 1:
+            for start in chunk_starts:
+                predict_chunk(start)
+        else:
+            with multiprocessing.pool.ThreadPool(processes=min(n_jobs, len(chunk_starts))) as pool:
+                # (iterate over results, so that exceptions in worker threads are raised here)
+                for _ in pool.imap_unordered(predict_chunk, chunk_starts):
+                    pass
+
+        return out
+
+    def _predict_proba_chunk(self, feats, verbose=True, n_trees=None):
+        if verbose:
+            print("[predict_proba(...)] Predicting probabilities...")
+
+        # (loaded models only have compiled forests)
+        use_compiled = self._casc_forest is None
+        mg_scan = self._compiled_mgscan if use_compiled else self._mgscan
+        transformed_feats = mg_scan.transform_all_grains(feats=feats) if mg_scan is not None else [feats]
+        if verbose:
+            print("[predict_proba(...)] Multi-grained scanning shapes...")
+            for feats in transformed_feats:
+                print("[predict_proba(...)] -> %s" % str(feats.shape))
+
+        if use_compiled:
+            return self._compiled.predict_proba(transformed_feats, n_trees=n_trees)
+
+        return self._casc_forest._pred_proba(transformed_feats, exit_threshold=self._exit_threshold,
+                                             exit_criterion=self.exit_criterion, verbose=verbose, n_trees=n_trees)
+
+    def predict(self, feats, batch_size=None, n_jobs=1, n_trees=None):
+        return self.classes_[np.argmax(self.predict_proba(feats=feats, batch_size=batch_size, n_jobs=n_jobs,
+                                                          n_trees=n_trees), axis=1)]
+
+    @prediction_pool()
+    def calibrate_n_trees(self, feats, labels, candidates=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75), max_acc_loss=0.01,
+                          n_repeats=3):
+        """ Measures accuracy-vs-latency trade-off of truncating forests of cascade layers to their first trees (see
+        `n_trees_predict`) on validation data and sets `n_trees_predict` to the cheapest candidate, whose accuracy
+        drops by at most `max_acc_loss` compared to using all trees.
+
+        Parameters
+        ----------
+        feats: np.array
+            Validation examples.
+
+        labels: np.array
+            Labels of validation examples (not encoded).
+
+        candidates: list or tuple, optional
+            Candidate values of `n_trees_predict` - numbers (int) or fractions (float) of first trees of each forest.
+            Using all trees is always evaluated as well.
+
+        max_acc_loss: float, optional
+            Maximum allowed drop of validation accuracy (e.g. 0.01 for 1 percentage point).
+
+        n_repeats: int, optional
+            Number of times that prediction is timed for each candidate (fastest time is reported).
+
+        Returns
+        -------
+        list
+            Accuracy-vs-latency curve - for each candidate (ordered by number of used trees, ending with None for all
+            trees), a dict with `n_trees`, number of used cascade trees (`n_cascade_trees`), `accuracy` and
+            `latency_us` (prediction time per example in microseconds).
+        """
+        if self._casc_forest is None and self._compiled is None:
+            raise Exception("GrainedCascadeForest is not trained yet!")
+        feats = np.asarray(feats, dtype=self.dtype)
+        labels = np.asarray(labels)
+
+        curve = []
+        for n_trees in list(candidates) + [None]:
+            times = []
+            for _ in range(n_repeats):
+                start_time = time.perf_counter()
+                proba_preds = self.predict_proba(feats, verbose=False, n_trees=n_trees)
+                times.append(time.perf_counter() - start_time)
+
+            curve.append({"n_trees": n_trees,
+                          "n_cascade_trees": self._n_cascade_trees(n_trees),
+                          "accuracy": float(np.mean(self.classes_[np.argmax(proba_preds, axis=1)] == labels)),
+                          "latency_us": 1e6 * min(times) / max(1, feats.shape[0])})
+        curve.sort(key=lambda point: (point["n_cascade_trees"], point["n_trees"] is None))
+
+        full_acc = curve[-1]["accuracy"]
+        # (using all trees is the last point of curve, so a point is always found for non-negative `max_acc_loss`)
+        self.n_trees_predict = next((point["n_trees"] for point in curve
+                                     if point["accuracy"] >= full_acc - max_acc_loss), None)
+
+        print("[calibrate_n_trees(...)] Accuracy and latency for number of used trees of each forest...")
+        for point in curve:
+            print("[calibrate_n_trees(...)] -> %s (%d cascade trees): accuracy %.5f, %.1f us/example" %
+                  (str(point["n_trees"]), point["n_cascade_trees"], point["accuracy"], point["latency_us"]))
+        print("[calibrate_n_trees(...)] 'n_trees_predict' was set to %s..." % str(self.n_trees_predict))
+
+        return curve
+
+    def _n_cascade_trees(self, n_trees):
+        """ Number of trees in cascade layers that are used for prediction with `n_trees` (see `n_trees_predict`). """
+        if self._compiled is not None:
+            return int(sum(np.sum(layer.truncation(n_trees)[2]) for layer in self._compiled.layers))
+
+        return sum(truncated_n_trees(len(forest_trees(forest)), n_trees)
+                   for layer in self._casc_forest.layers for forest in layer.forests())
+
+    @prediction_pool()
+    def prune(self, max_acc_loss=0.005, feats=None, labels=None, tree_fractions=(0.25, 0.5, 0.75)):
+        """ Post-training pruning of cascade, which makes the model smaller and faster:
+        - if inputs of cascade layers were kept (see `fit(..., keep_train_inputs=True)`), forests of all layers but the
+        last one are (one by one) removed as long as accuracy of the cascade on training data (estimated from k-fold
+        cross-validation class vectors of the last layer, combined by the ending layer) drops by at most
+        `max_acc_loss`; class vector slots of a removed forest are removed from the input of the next layer, so all
+        following layers (and the ending layer) are retrained on the new input layout in the same way as in
+        `fit(...)`, which makes this step as costly as retraining them once for each forest,
+        - whole forests are greedily removed from the last cascade layer as long as accuracy of the cascade on training
+        data drops by at most `max_acc_loss`; class vector slots of removed forests are removed from the layer output
+        (and stacking ending layer is refitted on the remaining ones),
+        - if validation data (`feats`, `labels`) is given, forests of all layers are then (one by one) truncated to
+        their first trees (smallest of `tree_fractions` of their trees) as long as validation accuracy drops by at most
+        `max_acc_loss` compared to the model before truncation.
+
+        Compiled model (see `compile()`) is discarded. Truncated forests no longer produce the k-fold cross-validation
+        class vectors of training data that were kept from training, so if any forest gets truncated, these are dropped
+        and warm start, early exit calibration and further pruning are not possible any more (early exit threshold is
+        kept - validation accuracy of the truncated model is measured with it).
+
+        Parameters
+        ----------
+        max_acc_loss: float, optional
+            Maximum allowed drop of accuracy (e.g. 0.005 for half a percentage point) for each of the steps.
+
+        feats: np.array, optional
+            Validation examples for truncation of forests. If None, forests are not truncated.
+
+        labels: np.array, optional
+            Labels of validation examples (not encoded).
+
+        tree_fractions: list or tuple, optional
+            Candidate fractions of trees of each forest, that are kept when truncating.
+
+        Returns
+        -------
+        dict
+            Number of forests and trees in cascade before and after pruning.
+        """
+        if self._casc_forest is None or self._train_class_vectors is None:
+            raise Exception("Pruning requires a trained GrainedCascadeForest with kept models (trained with fit(...)), "
+                            "whose forests were not truncated yet!")
+        self._compiled, self._compiled_mgscan = None, None
+
+        def cascade_size():
+            return {"n_forests": sum(len(layer.forests()) for layer in self._casc_forest.layers),
+                    "n_trees": self._n_cascade_trees(None)}
+
+        size = {"before": cascade_size()}
+        if self._train_layer_class_vectors is not None:
+            self._prune_inner_layers(max_acc_loss)
+        else:
+            print("[prune(...)] Inputs of cascade layers were not kept by fit(...), only forests of last layer can be "
+                  "removed...")
+        self._prune_last_layer(max_acc_loss)
+        if feats is not None:
+            self._prune_trees(feats, labels, max_acc_loss, tree_fractions)
+        size["after"] = cascade_size()
+
+        print("[prune(...)] Cascade was pruned from %d forests (%d trees) to %d forests (%d trees)..." %
+              (size["before"]["n_forests"], size["before"]["n_trees"], size["after"]["n_forests"],
+               size["after"]["n_trees"]))
+        return size
+
+    def _forest_cols(self, kept_forests):
+        """ Columns of class vector slots of `kept_forests` in output of a cascade layer. """
+        n_classes = self.classes_.shape[0]
+        return np.concatenate([np.arange(idx * n_classes, (idx + 1) * n_classes) for idx in kept_forests])
+
+    def _cascade_acc(self, router, class_vectors):
+        """ Accuracy of cascade on training data if the layer, that produced `class_vectors` (k-fold cross-validation
+        class vectors of examples that remain in `router`), was the last one (see `prune(...)`). """
+        ending_layer = self._casc_forest.ending_layer
+        if isinstance(ending_layer, EndingLayerStacking):
+            # (k-fold cross-validation predictions of a new stacking model, as stacking model was trained on other
+            # class vectors)
+            _, class_vectors, _ = common_utils.get_class_distribution(feats=class_vectors,
+                                                                      labels=self._train_labels[router.remaining],
+                                                                      model=clone(ending_layer._stacking_model),
+                                                                      num_all_classes=self.classes_.shape[0],
+                                                                      k_cv=self.k_cv, dtype=self.dtype)
+
+        return np.mean(router.predictions(class_vectors) == self._train_labels)
+
+    def _refit_following_layers(self, idx_layer, kept_forests):
+        """ Retrains cascade layers after layer `idx_layer` on inputs, in which class vectors of this layer only
+        contain slots of `kept_forests` (see `prune(...)`). The model is not modified - retrained layers, k-fold
+        cross-validation class vectors and stats of layers from `idx_layer` on and routing state of training data
+        after the last layer are returned. """
+        layer_class_vectors = self._train_layer_class_vectors
+        labels = self._train_labels
+        # examples are routed through previous layers again (up to the input of layer `idx_layer`)
+        router = self._train_router.restart()
+        for idx in range(idx_layer):
+            router.route(idx, layer_class_vectors[idx])
+
+        curr_feats = layer_class_vectors[idx_layer][:, self._forest_cols(kept_forests)]
+        layers, class_vectors = [], [curr_feats]
+        layer_stats = [self._layer_stats(self._casc_forest.layers[idx_layer], router, curr_feats, labels,
+                                         train_time=self._train_layer_stats[idx_layer]["train_time"])]
+
+        for idx in range(idx_layer + 1, len(self._casc_forest.layers)):
+            prev_router = router.copy()
+            curr_input = router.route(idx - 1, curr_feats)
+            # (examples can exit earlier than before, see `fit(...)`)
+            if router.n_remaining < self.k_cv:
+                router = prev_router
+                break
 
-        return self._casc_forest._pred_proba(transformed_feats)
+            layer = self._new_layer()
+            start_time = time.time()
+            curr_feats = layer.train_layer(curr_input, labels[router.remaining])
+            train_time = time.time() - start_time
+
+            layers.append(layer)
+            class_vectors.append(curr_feats)
+            layer_stats.append(self._layer_stats(layer, router, curr_feats, labels, train_time=train_time))
+
+        return layers, class_vectors, layer_stats, router
+
+    def _prune_inner_layers(self, max_acc_loss):
+        """ Removes forests from all cascade layers but the last one, one by one (see `prune(...)`). """
+        full_acc = self._cascade_acc(self._train_router, self._train_class_vectors)
+        print("[prune(...)] Accuracy of cascade before removing forests of inner layers is %.5f..." % full_acc)
+
+        idx_layer, n_removed = 0, 0
+        while idx_layer < len(self._casc_forest.layers) - 1:
+            layer = self._casc_forest.layers[idx_layer]
+            idx_forest = 0
+            while idx_forest < len(layer.forests()) and len(layer.forests()) > 1:
+                kept_forests = [idx for idx in range(len(layer.forests())) if idx != idx_forest]
+                layers, class_vectors, layer_stats, router = self._refit_following_layers(idx_layer, kept_forests)
+                curr_acc = self._cascade_acc(router, class_vectors[-1])
+                if curr_acc < full_acc - max_acc_loss:
+                    idx_forest += 1
+                    continue
+
+                print("[prune(...)] -> removing forest %d of layer %d and retraining following layers (accuracy "
+                      "%.5f)..." % (idx_forest, idx_layer, curr_acc))
+                layer.remove_forest(idx_forest)
+                n_removed += 1
+                while len(self._casc_forest.layers) > idx_layer + 1:
+                    self._casc_forest.remove_last_layer()
+                for new_layer in layers:
+                    self._casc_forest.add_layer(new_layer, is_trained=True)
+
+                self._train_layer_class_vectors = self._train_layer_class_vectors[:idx_layer] + class_vectors
+                self._train_layer_stats[idx_layer:] = layer_stats
+                self._train_exit_stats[idx_layer:] = [self._exit_stats(curr_feats) for curr_feats in class_vectors]
+                self._train_router, self._train_class_vectors = router, class_vectors[-1]
+                self._casc_forest.ending_layer.fit(self._train_class_vectors, self._train_labels[router.remaining])
+
+            idx_layer += 1
+
+        if n_removed > 0 and self.routing_threshold is None and self.early_exit_loss is not None:
+            self.calibrate_early_exit(self.early_exit_loss)
+
+    def _prune_last_layer(self, max_acc_loss):
+        """ Greedily removes forests from last cascade layer (see `prune(...)`). """
+        last_layer = self._casc_forest.layers[-1]
+        router, class_vectors = self._train_router, self._train_class_vectors
+        ending_layer = self._casc_forest.ending_layer
+        remaining_labels = self._train_labels[router.remaining]
+
+        def cascade_acc(kept_forests):
+            return self._cascade_acc(router, class_vectors[:, self._forest_cols(kept_forests)])
+
+        kept_forests = list(range(len(last_layer.forests())))
+        full_acc = cascade_acc(kept_forests)
+        print("[prune(...)] Accuracy of cascade with all forests of last layer is %.5f..." % full_acc)
+
+        while len(kept_forests) > 1:
+            # forest, whose removal decreases accuracy the least
+            best_acc, best_forest = max((cascade_acc([idx for idx in kept_forests if idx != idx_forest]), idx_forest)
+                                        for idx_forest in kept_forests)
+            if best_acc < full_acc - max_acc_loss:
+                break
+
+            print("[prune(...)] -> removing forest %d of last layer (accuracy %.5f)..." % (best_forest, best_acc))
+            kept_forests.remove(best_forest)
+
+        removed_forests = sorted(set(range(len(last_layer.forests()))) - set(kept_forests), reverse=True)
+        if len(removed_forests) == 0:
+            return
 
-    def predict(self, feats):
-        return self.classes_[np.argmax(self.predict_proba(feats=feats), axis=1)]
+        for idx_forest in removed_forests:
+            last_layer.remove_forest(idx_forest)
+        self._train_class_vectors = class_vectors[:, self._forest_cols(kept_forests)]
+        if self._train_layer_class_vectors is not None:
+            self._train_layer_class_vectors[-1] = self._train_class_vectors
+
+        ending_layer.fit(self._train_class_vectors, remaining_labels)
+        self._train_exit_stats[-1] = self._exit_stats(self._train_class_vectors)
+        self._train_layer_stats[-1]["cascade_acc"] = np.mean(router.predictions(self._train_class_vectors) ==
+                                                             self._train_labels)
+        if self.routing_threshold is None and self.early_exit_loss is not None:
+            self.calibrate_early_exit(self.early_exit_loss)
+
+    def _prune_trees(self, feats, labels, max_acc_loss, tree_fractions):
+        """ Truncates forests of all cascade layers to their first trees (see `prune(...)`). """
+        feats = np.asarray(feats, dtype=self.dtype)
+        labels = np.asarray(labels)
+
+        def val_acc():
+            return np.mean(self.classes_[np.argmax(self.predict_proba(feats, verbose=False), axis=1)] == labels)
+
+        full_acc = val_acc()
+        print("[prune(...)] Validation accuracy before truncating forests is %.5f..." % full_acc)
+
+        n_trees = self._n_cascade_trees(None)
+        for idx_layer, layer in enumerate(self._casc_forest.layers):
+            for idx_forest, forest in enumerate(layer.forests()):
+                for fraction in sorted(tree_fractions):
+                    truncated = copy.copy(forest)
+                    truncate_forest(truncated, float(fraction))
+                    if len(forest_trees(truncated)) == len(forest_trees(forest)):
+                        break
+
+                    layer.replace_forest(idx_forest, truncated)
+                    curr_acc = val_acc()
+                    if curr_acc >= full_acc - max_acc_loss:
+                        print("[prune(...)] -> truncating forest %d of layer %d to %d trees (accuracy %.5f)..." %
+                              (idx_forest, idx_layer, len(forest_trees(truncated)), curr_acc))
+                        break
+
+                    layer.replace_forest(idx_forest, forest)
+
+        if self._n_cascade_trees(None) < n_trees:
+            # (class vectors of truncated forests differ from the kept ones, see `prune(...)`)
+            self._train_router, self._train_class_vectors, self._train_exit_stats = None, None, []
+            self._train_layer_class_vectors = None
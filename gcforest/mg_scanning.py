@@ -155,7 +155,8 @@ class Grain:
                  k_cv=3,
                  classes_=None,
                  random_state=None,
-                 labels_encoded=False):
+                 labels_encoded=False,
+                 dtype=np.float32):
         """
         Parameters
         ----------
@@ -184,6 +185,8 @@ class Grain:
                 The random state for random number generator.
         :param labels_encoded: bool (default: False)
                 Will labels in training set already be encoded as stated in 'classes_'?
+        :param dtype: numpy.dtype (default: numpy.float32)
+                Data type of class vectors, produced by this grain.
         """
         self.wind_size = self._process(window_size)
         self.stride = self._process(stride)
@@ -201,6 +204,7 @@ class Grain:
         if random_state is not None:
             np.random.seed(random_state)
         self.labels_encoded = labels_encoded
+        self.dtype = dtype
 
         self.kfold_acc = None
 
@@ -234,6 +238,11 @@ class Grain:
         if len(features.shape) == 1:
             features = np.expand_dims(features, 0)
 
+        return features[:, self.slice_indices()].flatten().reshape([-1, self.wind_size[0] * self.wind_size[1]])
+
+    def slice_indices(self):
+        """ Computes indices of features in an (unrolled) example, covered by sliding window, for each position of
+        window (one position after another). """
         wind_single_row = np.arange(self.wind_size[1])
         wind_all_rows = np.tile(wind_single_row, (self.wind_size[0], 1))
 
@@ -250,7 +259,7 @@ class Grain:
         # create indices for when sliding window gets moved down by step self.stride[0] (for each of these movements)
         all_winds_single_example = all_winds_single_example + iters_rows * self.single_shape[1]
 
-        return features[:, all_winds_single_example].flatten().reshape([-1, self.wind_size[0] * self.wind_size[1]])
+        return all_winds_single_example.flatten()
 
     def create(self, features, labels):
         # -----------------------------------------------------------------------------------------------
@@ -282,7 +291,8 @@ class Grain:
                                                                                         model=crf_model,
                                                                                         num_all_classes=
                                                                                         self.classes_.shape[0],
-                                                                                        k_cv=self.k_cv)
+                                                                                        k_cv=self.k_cv,
+                                                                                        dtype=self.dtype)
 
             layer_acc += curr_acc
 
@@ -307,7 +317,8 @@ class Grain:
                                                                                        model=rf_model,
                                                                                        num_all_classes=
                                                                                        self.classes_.shape[0],
-                                                                                       k_cv=self.k_cv)
+                                                                                       k_cv=self.k_cv,
+                                                                                       dtype=self.dtype)
 
             layer_acc += curr_acc
 
@@ -333,7 +344,8 @@ class Grain:
                                                                                         model=rsf_model,
                                                                                         num_all_classes=
                                                                                         self.classes_.shape[0],
-                                                                                        k_cv=self.k_cv)
+                                                                                        k_cv=self.k_cv,
+                                                                                        dtype=self.dtype)
 
             layer_acc += curr_acc
             # combine predictions for slices of same example together
@@ -358,7 +370,8 @@ class Grain:
                                                                                          model=xonf_model,
                                                                                          num_all_classes=
                                                                                          self.classes_.shape[0],
-                                                                                         k_cv=self.k_cv)
+                                                                                         k_cv=self.k_cv,
+                                                                                         dtype=self.dtype)
 
             layer_acc += curr_acc
             # combine predictions for slices of same example together
@@ -414,10 +427,11 @@ class Grain:
                                                                                         labels=train_labels,
                                                                                         model=crf_model,
                                                                                         num_all_classes=self.classes_.shape[0],
-                                                                                        k_cv=self.k_cv)
+                                                                                        k_cv=self.k_cv,
+                                                                                        dtype=self.dtype)
 
             # predict
-            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = crf_model.classes_
             curr_test_feats[:, class_indices] = crf_model.predict_proba(sliced_test)
 
@@ -446,10 +460,11 @@ class Grain:
                                                                                        labels=train_labels,
                                                                                        model=rf_model,
                                                                                        num_all_classes=self.classes_.shape[0],
-                                                                                       k_cv=self.k_cv)
+                                                                                       k_cv=self.k_cv,
+                                                                                       dtype=self.dtype)
 
             # predict
-            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = rf_model.classes_
             curr_test_feats[:, class_indices] = rf_model.predict_proba(sliced_test)
 
@@ -483,10 +498,11 @@ class Grain:
                                                                                         labels=train_labels,
                                                                                         model=rsf_model,
                                                                                         num_all_classes=self.classes_.shape[0],
-                                                                                        k_cv=self.k_cv)
+                                                                                        k_cv=self.k_cv,
+                                                                                        dtype=self.dtype)
 
             # predict
-            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = rsf_model.classes_
             curr_test_feats[:, class_indices] = rsf_model.predict_proba(sliced_test)
 
@@ -521,10 +537,11 @@ class Grain:
                                                                                          model=xonf_model,
                                                                                          num_all_classes=
                                                                                          self.classes_.shape[0],
-                                                                                         k_cv=self.k_cv)
+                                                                                         k_cv=self.k_cv,
+                                                                                         dtype=self.dtype)
 
             # predict
-            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]))
+            curr_test_feats = np.zeros((sliced_test.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = xonf_model.classes_
             curr_test_feats[:, class_indices] = xonf_model.predict_proba(sliced_test)
 
@@ -566,7 +583,7 @@ class Grain:
         all_test = None
 
         for idx_crf in range(self.n_crf):
-            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.crf_estimators[idx_crf].classes_
             curr_proba_preds[:, class_indices] = self.crf_estimators[idx_crf].predict_proba(sliced_data)
 
@@ -578,7 +595,7 @@ class Grain:
             all_test = feats_crf
 
         for idx_rf in range(self.n_rf):
-            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.rf_estimators[idx_rf].classes_
             curr_proba_preds[:, class_indices] = self.rf_estimators[idx_rf].predict_proba(sliced_data)
 
@@ -590,9 +607,9 @@ class Grain:
             all_test = feats_rf if all_test is None else np.hstack((all_test, feats_rf))
 
         for idx_rsf in range(self.n_rsf):
-            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]))
-            class_indices = self.crf_estimators[idx_rsf].classes_
-            curr_proba_preds[:, class_indices] = self.crf_estimators[idx_rsf].predict_proba(sliced_data)
+            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]), dtype=self.dtype)
+            class_indices = self.rsf_estimators[idx_rsf].classes_
+            curr_proba_preds[:, class_indices] = self.rsf_estimators[idx_rsf].predict_proba(sliced_data)
 
             # combine predictions for slices of same example together
             feats_rsf.append(curr_proba_preds.reshape([-1, multiply_factor * self.classes_.shape[0]]))
@@ -602,7 +619,7 @@ class Grain:
             all_test = feats_rsf if all_test is None else np.hstack((all_test, feats_rsf))
 
         for idx_xonf in range(self.n_xonf):
-            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]))
+            curr_proba_preds = np.zeros((sliced_data.shape[0], self.classes_.shape[0]), dtype=self.dtype)
             class_indices = self.xonf_estimators[idx_xonf].classes_
             curr_proba_preds[:, class_indices] = self.xonf_estimators[idx_xonf].predict_proba(sliced_data)
 
@@ -0,0 +1,259 @@
+""" Batch scoring of large files with a trained GrainedCascadeForest (saved with `GrainedCascadeForest.save(...)`).
+
+Rows of input files are streamed through the model in batches, so memory stays bounded regardless of file size:
+`.npy` files are memory-mapped (workers read their batches directly from the mapped file), CSV files are parsed
+`batch_size` rows at a time. Batches are scored by `n_jobs` worker processes. Each of them loads the model with its
+node arrays memory-mapped and predicts with them at every batch size, so all workers share a single copy of the model
+(pickled original models, if saved, are not loaded). Main process only loads classes of the model. Predictions (class
+probabilities or labels) are written into the output file incrementally, in input order.
+
+Usage:
+    $ python -m gcforest.predict --model model_dir data.npy -o proba.npy
+    $ python -m gcforest.predict --model model_dir data.csv --header -o labels.csv --labels --n-jobs 4
+    $ python -m gcforest.predict --model model_dir part1.npy part2.csv -o out_dir --batch-size 50000
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+import warnings
+from collections import deque
+
+import numpy as np
+
+# (model and memory-mapped inputs of worker process)
+_worker_model = None
+_worker_inputs = {}
+
+
+def _init_worker(model_dir, mmap_mode):
+    global _worker_model
+    from gcforest.gc_forest import GrainedCascadeForest
+    _worker_model = GrainedCascadeForest.load(model_dir, mmap_mode=mmap_mode)
+    # (sklearn forests run on a single thread in worker processes, which is what is wanted here)
+    warnings.filterwarnings("ignore", message="Loky-backed parallel loops cannot be called in a multiprocessing")
+
+
+def _predict_batch(task):
+    """ Scores a batch in worker process - either (path of .npy file, start row, end row) or (start row, 2D
+    numpy.ndarray). """
+    if len(task) == 3:
+        path, start, end = task
+        if path not in _worker_inputs:
+            _worker_inputs[path] = np.load(path, mmap_mode="r")
+        feats = _worker_inputs[path][start: end]
+    else:
+        start, feats = task
+
+    return start, _worker_model.predict_proba(feats, verbose=False)
+
+
+def _imap_bounded(pool, tasks, max_pending):
+    """ Ordered equivalent of `pool.imap(_predict_batch, tasks)`, which takes a new task from `tasks` only when fewer
+    than `max_pending` results are waiting (Pool.imap consumes all tasks up front, i.e. would read whole CSV file). """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_predict_batch, (task,)))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+
+    while pending:
+        yield pending.popleft().get()
+
+
+def read_csv_batches(path, batch_size, delimiter=",", header=False):
+    """ Parses CSV file `path` (numeric values only) in batches of `batch_size` rows. Yields (start row, batch). """
+    with open(path) as f_input:
+        if header:
+            next(f_input, None)
+
+        start = 0
+        while True:
+            lines = [line for line in itertools.islice(f_input, batch_size) if line.strip()]
+            if not lines:
+                break
+
+            batch = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+            yield start, batch
+            start += batch.shape[0]
+
+
+def count_csv_rows(path, header=False):
+    with open(path) as f_input:
+        n_rows = sum(1 for line in f_input if line.strip())
+
+    return n_rows - 1 if header and n_rows > 0 else n_rows
+
+
+class _OutputWriter:
+    def __init__(self, path, n_rows, n_cols, dtype, classes_=None, delimiter=","):
+        """ Writes predictions into a .npy file (memory-mapped, preallocated for `n_rows` rows) or appends them to a
+        CSV file (with a header of class names for probabilities or "label" for labels). """
+        self.is_npy = path.endswith(".npy")
+        if self.is_npy:
+            shape = (n_rows, n_cols) if n_cols is not None else (n_rows,)
+            self._out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+        else:
+            self._out = open(path, "w")
+            self._delimiter = delimiter
+            header = delimiter.join(str(cls) for cls in classes_) if n_cols is not None else "label"
+            self._out.write(header + "\n")
+
+    def write(self, start, preds):
+        if self.is_npy:
+            self._out[start: start + preds.shape[0]] = preds
+        elif preds.ndim == 1:
+            self._out.writelines("%s\n" % label for label in preds)
+        else:
+            np.savetxt(self._out, preds, delimiter=self._delimiter, fmt="%.8g")
+
+    def close(self):
+        if self.is_npy:
+            self._out.flush()
+            del self._out
+        else:
+            self._out.close()
+
+
+def output_path(input_path, output, n_inputs, labels=False):
+    """ Output file for `input_path` - `output` itself for a single input file, otherwise a file in directory `output`
+    (named after input file, in the same format as input). """
+    if n_inputs == 1 and output is not None and not os.path.isdir(output):
+        return output
+
+    stem, ext = os.path.splitext(os.path.basename(input_path))
+    out_dir = output if output is not None else os.path.dirname(input_path)
+    return os.path.join(out_dir, "%s_%s%s" % (stem, "labels" if labels else "proba", ext))
+
+
+def score_file(input_path, out_path, classes_, model=None, batch_size=10000, pool=None, max_pending=4, labels=False,
+               delimiter=",", header=False, progress_interval=10.0):
+    """ Scores all rows of `input_path` (.npy or CSV) and writes predictions into `out_path` (.npy or CSV).
+
+    Parameters
+    ----------
+    :param input_path: str
+            Path of .npy (memory-mapped) or CSV file (parsed in batches) with one example per row.
+    :param out_path: str
+            Path of output file - predictions are written into a .npy file if it ends with '.npy', otherwise into CSV.
+    :param classes_: numpy.ndarray
+            Classes of model (in order of its class probabilities).
+    :param model: GrainedCascadeForest (default: None)
+            Trained (or loaded) model, used for scoring if `pool` is None.
+    :param batch_size: int (default: 10000)
+            Number of rows, scored together.
+    :param pool: multiprocessing.Pool (default: None)
+            Worker processes (initialized with `_init_worker`). If None, batches are scored in current process.
+    :param max_pending: int (default: 4)
+            Maximum number of batches, submitted to `pool` and not yet written (bounds memory for CSV inputs).
+    :param labels: bool (default: False)
+            Whether to write predicted labels instead of class probabilities.
+    :param delimiter: str (default: ",")
+            Delimiter of values in CSV files.
+    :param header: bool (default: False)
+            Whether first line of input CSV file is a header (and is skipped).
+    :param progress_interval: float (default: 10.0)
+            Interval (in seconds) of printing progress, 0 to disable.
+    :return: tuple
+            Number of scored rows and time taken (in seconds).
+    """
+    if pool is None and model is None:
+        raise Exception("Either 'model' or 'pool' must be given!")
+
+    start_time = time.perf_counter()
+    if input_path.endswith(".npy"):
+        inputs = np.load(input_path, mmap_mode="r")
+        n_rows = inputs.shape[0]
+        # (workers map the file themselves, so only row ranges are sent to them)
+        tasks = ((input_path, start, start + batch_size) if pool is not None else
+                 (start, inputs[start: start + batch_size]) for start in range(0, n_rows, batch_size))
+    else:
+        n_rows = count_csv_rows(input_path, header=header)
+        tasks = read_csv_batches(input_path, batch_size, delimiter=delimiter, header=header)
+
+    if pool is not None:
+        results = _imap_bounded(pool, tasks, max_pending)
+    else:
+        results = ((start, model.predict_proba(batch, verbose=False)) for start, batch in tasks)
+
+    # (created up front, so that an output file is written for inputs without rows as well)
+    writer = _OutputWriter(out_path, n_rows, None if labels else len(classes_),
+                           classes_.dtype if labels else np.float64, classes_=classes_, delimiter=delimiter)
+    n_done, last_report = 0, start_time
+    try:
+        for start, preds in results:
+            if labels:
+                preds = classes_[np.argmax(preds, axis=1)]
+
+            writer.write(start, preds)
+            n_done += preds.shape[0]
+
+            curr_time = time.perf_counter()
+            if progress_interval > 0 and curr_time - last_report >= progress_interval:
+                print("[predict] %s: %d/%d rows, %.1f rows/s" % (input_path, n_done, n_rows,
+                                                                 n_done / (curr_time - start_time)))
+                last_report = curr_time
+    finally:
+        writer.close()
+
+    return n_done, time.perf_counter() - start_time
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Score .npy or CSV files with a saved GrainedCascadeForest.")
+    parser.add_argument("inputs", nargs="+", help=".npy or CSV files with one example per row")
+    parser.add_argument("--model", required=True, help="directory with model, saved with GrainedCascadeForest.save(...)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="output file (.npy or CSV) for a single input file or output directory (default: "
+                             "'<input>_proba' or '<input>_labels' next to each input file)")
+    parser.add_argument("--labels", action="store_true", help="write predicted labels instead of class probabilities")
+    parser.add_argument("--batch-size", type=int, default=10000, help="number of rows, scored together")
+    parser.add_argument("--n-jobs", type=int, default=1, help="number of worker processes (-1 for all CPUs)")
+    parser.add_argument("--delimiter", default=",", help="delimiter of values in CSV files")
+    parser.add_argument("--header", action="store_true", help="first line of input CSV files is a header")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="interval (in seconds) of printing progress, 0 to disable")
+    args = parser.parse_args(args)
+
+    if args.batch_size < 1:
+        raise Exception("'--batch-size' must be at least 1!")
+    if len(args.inputs) > 1 and args.output is not None and not os.path.isdir(args.output):
+        raise Exception("'--output' must be an existing directory when scoring multiple files!")
+
+    from gcforest.compiled import load_classes
+    from gcforest.gc_forest import GrainedCascadeForest
+    n_jobs = max(1, args.n_jobs) if args.n_jobs != -1 else multiprocessing.cpu_count()
+
+    # (with worker processes, only they load the model)
+    model, pool = None, None
+    if n_jobs > 1:
+        classes_ = load_classes(args.model)
+        pool = multiprocessing.Pool(processes=n_jobs, initializer=_init_worker, initargs=(args.model, "r"))
+    else:
+        model = GrainedCascadeForest.load(args.model)
+        classes_ = model.classes_
+    total_rows, total_time = 0, 0.0
+    try:
+        for input_path in args.inputs:
+            out_path = output_path(input_path, args.output, len(args.inputs), labels=args.labels)
+            n_rows, time_taken = score_file(input_path, out_path, classes_, model=model, batch_size=args.batch_size,
+                                            pool=pool, max_pending=2 * n_jobs, labels=args.labels,
+                                            delimiter=args.delimiter, header=args.header,
+                                            progress_interval=args.progress_interval)
+            print("[predict] %s -> %s: %d rows in %.2f s (%.1f rows/s)" %
+                  (input_path, out_path, n_rows, time_taken, n_rows / max(time_taken, 1e-9)))
+            total_rows += n_rows
+            total_time += time_taken
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if len(args.inputs) > 1:
+        print("[predict] Total: %d rows in %.2f s (%.1f rows/s)" % (total_rows, total_time,
+                                                                    total_rows / max(total_time, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
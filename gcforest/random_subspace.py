@@ -157,7 +157,9 @@ class RandomSubspaceForest:
         if not self._is_fitted:
             raise Exception("RandomSubspaceForest is not fitted!")
 
-        proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=np.float32)
+        # probabilities are summed in double precision (as in sklearn forests), so that the result does not depend on
+        # the order of summation (e.g. in gcforest.compiled)
+        proba_preds = np.zeros((feats.shape[0], self.classes_.shape[0]), dtype=np.float64)
 
         for idx_tree in range(self.n_estimators):
             class_indices = self.estimators[idx_tree].classes_
@@ -167,7 +169,7 @@ class RandomSubspaceForest:
 
         proba_preds /= self.n_estimators
 
-        return proba_preds
+        return proba_preds.astype(np.float32)
 
     def predict(self, feats):
         return self.classes_[np.argmax(self.predict_proba(feats=feats), axis=1)]
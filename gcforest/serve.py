@@ -0,0 +1,340 @@
+""" Local prediction server for a trained GrainedCascadeForest (saved with `GrainedCascadeForest.save(...)`).
+
+Concurrent requests are collected into micro-batches (up to `max_batch_size` examples, waiting at most `max_wait_ms`
+after the first request of a batch), each of which is scored with a single call to `predict_proba(...)`.
+
+Protocol: newline-delimited JSON over a TCP or Unix socket. Each request is a JSON object on its own line, each
+response as well:
+    {"features": [[...], ...]}  ->  {"proba": [[...], ...]}   (a single example can also be sent as a flat list)
+    {"stats": true}             ->  {"stats": {...}}          (latency percentiles and batch size statistics)
+Errors are returned as {"error": "..."}.
+
+Usage:
+    $ python -m gcforest.serve --model model_dir --port 8765
+    $ python -m gcforest.serve --model model_dir --unix /tmp/gcforest.sock --max-batch-size 128 --max-wait-ms 2
+"""
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _Request:
+    def __init__(self, feats):
+        self.feats = feats
+        self.arrival_time = time.perf_counter()
+        self.future = Future()
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0, stats_window=100000):
+        """ Collects concurrently submitted examples into batches and scores each batch with a single call of
+        `predict_fn`. A batch is scored when it holds `max_batch_size` examples or `max_wait_ms` milliseconds after its
+        first request arrived, whichever comes first (a single request with more examples is scored on its own).
+
+        Parameters
+        ----------
+        :param predict_fn: callable
+                Function that maps a 2D numpy.ndarray of examples to a numpy.ndarray of predictions (one row for each
+                example), e.g. `GrainedCascadeForest.predict_proba`.
+        :param max_batch_size: int (default: 64)
+                Maximum number of examples in a batch.
+        :param max_wait_ms: float (default: 2.0)
+                Maximum time (in milliseconds) that the first request of a batch waits for other requests.
+        :param stats_window: int (default: 100000)
+                Number of most recent requests (and batches) that latency and batch size statistics are computed on.
+        """
+        if max_batch_size < 1:
+            raise Exception("'max_batch_size' must be at least 1!")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._latencies = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._stats_lock = threading.Lock()
+        self._n_requests, self._n_batches = 0, 0
+
+        self._worker = threading.Thread(target=self._run, name="gcforest-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, feats):
+        """ Submits examples (2D numpy.ndarray) for scoring and returns a concurrent.futures.Future, resolved with
+        their predictions. """
+        request = _Request(feats)
+        self._queue.put(request)
+        return request.future
+
+    def predict(self, feats):
+        """ Submits examples and waits for their predictions. """
+        return self.submit(feats).result()
+
+    def close(self):
+        """ Scores requests that were already submitted and stops the worker thread. """
+        self._queue.put(None)
+        self._worker.join()
+
+    def _run(self):
+        pending = None
+        closing = False
+
+        while not closing or pending is not None:
+            first = pending if pending is not None else self._queue.get()
+            pending = None
+            if first is None:
+                break
+
+            batch, n_examples = [first], first.feats.shape[0]
+            deadline = first.arrival_time + self.max_wait
+            while n_examples < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    closing = True
+                    break
+                # request that does not fit into batch starts the next one
+                if n_examples + request.feats.shape[0] > self.max_batch_size:
+                    pending = request
+                    break
+
+                batch.append(request)
+                n_examples += request.feats.shape[0]
+
+            self._process(batch, n_examples)
+
+    def _process(self, batch, n_examples):
+        try:
+            preds = self.predict_fn(np.vstack([request.feats for request in batch]))
+            offsets = np.cumsum([0] + [request.feats.shape[0] for request in batch])
+            results = [(preds[offsets[idx]: offsets[idx + 1]], None) for idx in range(len(batch))]
+        except Exception as batch_exc:
+            if len(batch) == 1:
+                results = [(None, batch_exc)]
+            else:
+                # score requests separately, so that an invalid request does not fail the whole batch
+                results = [self._predict_single(request) for request in batch]
+
+        done_time = time.perf_counter()
+        with self._stats_lock:
+            self._n_requests += len(batch)
+            self._n_batches += 1
+            self._batch_sizes.append(n_examples)
+            self._latencies.extend(done_time - request.arrival_time for request in batch)
+
+        for request, (preds, exc) in zip(batch, results):
+            if exc is not None:
+                request.future.set_exception(exc)
+            else:
+                request.future.set_result(preds)
+
+    def _predict_single(self, request):
+        try:
+            return self.predict_fn(request.feats), None
+        except Exception as exc:
+            return None, exc
+
+    def stats(self):
+        """ Returns latency percentiles (in milliseconds, from arrival of request to its predictions being ready) and
+        batch size statistics. """
+        with self._stats_lock:
+            latencies = np.array(self._latencies) * 1000.0
+            batch_sizes = np.array(self._batch_sizes)
+            n_requests, n_batches = self._n_requests, self._n_batches
+
+        stats = {"n_requests": n_requests, "n_batches": n_batches}
+        if latencies.shape[0] > 0:
+            for percentile in (50, 90, 99):
+                stats["latency_p%d_ms" % percentile] = float(np.percentile(latencies, percentile))
+            stats["latency_max_ms"] = float(np.max(latencies))
+            stats["batch_size_mean"] = float(np.mean(batch_sizes))
+            stats["batch_size_p50"] = float(np.percentile(batch_sizes, 50))
+            stats["batch_size_max"] = int(np.max(batch_sizes))
+
+        return stats
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            try:
+                response = self.server.handle_message(json.loads(line))
+            except Exception as exc:
+                response = {"error": "%s: %s" % (type(exc).__name__, exc)}
+
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class PredictionServer:
+    def __init__(self, model, address, max_batch_size=64, max_wait_ms=2.0):
+        """ Serves predictions of `model` on a local socket (see module docstring for protocol).
+
+        Parameters
+        ----------
+        :param model: GrainedCascadeForest
+                Trained (or loaded) model.
+        :param address: tuple or str
+                (host, port) for TCP socket (port 0 picks a free port) or path of Unix socket.
+        :param max_batch_size: int (default: 64)
+                Maximum number of examples, scored in a single batch (see MicroBatcher).
+        :param max_wait_ms: float (default: 2.0)
+                Maximum time (in milliseconds) that the first request of a batch waits for other requests.
+        """
+        self.model = model
+        self.batcher = MicroBatcher(lambda feats: model.predict_proba(feats, verbose=False),
+                                    max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            self._server = _UnixServer(address, _RequestHandler)
+        else:
+            self._server = _TCPServer(tuple(address), _RequestHandler)
+        self._server.handle_message = self.handle_message
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def handle_message(self, message):
+        if message.get("stats"):
+            return {"stats": self.batcher.stats()}
+
+        feats = np.asarray(message["features"], dtype=self.model.dtype)
+        if feats.ndim == 1:
+            feats = np.expand_dims(feats, 0)
+        if feats.ndim != 2:
+            raise Exception("'features' must be a single example or a list of examples!")
+
+        return {"proba": self.batcher.predict(feats).tolist()}
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """ Starts serving in a background thread. """
+        thread = threading.Thread(target=self.serve_forever, name="gcforest-server", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.batcher.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class PredictionClient:
+    def __init__(self, address, timeout=None):
+        """ Client for PredictionServer, keeping a single connection open.
+
+        Parameters
+        ----------
+        :param address: tuple or str
+                (host, port) of TCP socket or path of Unix socket.
+        :param timeout: float (default: None)
+                Socket timeout in seconds.
+        """
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(address if isinstance(address, str) else tuple(address))
+        self._file = self._sock.makefile("rwb")
+
+    def _request(self, message):
+        self._file.write((json.dumps(message) + "\n").encode("utf-8"))
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if "error" in response:
+            raise Exception("Server error: %s" % response["error"])
+
+        return response
+
+    def predict_proba(self, feats):
+        feats = np.asarray(feats)
+        return np.array(self._request({"features": feats.tolist()})["proba"])
+
+    def stats(self):
+        return self._request({"stats": True})["stats"]
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Serve predictions of a saved GrainedCascadeForest on a local socket.")
+    parser.add_argument("--model", required=True, help="directory with model, saved with GrainedCascadeForest.save(...)")
+    parser.add_argument("--host", default="127.0.0.1", help="host of TCP socket")
+    parser.add_argument("--port", type=int, default=8765, help="port of TCP socket")
+    parser.add_argument("--unix", default=None, help="path of Unix socket (used instead of TCP socket)")
+    parser.add_argument("--max-batch-size", type=int, default=64, help="maximum number of examples in a batch")
+    parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                        help="maximum time that the first request of a batch waits for other requests")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        help="interval (in seconds) of printing statistics, 0 to disable")
+    args = parser.parse_args(args)
+
+    from gcforest.gc_forest import GrainedCascadeForest
+    model = GrainedCascadeForest.load(args.model)
+
+    address = args.unix if args.unix is not None else (args.host, args.port)
+    server = PredictionServer(model, address, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    print("[serve] Serving model '%s' on %s..." % (args.model, server.address))
+
+    stop_event = threading.Event()
+    if args.stats_interval > 0:
+        def print_stats():
+            while not stop_event.wait(args.stats_interval):
+                print("[serve] %s" % json.dumps(server.batcher.stats()))
+
+        threading.Thread(target=print_stats, daemon=True).start()
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    # (stop gracefully on SIGTERM as well)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.shutdown()
+        print("[serve] Final statistics: %s" % json.dumps(server.batcher.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,27 @@
 import numpy as np
+import contextlib
 import multiprocessing
-
-from itertools import chain
+import multiprocessing.pool
+import os
+import shutil
+import tempfile
+import threading
+
+from itertools import chain, starmap
+
+# max. number of elements in a batch of X-of-N attribute values that gets evaluated at once in `search_xofn(...)`
+_MAX_BATCH_ELEMS = 2 ** 22
+# number of insertion candidates that make up a single task when candidates are evaluated in a thread pool
+_POOL_CHUNK_SIZE = 4
+# min. number of examples in a node for its X-of-N attribute to be constructed in a thread pool (see `XOfNTree`) - only
+# numpy kernels run without the GIL and they take ~27%, ~43% and ~58% of construction time in nodes with 1k, 5k and 16k
+# examples (letter data), while splitting work across threads costs ~10-15%, so smaller nodes do not gain anything
+_PARALLEL_MIN_SAMPLES = 16000
+# min. number of (example, tree) pairs for which `RandomXOfNForest.predict_proba(...)` uses worker processes - smaller
+# predictions take less time than sending examples to processes
+_PARALLEL_PREDICT_MIN_ELEMS = 100000
+# file name of test examples that are shared with worker processes in `RandomXOfNForest.predict_proba(...)`
+_PREDICT_FEATS_FILE = "feats.npy"
 
 
 class XOfNAttribute(object):
@@ -41,7 +61,7 @@ class XOfNAttribute(object):
                % (",".join([str(val) for val in zip(self.idx_attr, self.thresh_val)]), self.split_val)
 
 
-def _find_valid_values(feat_subset, target):
+def _find_valid_values(feat_subset, target, return_sort_idx=False, sort_idx=None):
     """ Narrows the search space of thresholds to be considered when finding the best one to split a data set. Returns
     threshold values from `feat_subset` that result in a class change (in `target`).
 
@@ -53,24 +73,142 @@ def _find_valid_values(feat_subset, target):
     target: np.array
         Labels corresponding to `feat_subset`
 
+    return_sort_idx: bool, optional
+        If True, also returns indices that sort `feat_subset` so that they can be passed on to
+        `_res_gini_numerical(...)` instead of sorting the same column again
+
+    sort_idx: np.array, optional
+        Precomputed indices that sort `feat_subset` (e.g. derived from a presorted data set). If None, `feat_subset`
+        gets sorted here
+
     Returns
     -------
-    np.array:
-        "valid" thresholds
+    np.array or (np.array, np.array):
+        "valid" thresholds (and indices that sort `feat_subset` if `return_sort_idx=True`)
     """
     if feat_subset.shape[0] < 2:
-        return feat_subset
+        return (feat_subset, np.arange(feat_subset.shape[0])) if return_sort_idx else feat_subset
 
-    sort_idx = np.argsort(feat_subset)
+    if sort_idx is None:
+        sort_idx = np.argsort(feat_subset)
     _feats = feat_subset[sort_idx]
     _target = target[sort_idx]
-    valid = [_feats[0]]
 
-    for i in range(1, _feats.shape[0]):
-        if _target[i] != _target[i - 1] and _feats[i] != valid[-1]:
-            valid.append(_feats[i])
+    # first value is always valid, other values are candidates if label changes at their position...
+    label_change = np.flatnonzero(_target[1:] != _target[:-1]) + 1
+    candidates = np.concatenate((_feats[:1], _feats[label_change]))
+    # ... and are valid if they differ from previous valid value (candidates are sorted, so comparing neighbours is enough)
+    value_change = np.concatenate(([True], candidates[1:] != candidates[:-1]))
+    valid = candidates[value_change]
+
+    return (valid, sort_idx) if return_sort_idx else valid
+
+
+def _find_bin_edges(feats, max_bins):
+    """ Finds (at most `max_bins - 1`) quantile-based bin edges for each column of `feats`. If a column has at most
+    `max_bins` different values, all of them (except the lowest one) are used as edges, so binning it is lossless.
+
+    Parameters
+    ----------
+    feats: np.array
+        2D array of examples
+
+    max_bins: int
+        Max. number of bins per column (at most 256, so that bin codes fit into np.uint8)
+
+    Returns
+    -------
+    list
+        Sorted bin edges (np.array) for each column of `feats`
+    """
+    if not 2 <= max_bins <= 256:
+        raise ValueError("Invalid 'max_bins' value encountered (%s)..." % str(max_bins))
+
+    bin_edges = []
+    for idx_col in range(feats.shape[1]):
+        uniq_vals = np.unique(feats[:, idx_col])
+        if uniq_vals.shape[0] <= max_bins:
+            bin_edges.append(uniq_vals[1:])
+        else:
+            sorted_col = np.sort(feats[:, idx_col])
+            # positions of quantiles in sorted column (edges are actual values of the column)
+            idx_quantiles = np.round(np.linspace(0, sorted_col.shape[0] - 1, max_bins + 1)[1: -1]).astype(np.int64)
+            curr_edges = np.unique(sorted_col[idx_quantiles])
+            bin_edges.append(curr_edges[curr_edges > uniq_vals[0]])
+
+    return bin_edges
+
 
-    return np.array(valid)
+def _presort_columns(feats):
+    """ Finds indices that (stably) sort each column of `feats`. Indices are stored as np.int32 if `feats` has less than
+    2 ** 31 rows and columns get sorted one at a time, so int64 indices of all columns are never held at once.
+
+    Parameters
+    ----------
+    feats: np.array
+        2D array of examples
+
+    Returns
+    -------
+    np.array
+        Array with same shape as `feats`, column `j` of which sorts `feats[:, j]`
+    """
+    sort_order = np.empty(feats.shape, dtype=np.int32 if feats.shape[0] < 2 ** 31 else np.int64)
+    for idx_col in range(feats.shape[1]):
+        sort_order[:, idx_col] = np.argsort(feats[:, idx_col], kind="stable")
+
+    return sort_order
+
+
+def _bin_feats(feats, bin_edges):
+    """ Converts `feats` into bin codes. Code of value `x` in column `j` is number of edges in `bin_edges[j]` that are
+    LTE `x`, so condition `code < c` is equivalent to condition `x < bin_edges[j][c - 1]` (for c >= 1).
+
+    Parameters
+    ----------
+    feats: np.array
+        2D array of examples
+
+    bin_edges: list
+        Sorted bin edges (np.array) for each column of `feats` (as returned by `_find_bin_edges(...)`)
+
+    Returns
+    -------
+    np.array
+        Bin codes (np.uint8) with same shape as `feats`
+    """
+    codes = np.empty(feats.shape, dtype=np.uint8)
+    for idx_col in range(feats.shape[1]):
+        codes[:, idx_col] = np.searchsorted(bin_edges[idx_col], feats[:, idx_col], side="right")
+
+    return codes
+
+
+def _encode_target(target):
+    """ Equivalent to `np.unique(target, return_inverse=True, return_counts=True)`, but avoids sorting `target` when
+    it contains (already encoded) non-negative integer labels.
+
+    Parameters
+    ----------
+    target: np.array
+        Labels
+
+    Returns
+    -------
+    (np.array, np.array, np.array):
+        Unique labels, indices of unique labels that reconstruct `target` and number of occurrences of each label
+    """
+    if target.dtype.kind not in "iu" or target.shape[0] == 0 or np.min(target) < 0:
+        return np.unique(target, return_inverse=True, return_counts=True)
+
+    label_counts = np.bincount(target)
+    uniq_classes = np.flatnonzero(label_counts)
+    if uniq_classes.shape[0] == label_counts.shape[0]:
+        return uniq_classes, target, label_counts
+
+    encoding = np.zeros(label_counts.shape[0], dtype=np.int64)
+    encoding[uniq_classes] = np.arange(uniq_classes.shape[0])
+    return uniq_classes, encoding[target], label_counts[uniq_classes]
 
 
 def _fib(n):
@@ -119,7 +257,32 @@ def _apply_attr(train_feats, valid_attrs, valid_thresh):
     return np.sum(np.less(train_feats[:, valid_attrs], valid_thresh), axis=1)
 
 
-def _eval_attr(curr_gini, best_gini, train_feats, attr_feats, attr_thresh, available_attrs):
+def _gather_columns(feats, rows, cols):
+    """ Returns values of column `cols` (int) or columns `cols` (list or np.array) of `feats` for examples `rows`.
+
+    Parameters
+    ----------
+    feats: np.array
+        2D array of examples
+
+    rows: np.array or None
+        Indices of examples. If None, values of all examples are returned
+
+    cols: int or list or np.array
+        Column index or indices
+
+    Returns
+    -------
+    np.array
+        1D array of values (if `cols` is int) or 2D array with a column for each index in `cols`
+    """
+    if rows is None:
+        return feats[:, cols]
+
+    return feats[rows, cols] if np.ndim(cols) == 0 else feats[np.ix_(rows, cols)]
+
+
+def _eval_attr(curr_gini, best_gini, train_feats, attr_feats, attr_thresh, available_attrs, attr_n_vals=None):
     """Evaluates if newly constructed X-of-N attribute achieves lower Gini index value than `best_gini`
     and returns attribute complexity in this case. Otherwise returns None
 
@@ -147,13 +310,18 @@ def _eval_attr(curr_gini, best_gini, train_feats, attr_feats, attr_thresh, avail
         all available features (`np.arange(train_feats.shape[1])`), but can also be a subset of that (e.g.
         a random sample of features when constructing random forests)
 
+    attr_n_vals: np.array, optional
+        Number of different values of each attribute in `train_feats` (value at index `i` belongs to attribute `i`).
+        If None, gets computed from `train_feats` when needed
+
     Returns
     -------
     float or None
         Complexity of new attribute if new attribute is "better" or None if it is not
     """
     if curr_gini < best_gini:
-        curr_compl = _calc_attr_cost(train_feats, attr_feats, attr_thresh, available_attrs=available_attrs)
+        curr_compl = _calc_attr_cost(train_feats, attr_feats, attr_thresh, available_attrs=available_attrs,
+                                     attr_n_vals=attr_n_vals)
         return curr_compl
     # elif np.isclose(curr_gini, best_gini):
     #     curr_compl = _calc_attr_cost(train_feats, attr_feats, attr_thresh, available_attrs=available_attrs)
@@ -162,7 +330,7 @@ def _eval_attr(curr_gini, best_gini, train_feats, attr_feats, attr_thresh, avail
     #     return curr_compl
 
 
-def _calc_attr_cost(train_feats, idx_attr, thresh_val, available_attrs):
+def _calc_attr_cost(train_feats, idx_attr, thresh_val, available_attrs, attr_n_vals=None):
     """ Calculate new X-of-N attribute's complexity (equation 1 and 2 in paper on X-of-N trees [1]).
 
     Parameters
@@ -183,6 +351,10 @@ def _calc_attr_cost(train_feats, idx_attr, thresh_val, available_attrs):
         all available features (`np.arange(train_feats.shape[1])`), but can also be a subset of that (e.g.
         a random sample of features when constructing random forests)
 
+    attr_n_vals: np.array, optional
+        Number of different values of each attribute in `train_feats` (value at index `i` belongs to attribute `i`).
+        If None, gets computed from `train_feats`
+
     Returns
     -------
     float
@@ -203,7 +375,8 @@ def _calc_attr_cost(train_feats, idx_attr, thresh_val, available_attrs):
     # Na... number of primitive attrs. available for creating X-of-N attribute
     n_all_attrs = available_attrs.shape[0]
     # Nvj... number of different values of attribute j
-    n_vals = np.array([np.unique(train_feats[:, i]).shape[0] for i in unique_attrs_xon])
+    n_vals = np.array([np.unique(train_feats[:, i]).shape[0] for i in unique_attrs_xon]) if attr_n_vals is None else \
+        attr_n_vals[unique_attrs_xon]
     # nj... number of different values of attribute j that appear in X-of-N attribute
     n_unique_vals = np.array([np.unique(np.compress(np.equal(idx_attr, i), thresh_val)).shape[0]
                               for i in unique_attrs_xon])
@@ -233,7 +406,7 @@ def _gini(class_dist, num_el):
     return 1 - np.sum(np.square(np.divide(class_dist, num_el)))
 
 
-def _res_gini_numerical(feat, target, sorted_thresholds=None):
+def _res_gini_numerical(feat, target, sorted_thresholds=None, sort_indices=None, sample_weight=None):
     """ Finds lowest Gini index value and the threshold that produced it.
 
     Parameters
@@ -247,6 +420,12 @@ def _res_gini_numerical(feat, target, sorted_thresholds=None):
     sorted_thresholds: np.array, optional
         Thresholds to be checked, need to be sorted. If None, thresholds are automatically determined from `feat`
 
+    sort_indices: np.array, optional
+        Indices that sort `feat` (e.g. obtained from `_find_valid_values(...)`). If None, `feat` gets sorted here
+
+    sample_weight: np.array, optional
+        Non-negative integer weights of examples (e.g. bootstrap multiplicities). If None, each example has weight 1
+
     Returns
     -------
     (float, int):
@@ -258,55 +437,208 @@ def _res_gini_numerical(feat, target, sorted_thresholds=None):
         Assumption: works only for numerical feature values.
     """
     # how examples are distributed among classes prior to checking splits
-    uniq_classes, target, class_dist = np.unique(target, return_counts=True, return_inverse=True)
+    uniq_classes, target, class_dist = _encode_target(target)
+    if sample_weight is not None:
+        class_dist = np.bincount(target, weights=sample_weight).astype(np.int64)
 
     if uniq_classes.shape[0] == 1:
         # pure subset
         return 0.0, 0
 
     if sorted_thresholds is None:
-        sorted_thresholds = _find_valid_values(feat, target)
+        sorted_thresholds, sort_indices = _find_valid_values(feat, target, return_sort_idx=True)
 
     # sort examples (and corresponding labels) by attribute values (i.e. by thresholds)
-    sort_indices = np.argsort(feat)
+    if sort_indices is None:
+        sort_indices = np.argsort(feat)
     sorted_feat, sorted_target = feat[sort_indices], target[sort_indices]
+    num_examples = np.sum(class_dist)
+
+    # `cum_dist[j]` holds the class distribution of the first `j` sorted examples, so the distribution of elements
+    # LT threshold `t` is `cum_dist[number of examples LT t]` (first threshold is skipped as it produces empty left side)
+    sorted_dist = np.eye(class_dist.shape[0], dtype=np.int64)[sorted_target]
+    if sample_weight is not None:
+        sorted_dist *= sample_weight[sort_indices, np.newaxis]
+    cum_dist = np.zeros((sorted_feat.shape[0] + 1, class_dist.shape[0]), dtype=np.int64)
+    np.cumsum(sorted_dist, axis=0, out=cum_dist[1:])
+
+    left = cum_dist[np.searchsorted(sorted_feat, sorted_thresholds[1:], side="left")]
+    right = class_dist - left
+    left_counts = np.sum(left, axis=1)
+    right_counts = num_examples - left_counts
+
+    # calculate gini for all thresholds at once (empty sides produce NaN, which never gets selected)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        left_prob = left_counts / num_examples
+        left_gini = 1 - np.sum(np.square(np.divide(left, left_counts[:, np.newaxis])), axis=1)
+        right_gini = 1 - np.sum(np.square(np.divide(right, right_counts[:, np.newaxis])), axis=1)
+        gini_res = left_prob * left_gini + (1 - left_prob) * right_gini
+    gini_res[np.isnan(gini_res)] = np.inf
+
+    clean_thresh = np.flatnonzero(gini_res < 10e-6)
+    if clean_thresh.shape[0] > 0:
+        # clean subset - first threshold that produces it is taken
+        return gini_res[clean_thresh[0]], clean_thresh[0] + 1
 
-    idx_thresh, idx_example = 1, 0
-    num_examples = sorted_feat.shape[0]
     best_gini, idx_best_thresh = 1, 0
+    if gini_res.shape[0] > 0:
+        idx_min = np.argmin(gini_res)
+        if gini_res[idx_min] < best_gini:
+            best_gini, idx_best_thresh = gini_res[idx_min], idx_min + 1
 
-    # distribution of elements LT/GTE current threshold
-    left, left_count = np.zeros_like(class_dist), 0
-    right, right_count = np.copy(class_dist), num_examples
+    return best_gini, idx_best_thresh
 
-    while idx_thresh < sorted_thresholds.shape[0]:
-        if sorted_feat[idx_example] < sorted_thresholds[idx_thresh]:
-            left[sorted_target[idx_example]] += 1
-            right[sorted_target[idx_example]] -= 1
 
-            left_count += 1
-            right_count -= 1
-            idx_example += 1
-        else:
-            left_prob = (left_count / num_examples)
+def _res_gini_xon_batch(xon_vals, target, sample_weight=None):
+    """ Finds lowest Gini index value and the split point that produced it for multiple X-of-N attributes at once.
+    Equivalent to calling `_res_gini_numerical(row, target, np.unique(row))` for each row of `xon_vals`, but uses
+    class histograms of (small, non-negative) X-of-N values instead of sorting each row.
 
-            # calculate gini for curr threshold
-            curr_gini_res = left_prob * _gini(left, left_count) + (1 - left_prob) * _gini(right, right_count)
+    Parameters
+    ----------
+    xon_vals: np.array
+        2D array, where each row contains results of applying an X-of-N attribute to a data set (i.e. number of true
+        conditions for each example)
 
-            if curr_gini_res < 10e-6:
-                # clean subset
-                best_gini, idx_best_thresh = curr_gini_res, idx_thresh
-                break
+    target: np.array
+        Labels, corresponding to columns of `xon_vals`
+
+    sample_weight: np.array, optional
+        Non-negative integer weights of examples (e.g. bootstrap multiplicities). If None, each example has weight 1
 
-            if curr_gini_res < best_gini:
-                best_gini, idx_best_thresh = curr_gini_res, idx_thresh
+    Returns
+    -------
+    (np.array, np.array):
+        Best Gini index value found and split value that produced it (value from corresponding row of `xon_vals`)
+        for each row of `xon_vals`
+    """
+    uniq_classes, target, _ = _encode_target(target)
+    n_rows = xon_vals.shape[0]
+    n_classes = uniq_classes.shape[0]
+
+    if n_classes == 1:
+        # pure subset
+        return np.zeros(n_rows), np.min(xon_vals, axis=1)
+
+    # `hist[r, v, c]`... number of examples of class `c` for which X-of-N attribute in row `r` has value `v`
+    n_vals = int(np.max(xon_vals)) + 1
+    flat_idx = (np.arange(n_rows)[:, np.newaxis] * n_vals + xon_vals) * n_classes + target
+    if sample_weight is None:
+        hist = np.bincount(flat_idx.ravel(), minlength=n_rows * n_vals * n_classes)
+        class_dist = np.bincount(target, minlength=n_classes)
+    else:
+        hist = np.bincount(flat_idx.ravel(), weights=np.tile(sample_weight, n_rows),
+                           minlength=n_rows * n_vals * n_classes).astype(np.int64)
+        class_dist = np.bincount(target, weights=sample_weight, minlength=n_classes).astype(np.int64)
+    hist = hist.reshape((n_rows, n_vals, n_classes))
+    n_examples = np.sum(class_dist)
 
-            idx_thresh += 1
+    # distribution of elements LT/GTE each possible split value
+    left = np.cumsum(hist, axis=1) - hist
+    right = class_dist - left
+    left_counts = np.sum(left, axis=2)
+    right_counts = n_examples - left_counts
 
-    return best_gini, idx_best_thresh
+    with np.errstate(divide="ignore", invalid="ignore"):
+        left_prob = left_counts / n_examples
+        left_gini = 1 - np.sum(np.square(np.divide(left, left_counts[:, :, np.newaxis])), axis=2)
+        right_gini = 1 - np.sum(np.square(np.divide(right, right_counts[:, :, np.newaxis])), axis=2)
+        gini_res = left_prob * left_gini + (1 - left_prob) * right_gini
+
+    # only values that are present in a row are checked as split points, except for the lowest one (empty left side)
+    valid_splits = np.logical_and(np.sum(hist, axis=2) > 0, left_counts > 0)
+    gini_res[np.logical_not(valid_splits)] = np.inf
 
+    row_idx = np.arange(n_rows)
+    is_clean = gini_res < 10e-6
+    idx_clean, idx_min = np.argmax(is_clean, axis=1), np.argmin(gini_res, axis=1)
+    has_clean, min_gini = np.any(is_clean, axis=1), gini_res[row_idx, idx_min]
+
+    # clean subset - first split point that produces it is taken; if no split beats the initial gini (1), lowest value
+    best_gini = np.where(has_clean, gini_res[row_idx, idx_clean], np.where(min_gini < 1, min_gini, 1))
+    split_vals = np.where(has_clean, idx_clean, np.where(min_gini < 1, idx_min, np.min(xon_vals, axis=1)))
+
+    return best_gini, split_vals
+
+
+def _res_gini_insertions(last_xon_vals, train_feats, cand_attrs, cand_thresh, target, sample_weight=None, rows=None):
+    """ Finds lowest Gini index value and the split point that produced it for each X-of-N attribute, obtained by
+    inserting a single condition (`cand_attrs[i]` < `cand_thresh[i]`) into an X-of-N attribute with values
+    `last_xon_vals`.
+
+    Parameters
+    ----------
+    last_xon_vals: np.array
+        Results of applying current X-of-N attribute to `train_feats`
 
-def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, available_thresh=None):
+    train_feats: np.array
+        Training data set features
+
+    cand_attrs: np.array
+        Attribute indices of inserted conditions
+
+    cand_thresh: np.array
+        Thresholds of inserted conditions
+
+    target: np.array
+        Labels, corresponding to `train_feats`
+
+    sample_weight: np.array, optional
+        Non-negative integer weights of examples (e.g. bootstrap multiplicities). If None, each example has weight 1
+
+    rows: np.array, optional
+        Indices of examples (rows of `train_feats`) that `last_xon_vals` and `target` correspond to. If None, all
+        examples are used
+
+    Returns
+    -------
+    (np.array, np.array):
+        Best Gini index value found and split value that produced it for each candidate
+    """
+    new_xon_vals = last_xon_vals + np.less(_gather_columns(train_feats, rows, cand_attrs).T, cand_thresh[:, np.newaxis])
+    return _res_gini_xon_batch(new_xon_vals, target, sample_weight=sample_weight)
+
+
+def _best_single_split(feat, target, sorted_thresholds=None, sort_idx=None, sample_weight=None):
+    """ Finds the best threshold of a single attribute (i.e. of an X-of-N attribute with one condition).
+
+    Parameters
+    ----------
+    feat: np.array
+        Single column of a data set
+
+    target: np.array
+        Labels, corresponding to `feat`
+
+    sorted_thresholds: np.array, optional
+        Thresholds to be checked, need to be sorted. If None, "valid" thresholds are determined from `feat`
+
+    sort_idx: np.array, optional
+        Precomputed indices that sort `feat`. Only used if `sorted_thresholds` is None
+
+    sample_weight: np.array, optional
+        Non-negative integer weights of examples (e.g. bootstrap multiplicities). If None, each example has weight 1
+
+    Returns
+    -------
+    (float, float):
+        Best Gini index value found and threshold that produced it
+    """
+    sort_indices = None
+    if sorted_thresholds is None:
+        # sorted order of attribute is cached so that it only gets sorted once
+        sorted_thresholds, sort_indices = _find_valid_values(feat, target, return_sort_idx=True, sort_idx=sort_idx)
+
+    gini, idx_thresh = _res_gini_numerical(feat=feat,
+                                           target=target,
+                                           sorted_thresholds=sorted_thresholds,
+                                           sort_indices=sort_indices,
+                                           sample_weight=sample_weight)
+    return gini, sorted_thresholds[idx_thresh]
+
+
+def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, available_thresh=None, attr_n_vals=None,
+                sample_weight=None, pool=None, rows=None):
     """ Performs a single addition (when `op_del=False`) or deletion (when `op_del=True`) of an (attr, thresh) pair.
 
     Parameters
@@ -333,6 +665,22 @@ def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, av
         Thresholds that make up current X-of-N attribute (i.e. `xofn_attr.thresh_val` if `xofn_attr` is
         an object of type XofNAttribute)
 
+    attr_n_vals: np.array, optional
+        Number of different values of each attribute in `train_feats` (value at index `i` belongs to attribute `i`).
+        If None, gets computed from `train_feats` when needed
+
+    sample_weight: np.array, optional
+        Non-negative integer weights of examples (e.g. bootstrap multiplicities). If None, each example has weight 1
+
+    pool: multiprocessing.pool.ThreadPool, optional
+        If provided, insertion candidates get evaluated concurrently in chunks of `_POOL_CHUNK_SIZE` (heavy numpy
+        operations release the GIL). Constructed attribute does not change
+
+    rows: np.array, optional
+        Indices of examples (rows of `train_feats`) that the attribute is constructed for - `train_labels` and
+        `sample_weight` then correspond to these examples and `attr_n_vals` needs to be provided. Columns get gathered
+        for these examples only when they are evaluated. If None, all examples are used
+
     Returns
     -------
     (XOfNAttribute, float) or (None, float)
@@ -344,13 +692,19 @@ def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, av
     if train_feats.ndim == 1:
         train_feats = np.expand_dims(train_feats, 0)
 
-    last_xon_vals = _apply_attr(train_feats=train_feats,
-                                valid_attrs=np.array(last_xon.idx_attr),
-                                valid_thresh=np.array(last_xon.thresh_val))
+    if rows is not None and attr_n_vals is None:
+        raise ValueError("Numbers of different values of attributes ('attr_n_vals') are required when 'rows' are "
+                         "provided...")
+    n_rows = train_feats.shape[0] if rows is None else rows.shape[0]
+
+    # `last_xon_conds[i, j]`... is j-th condition of `last_xon` true for i-th example
+    last_xon_conds = np.less(_gather_columns(train_feats, rows, last_xon.idx_attr), np.array(last_xon.thresh_val))
+    last_xon_vals = np.sum(last_xon_conds, axis=1)
     splits = np.unique(last_xon_vals)
     prior_gini, ovr_best_thresh = _res_gini_numerical(feat=last_xon_vals,
                                                       target=train_labels,
-                                                      sorted_thresholds=splits)
+                                                      sorted_thresholds=splits,
+                                                      sample_weight=sample_weight)
 
     # gini value and complexity of best newly created X-of-N attribute
     ovr_best_gini, ovr_best_compl = prior_gini, last_xon.cost
@@ -364,31 +718,29 @@ def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, av
     if op_del:
         # try deleting one attribute
         xon_attrs = last_xon.idx_attr
+        # evaluate all attributes with a single (attr, val) pair deleted at once - row `i` holds values of
+        # `last_xon` without its i-th condition
+        del_gini, del_split_vals = _res_gini_xon_batch(last_xon_vals - last_xon_conds.T, train_labels,
+                                                           sample_weight=sample_weight)
         for idx_attr in range(len(xon_attrs)):
             # take everything but (attr, val) on index `idx_attr`
             mask = np.not_equal(range(len(xon_attrs)), idx_attr)
 
             valid_attrs = np.compress(mask, last_xon.idx_attr)
             valid_thresh = np.compress(mask, last_xon.thresh_val)
-            new_xon_vals = _apply_attr(train_feats=train_feats,
-                                       valid_attrs=valid_attrs,
-                                       valid_thresh=valid_thresh)
-            new_xon_thresh = np.unique(new_xon_vals)
-            # returns: best_gini, idx_best_thresh
-            best_gini, idx_best_thresh = _res_gini_numerical(feat=new_xon_vals,
-                                                             target=train_labels,
-                                                             sorted_thresholds=new_xon_thresh)
+            best_gini = del_gini[idx_attr]
 
             new_cost = _eval_attr(curr_gini=best_gini,
                                   best_gini=ovr_best_gini,
                                   train_feats=train_feats,
                                   attr_feats=valid_attrs,
                                   attr_thresh=valid_thresh,
-                                  available_attrs=available_attrs)
+                                  available_attrs=available_attrs,
+                                  attr_n_vals=attr_n_vals)
 
             if new_cost:
                 ovr_best_gini = best_gini
-                split_val = new_xon_thresh[idx_best_thresh]
+                split_val = del_split_vals[idx_attr]
                 idx_best_attr = idx_attr
                 ovr_best_compl = new_cost
 
@@ -401,29 +753,51 @@ def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, av
                                      cost=ovr_best_compl)
 
     else:
+        # candidate (attr, val) pairs, in the order in which they get evaluated
+        cand_attrs, cand_thresh = [], []
         for i, idx_attr in enumerate(available_attrs):
-            valid_attrs = np.array(last_xon.idx_attr + [idx_attr])
-            curr_attr_thresh = _find_valid_values(train_feats[:, idx_attr], train_labels) \
+            curr_attr_thresh = _find_valid_values(_gather_columns(train_feats, rows, idx_attr), train_labels) \
                 if available_thresh is None else available_thresh[i]
-            for thr in curr_attr_thresh:
+            cand_attrs.append(np.full(len(curr_attr_thresh), idx_attr))
+            cand_thresh.append(np.asarray(curr_attr_thresh))
+        cand_attrs, cand_thresh = np.concatenate(cand_attrs), np.concatenate(cand_thresh)
+
+        # adding an (attr, val) pair only adds a single condition to `last_xon`, so values of new attributes are
+        # obtained from `last_xon_vals` and candidates get evaluated in batches
+        batch_size = max(1, _MAX_BATCH_ELEMS // n_rows)
+        for idx_start in range(0, cand_attrs.shape[0], batch_size):
+            batch_attrs = cand_attrs[idx_start: idx_start + batch_size]
+            batch_thresh = cand_thresh[idx_start: idx_start + batch_size]
+            if pool is None:
+                batch_gini, batch_split_vals = _res_gini_insertions(last_xon_vals, train_feats, batch_attrs,
+                                                                    batch_thresh, train_labels, sample_weight, rows)
+            else:
+                chunks = range(0, batch_attrs.shape[0], _POOL_CHUNK_SIZE)
+                chunk_res = pool.starmap(_res_gini_insertions,
+                                         [(last_xon_vals, train_feats, batch_attrs[idx: idx + _POOL_CHUNK_SIZE],
+                                           batch_thresh[idx: idx + _POOL_CHUNK_SIZE], train_labels, sample_weight,
+                                           rows)
+                                          for idx in chunks])
+                batch_gini = np.concatenate([chunk_gini for chunk_gini, _ in chunk_res])
+                batch_split_vals = np.concatenate([chunk_split_vals for _, chunk_split_vals in chunk_res])
+
+            for idx_cand in range(batch_attrs.shape[0]):
+                idx_attr, thr = batch_attrs[idx_cand], batch_thresh[idx_cand]
+                valid_attrs = np.array(last_xon.idx_attr + [idx_attr])
                 valid_thresh = np.array(last_xon.thresh_val + [thr])
-
-                new_xon_vals = np.sum(train_feats[:, valid_attrs] < valid_thresh, axis=1)
-                new_xon_thresh = np.unique(new_xon_vals)
-                best_gini, idx_best_thresh = _res_gini_numerical(feat=new_xon_vals,
-                                                                 target=train_labels,
-                                                                 sorted_thresholds=new_xon_thresh)
+                best_gini = batch_gini[idx_cand]
 
                 new_cost = _eval_attr(curr_gini=best_gini,
                                       best_gini=ovr_best_gini,
                                       train_feats=train_feats,
                                       attr_feats=valid_attrs,
                                       attr_thresh=valid_thresh,
-                                      available_attrs=available_attrs)
+                                      available_attrs=available_attrs,
+                                      attr_n_vals=attr_n_vals)
 
                 if new_cost:
                     ovr_best_gini = best_gini
-                    split_val = new_xon_thresh[idx_best_thresh]
+                    split_val = batch_split_vals[idx_cand]
                     ovr_best_thresh = thr
                     ovr_best_compl = new_cost
                     idx_best_attr = idx_attr
@@ -438,7 +812,9 @@ def search_xofn(train_feats, train_labels, available_attrs, last_xon, op_del, av
     return new_attr, ovr_best_gini
 
 
-def very_greedy_construct_xofn(train_feats, train_labels, available_attrs=None, available_thresh=None):
+def very_greedy_construct_xofn(train_feats, train_labels, available_attrs=None, available_thresh=None,
+                               attr_n_vals=None, sample_weight=None, binned=False, sort_indices=None, pool=None,
+                               rows=None):
     """ Constructs an X-of-N attribute greedily out of `available_attrs` and their best thresholds (that produce
     lowest Gini index value).
 
@@ -455,6 +831,30 @@ def very_greedy_construct_xofn(train_feats, train_labels, available_attrs=None,
         all available features (`np.arange(train_feats.shape[1])`), but can also be a subset of that (e.g.
         a random sample of features when constructing random forests)
 
+    attr_n_vals: np.array, optional
+        Number of different values of each attribute in `train_feats` (value at index `i` belongs to attribute `i`).
+        If None, gets computed from `train_feats` when needed
+
+    sample_weight: np.array, optional
+        Non-negative integer weights of examples (e.g. bootstrap multiplicities). If None, each example has weight 1
+
+    binned: bool, optional
+        If True, `train_feats` contain bin codes (see `_bin_feats(...)`) and every present code of an attribute is
+        considered as its threshold. Attributes then get evaluated with per-bin class histograms instead of sorting
+
+    sort_indices: np.array, optional
+        Indices that sort values of each available attribute (column `i` of `sort_indices` sorts values of attribute
+        `available_attrs[i]`). If None, attributes get sorted when they are evaluated
+
+    pool: multiprocessing.pool.ThreadPool, optional
+        If provided, attributes (in the first construction step) and insertion candidates (in `search_xofn(...)`) get
+        evaluated concurrently. Constructed attribute does not change
+
+    rows: np.array, optional
+        Indices of examples (rows of `train_feats`) that the attribute is constructed for - `train_labels` and
+        `sample_weight` then correspond to these examples (e.g. examples of a tree node). Columns get gathered for these
+        examples only when they are evaluated. If None, all examples are used
+
     Returns
     -------
     (XOfNAttribute, float)
@@ -467,6 +867,13 @@ def very_greedy_construct_xofn(train_feats, train_labels, available_attrs=None,
     if available_attrs is None:
         available_attrs = np.arange(train_feats.shape[1])
 
+    n_rows = train_feats.shape[0] if rows is None else rows.shape[0]
+    if rows is not None and attr_n_vals is None:
+        # complexity of attributes depends on number of different values among examples `rows` only
+        attr_n_vals = np.zeros(train_feats.shape[1], dtype=np.int64)
+        for idx_attr in available_attrs:
+            attr_n_vals[idx_attr] = np.unique(train_feats[rows, idx_attr]).shape[0]
+
     # element at index i is best XofN attribute that consists of i attributes
     best_xons = [None]
     del_applied = [True]
@@ -476,24 +883,43 @@ def very_greedy_construct_xofn(train_feats, train_labels, available_attrs=None,
     # `attr_best_thresh[i]` is the best threshold for attribute `available_attrs[i]`
     attr_best_thresh = []
 
-    for i, idx_attr in enumerate(available_attrs):
-        curr_thresh = _find_valid_values(train_feats[:, idx_attr], train_labels) if available_thresh is None else \
-            available_thresh[i]
-        gini, idx_thresh = _res_gini_numerical(feat=train_feats[:, idx_attr],
-                                               target=train_labels,
-                                               sorted_thresholds=curr_thresh)
-        attr_best_thresh.append([curr_thresh[idx_thresh]])
+    # attributes are evaluated independently (possibly concurrently) and compared in order afterwards - in a single
+    # thread, columns get gathered one batch at a time
+    starmap_func = starmap if pool is None else pool.starmap
+    if binned:
+        # bin codes are small non-negative integers, so all attributes can be evaluated in batches in the same way
+        # as X-of-N attribute values
+        batch_size = max(1, _MAX_BATCH_ELEMS // n_rows)
+        if pool is not None:
+            batch_size = min(batch_size, _POOL_CHUNK_SIZE)
+        binned_res = list(starmap_func(_res_gini_xon_batch,
+                                       ((_gather_columns(train_feats, rows,
+                                                         available_attrs[idx_start: idx_start + batch_size]).T,
+                                         train_labels, sample_weight)
+                                        for idx_start in range(0, len(available_attrs), batch_size))))
+        attr_res = zip(np.concatenate([batch_gini for batch_gini, _ in binned_res]),
+                       np.concatenate([batch_thresh for _, batch_thresh in binned_res]))
+    else:
+        attr_res = starmap_func(_best_single_split,
+                                ((_gather_columns(train_feats, rows, idx_attr), train_labels,
+                                  None if available_thresh is None else available_thresh[i],
+                                  None if sort_indices is None else sort_indices[:, i], sample_weight)
+                                 for i, idx_attr in enumerate(available_attrs)))
+
+    for idx_attr, (gini, attr_thresh) in zip(available_attrs, attr_res):
+        attr_best_thresh.append([attr_thresh])
 
         new_cost = _eval_attr(curr_gini=gini,
                               best_gini=best_gini,
                               train_feats=train_feats,
                               attr_feats=[idx_attr],
-                              attr_thresh=curr_thresh[idx_thresh],
-                              available_attrs=available_attrs)
+                              attr_thresh=attr_thresh,
+                              available_attrs=available_attrs,
+                              attr_n_vals=attr_n_vals)
 
         if new_cost:
             best_gini = gini
-            best_thresh = curr_thresh[idx_thresh]
+            best_thresh = attr_thresh
             idx_best_attr = idx_attr
             best_compl = new_cost
 
@@ -515,7 +941,11 @@ def very_greedy_construct_xofn(train_feats, train_labels, available_attrs=None,
                                          available_attrs=available_attrs,
                                          available_thresh=attr_best_thresh,
                                          last_xon=best_xons[len_last_xon],
-                                         op_del=do_del)
+                                         op_del=do_del,
+                                         attr_n_vals=attr_n_vals,
+                                         sample_weight=sample_weight,
+                                         pool=pool,
+                                         rows=rows)
 
         if do_del:
             del_applied[len_last_xon] = True
@@ -592,9 +1022,131 @@ class TreeNode(object):
         return node
 
 
+class FlatXOfNTree(object):
+    __slots__ = ('children_left', 'children_right', 'split_val', 'attr_ptr', 'attr_idx', 'thresh_val', 'probas')
+    """ Compiled (array-based) representation of a fitted X-of-N tree, used for vectorized batch prediction. Nodes
+    are stored in an array per property (root at index 0) and conditions of X-of-N attributes are packed as in CSR
+    matrices: conditions of node `i` are `attr_idx[attr_ptr[i]: attr_ptr[i + 1]]` and
+    `thresh_val[attr_ptr[i]: attr_ptr[i + 1]]`.
+
+    Parameters
+    ----------
+    children_left: np.array
+        Index of left child for each node (-1 for leaves)
+
+    children_right: np.array
+        Index of right child for each node (-1 for leaves)
+
+    split_val: np.array
+        Split point for each internal node (examples with less than `split_val` true conditions go to the left child)
+
+    attr_ptr: np.array
+        Offsets of conditions of each node in `attr_idx` and `thresh_val` (of length `n_nodes + 1`)
+
+    attr_idx: np.array
+        Attribute indices of conditions of all nodes
+
+    thresh_val: np.array
+        Thresholds of conditions of all nodes
+
+    probas: np.array
+        Class probabilities for each node (only meaningful for leaves)
+    """
+    def __init__(self, children_left, children_right, split_val, attr_ptr, attr_idx, thresh_val, probas):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.split_val = split_val
+        self.attr_ptr = attr_ptr
+        self.attr_idx = attr_idx
+        self.thresh_val = thresh_val
+        self.probas = probas
+
+    @staticmethod
+    def from_root(root, n_classes):
+        """ Compiles tree of TreeNode objects, rooted in `root`, into flat node arrays. """
+        nodes = [root]
+        children_left, children_right, split_val, attr_ptr = [], [], [], [0]
+        attr_idx, thresh_val, probas = [], [], []
+
+        idx_node = 0
+        while idx_node < len(nodes):
+            curr_node = nodes[idx_node]
+            if curr_node.is_leaf:
+                children_left.append(-1)
+                children_right.append(-1)
+                split_val.append(0)
+                probas.append(curr_node.probas)
+            else:
+                children_left.append(len(nodes))
+                children_right.append(len(nodes) + 1)
+                nodes.extend([curr_node.lch, curr_node.rch])
+                split_val.append(curr_node.split_val)
+                attr_idx.extend(curr_node.attr_list)
+                thresh_val.extend(curr_node.thresh_list)
+                probas.append(np.zeros(n_classes, dtype=np.float32))
+
+            attr_ptr.append(len(attr_idx))
+            idx_node += 1
+
+        return FlatXOfNTree(children_left=np.array(children_left, dtype=np.int32),
+                            children_right=np.array(children_right, dtype=np.int32),
+                            split_val=np.array(split_val, dtype=np.int32),
+                            attr_ptr=np.array(attr_ptr, dtype=np.int64),
+                            attr_idx=np.array(attr_idx, dtype=np.int64),
+                            thresh_val=np.array(thresh_val, dtype=np.float64),
+                            probas=np.array(probas, dtype=np.float32))
+
+    @property
+    def n_nodes(self):
+        return self.children_left.shape[0]
+
+    def apply(self, feats):
+        """ Routes all examples in `feats` through the tree level by level and returns index of leaf that each example
+        ends up in. At each level, number of true conditions is counted for all examples, that are still in internal
+        nodes, at once.
+
+        Parameters
+        ----------
+        feats: np.array
+            2D array of examples
+
+        Returns
+        -------
+        np.array
+            Leaf (node) index for each example in `feats`
+        """
+        node_idx = np.zeros(feats.shape[0], dtype=np.int64)
+        active = np.arange(feats.shape[0])
+
+        while active.shape[0] > 0:
+            curr_nodes = node_idx[active]
+            is_internal = self.children_left[curr_nodes] != -1
+            active, curr_nodes = active[is_internal], curr_nodes[is_internal]
+            if active.shape[0] == 0:
+                break
+
+            # expand (example, condition) pairs for conditions in the node that each active example is currently in
+            n_conds = self.attr_ptr[curr_nodes + 1] - self.attr_ptr[curr_nodes]
+            pair_ex = np.repeat(np.arange(active.shape[0]), n_conds)
+            pair_cond = np.arange(pair_ex.shape[0]) - np.repeat(np.cumsum(n_conds) - n_conds, n_conds) + \
+                np.repeat(self.attr_ptr[curr_nodes], n_conds)
+
+            true_conds = np.less(feats[active[pair_ex], self.attr_idx[pair_cond]], self.thresh_val[pair_cond])
+            xon_vals = np.bincount(pair_ex, weights=true_conds, minlength=active.shape[0])
+
+            node_idx[active] = np.where(xon_vals < self.split_val[curr_nodes],
+                                        self.children_left[curr_nodes],
+                                        self.children_right[curr_nodes])
+
+        return node_idx
+
+    def predict_proba(self, feats):
+        return self.probas[self.apply(feats)]
+
+
 class XOfNTree(object):
     __slots__ = ('min_samples_leaf', 'max_features', 'max_depth', 'classes_', '_max_feats', '_min_samples',
-                 'labels_encoded', '_root', '_is_fitted')
+                 'labels_encoded', 'max_bins', 'n_threads', 'tree_', '_is_fitted')
     """
     Parameters
     ----------
@@ -621,24 +1173,36 @@ class XOfNTree(object):
     classes_: np.array, optional
         Mapping of classes to indices in outcome vectors
         WARNING: Will likely be removed from init params later on    
+
+    max_bins: int, optional
+        If not None, features are discretized into at most `max_bins` (<= 256) quantile bins before fitting and only
+        bin edges are considered as thresholds (approximate, but much faster split search). If None, uses exact search
+
+    n_threads: int, optional
+        Number of threads that construct X-of-N attributes of nodes with at least `_PARALLEL_MIN_SAMPLES` examples
+        (smaller nodes are processed in a single thread). Constructed tree does not depend on this setting
     """
     def __init__(self, min_samples_leaf=1,
                  max_features=None,
                  max_depth=None,
                  random_state=None,
                  labels_encoded=False,
-                 classes_=None):
+                 classes_=None,
+                 max_bins=None,
+                 n_threads=1):
         self.min_samples_leaf = min_samples_leaf
         self.max_features = max_features
         self.max_depth = max_depth if max_depth is not None else 2 ** 30
         self.labels_encoded = labels_encoded
+        self.max_bins = max_bins
+        self.n_threads = max(1, n_threads) if n_threads != -1 else multiprocessing.cpu_count()
         if random_state is not None:
             np.random.seed(random_state)
 
         self.classes_ = classes_
         self._max_feats = None
         self._min_samples = None
-        self._root = None
+        self.tree_ = None
         self._is_fitted = False
 
     @staticmethod
@@ -669,72 +1233,201 @@ class XOfNTree(object):
         self.classes_, enc_labels = np.unique(labels, return_inverse=True)
         return enc_labels
 
-    def fit(self, train_feats, train_labels):
+    def fit(self, train_feats, train_labels, sample_weight=None, bin_edges=None, sort_order=None):
+        """
+        Parameters
+        ----------
+        train_feats: np.array
+            Training data set features
+
+        train_labels: np.array
+            Labels corresponding to `train_feats`
+
+        sample_weight: np.array, optional
+            Non-negative integer weights of examples (e.g. bootstrap multiplicities). Examples with weight 0 are not
+            used. If None, each example has weight 1
+
+        bin_edges: list, optional
+            Precomputed bin edges for each feature (only used if `max_bins` is not None). If provided, `train_feats`
+            need to already contain bin codes (e.g. when binning is done once for all trees in a forest). If None,
+            `train_feats` get binned here
+
+        sort_order: np.array, optional
+            Indices that sort each column of `train_feats` (e.g. as returned by `_presort_columns(train_feats)`),
+            computed once and shared by all trees of a forest. Large nodes then obtain sorted order of their examples
+            by filtering `sort_order` instead of sorting. If None, each node sorts its examples
+        """
         self._is_fitted = False
         if train_feats.ndim == 1:
             train_feats = np.expand_dims(train_feats, 0)
 
         if not self.labels_encoded:
             train_labels = self.encode_labels(train_labels)
+        if sample_weight is None:
+            sample_weight = np.ones(train_feats.shape[0], dtype=np.int64)
+        sample_weight = np.asarray(sample_weight, dtype=np.int64)
+
         self._max_feats = XOfNTree.calc_max_feats(self.max_features, train_feats.shape[1])
-        self._min_samples = XOfNTree.calc_min_samples(self.min_samples_leaf, train_feats.shape[0])
+        self._min_samples = XOfNTree.calc_min_samples(self.min_samples_leaf, int(np.sum(sample_weight)))
 
-        self._root = self._split_rec(train_feats, train_labels, 0)
+        if self.max_bins is not None and bin_edges is None:
+            bin_edges = _find_bin_edges(train_feats[sample_weight > 0], self.max_bins)
+            train_feats = _bin_feats(train_feats, bin_edges)
+
+        if self.n_threads > 1:
+            with multiprocessing.pool.ThreadPool(processes=self.n_threads) as pool:
+                self.tree_ = self._build(train_feats, train_labels, sample_weight, binned=self.max_bins is not None,
+                                         sort_order=sort_order, pool=pool)
+        else:
+            self.tree_ = self._build(train_feats, train_labels, sample_weight, binned=self.max_bins is not None,
+                                     sort_order=sort_order)
+
+        if self.max_bins is not None:
+            # conditions on bin codes (`code < c`) get converted into conditions on raw values (`x < edge[c - 1]`)
+            self.tree_.thresh_val = np.array([bin_edges[attr][int(code) - 1] if code >= 1 else -np.inf
+                                              for attr, code in zip(self.tree_.attr_idx, self.tree_.thresh_val)],
+                                             dtype=np.float64)
         self._is_fitted = True
 
-    def _split_rec(self, curr_feats, curr_labels, curr_depth):
-        # Note: `curr_feats` should be 2-dim (check is handled in self.fit())
-        n_attrs = curr_feats.shape[1]
-        n_samples = curr_feats.shape[0]
-        uniqs, class_dist = np.unique(curr_labels, return_counts=True)
-
-        if curr_depth == self.max_depth:
-            probas = np.zeros_like(self.classes_, dtype=np.float32)
-            probas[uniqs] = class_dist / n_samples
-            return TreeNode.create_leaf(probas, outcome=np.argmax(probas))
-
-        if class_dist.shape[0] == 1:
-            # pure subset
-            probas = np.zeros_like(self.classes_, dtype=np.float32)
-            probas[curr_labels[0]] = 1
-            return TreeNode.create_leaf(probas, outcome=curr_labels[0])
-
-        prior_gini = _gini(class_dist, n_samples)
-        selected_attrs = np.random.choice(n_attrs, size=self._max_feats, replace=False) \
-            if self._max_feats < n_attrs else np.arange(n_attrs)
-        new_attr, new_gini = very_greedy_construct_xofn(curr_feats, curr_labels, available_attrs=selected_attrs)
-
-        # if best possible constructed attribute is of length > 1 and has same gini, that means it reduces
-        # representation complexity (which means the algorithm should not terminate just yet)
-        if (len(new_attr) == 1 and new_gini >= prior_gini) or (len(new_attr) > 1 and new_gini > prior_gini):
-            probas = np.zeros_like(self.classes_, dtype=np.float32)
-            probas[uniqs] = class_dist / n_samples
-            return TreeNode.create_leaf(probas, outcome=np.argmax(probas))
-
-        # contains number of true conditions in newly created X-of-N attribute for each row in `train_feats`
-        xon_vals = _apply_attr(curr_feats,
-                               valid_attrs=new_attr.idx_attr,
-                               valid_thresh=new_attr.thresh_val)
-
-        node = TreeNode.create_internal(attr_list=new_attr.idx_attr,
-                                        thresh_list=new_attr.thresh_val,
-                                        split_val=new_attr.split_val)
-
-        lch_mask = xon_vals < new_attr.split_val
-        rch_mask = np.logical_not(lch_mask)
-
-        lfeats, llabs = curr_feats[lch_mask, :], curr_labels[lch_mask]
-        rfeats, rlabs = curr_feats[rch_mask, :], curr_labels[rch_mask]
-
-        if llabs.shape[0] < self._min_samples or rlabs.shape[0] < self._min_samples:
-            # further split would result in a node having to learn on a subset that is too small
-            probas = np.zeros_like(self.classes_, dtype=np.float32)
-            probas[uniqs] = class_dist / n_samples
-            return TreeNode.create_leaf(probas, outcome=np.argmax(probas))
-
-        node.lch = self._split_rec(lfeats, llabs, curr_depth + 1)
-        node.rch = self._split_rec(rfeats, rlabs, curr_depth + 1)
-        return node
+    def _build(self, feats, labels, sample_weight, binned=False, sort_order=None, pool=None):
+        """ Grows the tree iteratively (depth-first, left subtree first) and returns its compiled representation.
+        Examples of a node are a contiguous range of a single index array, which gets partitioned in place when the
+        node is split, so rows of `feats` are never copied as a whole.
+
+        Parameters
+        ----------
+        feats: np.array
+            2D array of training examples
+
+        labels: np.array
+            Encoded labels, corresponding to `feats`
+
+        sample_weight: np.array
+            Non-negative integer weights of examples
+
+        binned: bool, optional
+            Whether `feats` contain bin codes (thresholds of returned tree are then also bin codes)
+
+        sort_order: np.array, optional
+            Indices that sort each column of `feats`. If None, each node sorts its examples
+
+        pool: multiprocessing.pool.ThreadPool, optional
+            Thread pool, used when constructing X-of-N attributes of nodes with at least `_PARALLEL_MIN_SAMPLES`
+            examples
+
+        Returns
+        -------
+        FlatXOfNTree
+        """
+        n_all_samples, n_attrs = feats.shape
+        n_classes = len(self.classes_)
+        sample_idx = np.flatnonzero(sample_weight)
+        if sort_order is not None:
+            # `node_pos[i]`... position of example `i` among examples of current node (-1 if it is not in the node) -
+            # of same type as `sort_order`, so that filtered order of a node takes no more memory than needed
+            node_pos = np.full(n_all_samples, -1, dtype=sort_order.dtype)
+
+        children_left, children_right, split_val, probas = [], [], [], []
+        attr_idx, thresh_val = [], []
+
+        # (start, end, depth, parent, is_left_child): examples of node are `sample_idx[start: end]`
+        stack = [(0, sample_idx.shape[0], 0, -1, True)]
+        while stack:
+            start, end, curr_depth, parent, is_lch = stack.pop()
+
+            idx_node = len(children_left)
+            if parent != -1:
+                if is_lch:
+                    children_left[parent] = idx_node
+                else:
+                    children_right[parent] = idx_node
+            children_left.append(-1)
+            children_right.append(-1)
+            split_val.append(0)
+            attr_idx.append([])
+            thresh_val.append([])
+
+            node_rows = sample_idx[start: end]
+            curr_labels, curr_weights = labels[node_rows], sample_weight[node_rows]
+            uniqs = np.flatnonzero(np.bincount(curr_labels, minlength=n_classes))
+            class_dist = np.bincount(curr_labels, weights=curr_weights, minlength=n_classes).astype(np.int64)[uniqs]
+            n_samples = np.sum(class_dist)
+
+            # by default, node is a leaf that predicts class distribution of its examples
+            probas.append(np.zeros(n_classes, dtype=np.float32))
+            probas[idx_node][uniqs] = class_dist / n_samples
+
+            if curr_depth == self.max_depth:
+                continue
+
+            if class_dist.shape[0] == 1:
+                # pure subset
+                continue
+
+            prior_gini = _gini(class_dist, n_samples)
+            selected_attrs = np.random.choice(n_attrs, size=self._max_feats, replace=False) \
+                if self._max_feats < n_attrs else np.arange(n_attrs)
+
+            # sorted order of selected attributes among examples of node is obtained once per node - by filtering
+            # presorted order of all examples for large nodes (O(n)) or by sorting examples of node for small ones
+            # (O(n_node * log(n_node))); column `i` of `node_sort` sorts values of `selected_attrs[i]`
+            n_node = node_rows.shape[0]
+            if sort_order is not None and n_node * np.log2(n_node) >= n_all_samples:
+                node_pos[node_rows] = np.arange(n_node)
+                node_sort = node_pos[sort_order[:, selected_attrs]].T
+                node_sort = node_sort[node_sort >= 0].reshape((selected_attrs.shape[0], n_node)).T
+                node_pos[node_rows] = -1
+            else:
+                node_sort = np.argsort(_gather_columns(feats, node_rows, selected_attrs), axis=0, kind="stable")
+
+            # number of different values of selected attributes is computed once per node and reused when calculating
+            # complexity of constructed X-of-N attributes
+            sorted_feats = feats[node_rows[node_sort], selected_attrs]
+            attr_n_vals = np.zeros(n_attrs, dtype=np.int64)
+            attr_n_vals[selected_attrs] = 1 + np.count_nonzero(sorted_feats[1:, :] != sorted_feats[:-1, :], axis=0)
+            del sorted_feats
+
+            # examples of node are not copied - split search gathers columns of `node_rows` when it evaluates them
+            new_attr, new_gini = very_greedy_construct_xofn(feats, curr_labels, available_attrs=selected_attrs,
+                                                            attr_n_vals=attr_n_vals, sample_weight=curr_weights,
+                                                            binned=binned, sort_indices=node_sort,
+                                                            pool=pool if n_node >= _PARALLEL_MIN_SAMPLES else None,
+                                                            rows=node_rows)
+
+            # if best possible constructed attribute is of length > 1 and has same gini, that means it reduces
+            # representation complexity (which means the algorithm should not terminate just yet)
+            if (len(new_attr) == 1 and new_gini >= prior_gini) or (len(new_attr) > 1 and new_gini > prior_gini):
+                continue
+
+            # contains number of true conditions in newly created X-of-N attribute for each example in node
+            xon_vals = np.sum(np.less(_gather_columns(feats, node_rows, new_attr.idx_attr), new_attr.thresh_val),
+                              axis=1)
+            lch_mask = xon_vals < new_attr.split_val
+
+            n_left = np.sum(curr_weights[lch_mask])
+            if n_left < self._min_samples or n_samples - n_left < self._min_samples:
+                # further split would result in a node having to learn on a subset that is too small
+                continue
+
+            split_val[idx_node] = new_attr.split_val
+            attr_idx[idx_node] = new_attr.idx_attr
+            thresh_val[idx_node] = new_attr.thresh_val
+            probas[idx_node][:] = 0
+
+            # partition examples of node in place (stable, examples of left child first)
+            mid = start + np.count_nonzero(lch_mask)
+            sample_idx[start: end] = np.concatenate((node_rows[lch_mask], node_rows[np.logical_not(lch_mask)]))
+
+            stack.append((mid, end, curr_depth + 1, idx_node, False))
+            stack.append((start, mid, curr_depth + 1, idx_node, True))
+
+        return FlatXOfNTree(children_left=np.array(children_left, dtype=np.int32),
+                            children_right=np.array(children_right, dtype=np.int32),
+                            split_val=np.array(split_val, dtype=np.int32),
+                            attr_ptr=np.cumsum([0] + [len(conds) for conds in attr_idx], dtype=np.int64),
+                            attr_idx=np.array(list(chain(*attr_idx)), dtype=np.int64),
+                            thresh_val=np.array(list(chain(*thresh_val)), dtype=np.float64),
+                            probas=np.array(probas, dtype=np.float32))
 
     def predict(self, test_feats):
         return self.classes_[np.argmax(self.predict_proba(test_feats), axis=1)]
@@ -757,33 +1450,7 @@ class XOfNTree(object):
         if test_feats.ndim == 1:
             test_feats = np.expand_dims(test_feats, 0)
 
-        n_samples = test_feats.shape[0]
-        return np.array([self._single_pred_proba(test_feats[idx_ex, :], self._root)
-                        for idx_ex in range(n_samples)])
-
-    def _single_pred_proba(self, single_example, curr_node):
-        """
-        Parameters
-        ----------
-        single_example: np.array
-            Example for which prediction will be made.
-        curr_node: TreeNode
-
-        Returns
-        -------
-        np.array
-            Probability predictions for `single_example`.
-        """
-
-        if curr_node.is_leaf:
-            return curr_node.probas
-
-        xon_value = _apply_attr(single_example, curr_node.attr_list, curr_node.thresh_list)
-
-        if xon_value < curr_node.split_val:
-            return self._single_pred_proba(single_example, curr_node.lch)
-        else:
-            return self._single_pred_proba(single_example, curr_node.rch)
+        return self.tree_.predict_proba(test_feats)
 
 
 # data for parallel fitting of random X-of-N forests
@@ -791,16 +1458,45 @@ class XOfNTree(object):
 _shared_data_xofn = {}
 
 
-def _set_shared_data(feats, labels, shape):
+def _set_shared_data(feats, labels, shape, bin_edges=None):
     _shared_data_xofn["feats"] = feats
     _shared_data_xofn["labels"] = labels
     _shared_data_xofn["shape"] = shape
+    _shared_data_xofn["bin_edges"] = bin_edges
 
 
 def _clear_shared_data():
     _shared_data_xofn.clear()
 
 
+# worker processes, shared by predictions of random X-of-N forests inside `prediction_pool()` contexts
+# (written only in main thread of main process)
+_prediction_pool = {"pool": None, "depth": 0}
+
+
+@contextlib.contextmanager
+def prediction_pool():
+    """ Context in which all `RandomXOfNForest.predict_proba(...)` calls (e.g. of all X-of-N forests in all layers of a
+    cascade) share a single pool of worker processes instead of creating processes for each call. The pool is created
+    by the first prediction that needs it and terminated when the outermost context is left, so no worker process
+    outlives the context. Can also be used as a decorator. Outside of the main thread, the context does nothing (such
+    predictions do not use processes).
+    """
+    if threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    _prediction_pool["depth"] += 1
+    try:
+        yield
+    finally:
+        _prediction_pool["depth"] -= 1
+        if _prediction_pool["depth"] == 0 and _prediction_pool["pool"] is not None:
+            _prediction_pool["pool"].terminate()
+            _prediction_pool["pool"].join()
+            _prediction_pool["pool"] = None
+
+
 class RandomXOfNForest(object):
     def __init__(self, n_estimators=100,
                  min_samples_leaf=1,
@@ -810,7 +1506,9 @@ class RandomXOfNForest(object):
                  n_jobs=1,
                  random_state=None,
                  labels_encoded=False,
-                 classes_=None):
+                 classes_=None,
+                 max_bins=None,
+                 n_threads=1):
         self.n_estimators = n_estimators
         self.min_samples_leaf = min_samples_leaf
         self.max_features = max_features
@@ -821,6 +1519,10 @@ class RandomXOfNForest(object):
             np.random.seed(random_state)
         self.labels_encoded = labels_encoded
         self.classes_ = classes_
+        # if not None, features get binned once per forest and trees use approximate (binned) split search
+        self.max_bins = max_bins
+        # number of threads per tree for large nodes - useful when there are fewer trees per process than cores
+        self.n_threads = n_threads
 
         self.estimators = []
         self._is_fitted = False
@@ -844,25 +1546,62 @@ class RandomXOfNForest(object):
     def _fit_process(self, n_trees, rand_seed):
         np.random.seed(rand_seed)
         shape = _shared_data_xofn["shape"]
+        bin_edges = _shared_data_xofn["bin_edges"]
 
-        feats = np.frombuffer(_shared_data_xofn["feats"], np.float32).reshape(shape)
+        # features are shared as bin codes if approximate split search is used
+        feats = np.frombuffer(_shared_data_xofn["feats"], np.float32 if bin_edges is None else np.uint8).reshape(shape)
         labels = np.frombuffer(_shared_data_xofn["labels"], np.int32)
         n_samples = feats.shape[0]
         trees = []
 
+        # sorted order of each column is computed once per process and shared by all of its trees
+        sort_order = _presort_columns(feats)
+
         for i in range(n_trees):
+            # bootstrap multiplicities are used as sample weights instead of copying sampled rows
             sample_idx = np.random.choice(n_samples, size=self._sample_size, replace=True)
+            sample_weight = np.bincount(sample_idx, minlength=n_samples)
             xofn_tree = XOfNTree(min_samples_leaf=self.min_samples_leaf,
                                  max_features=self.max_features,
                                  max_depth=self.max_depth,
                                  labels_encoded=True,
-                                 classes_=self.classes_)
+                                 classes_=self.classes_,
+                                 max_bins=self.max_bins,
+                                 n_threads=self.n_threads)
 
-            xofn_tree.fit(feats[sample_idx, :], labels[sample_idx])
+            xofn_tree.fit(feats, labels, sample_weight=sample_weight, bin_edges=bin_edges, sort_order=sort_order)
             trees.append(xofn_tree)
 
         return trees
 
+    @staticmethod
+    def _predict_process(trees, feats_path, n_classes):
+        """ Internal method that is called in subprocesses to sum predictions of a part of all trees in a forest.
+
+        Parameters
+        ----------
+        trees: list
+            Fitted XOfNTree objects whose predictions are to be summed in this function
+
+        feats_path: str
+            Path to test examples (.npy file, which gets memory-mapped, so processes share its pages)
+
+        n_classes: int
+            Number of classes in probability vectors
+
+        Returns
+        -------
+        np.array
+            Sum of probability predictions of `trees` for test examples
+        """
+        feats = np.load(feats_path, mmap_mode="r")
+
+        proba_preds = np.zeros((feats.shape[0], n_classes), dtype=np.float64)
+        for tree in trees:
+            proba_preds += tree.predict_proba(feats)
+
+        return proba_preds
+
     def fit(self, train_feats, train_labels):
         self._is_fitted = False
         self.estimators = []
@@ -876,10 +1615,17 @@ class RandomXOfNForest(object):
         n_samples = train_feats.shape[0]
         self._sample_size = RandomXOfNForest.calc_sample_size(self.sample_size, n_samples)
 
+        bin_edges = None
+        if self.max_bins is not None:
+            # bin features once for all trees
+            bin_edges = _find_bin_edges(train_feats, self.max_bins)
+            train_feats = _bin_feats(train_feats, bin_edges)
+
         # put features and labels into shared data
         feats_shape = train_feats.shape
-        feats_base = multiprocessing.Array("f", feats_shape[0] * feats_shape[1], lock=False)
-        feats_np = np.frombuffer(feats_base, dtype=np.float32).reshape(feats_shape)
+        feats_base = multiprocessing.Array("f" if bin_edges is None else "B", feats_shape[0] * feats_shape[1],
+                                           lock=False)
+        feats_np = np.frombuffer(feats_base, dtype=np.float32 if bin_edges is None else np.uint8).reshape(feats_shape)
         np.copyto(feats_np, train_feats)
 
         labels_base = multiprocessing.Array("I", feats_shape[0], lock=False)
@@ -888,7 +1634,7 @@ class RandomXOfNForest(object):
 
         with multiprocessing.Pool(processes=self.n_jobs,
                                   initializer=_set_shared_data,
-                                  initargs=(feats_base, labels_base, feats_shape)) as pool:
+                                  initargs=(feats_base, labels_base, feats_shape, bin_edges)) as pool:
             async_objs = []
             for idx_proc in range(self.n_jobs):
                 # divide `n_estimators` between `n_jobs` processes -
@@ -912,13 +1658,61 @@ class RandomXOfNForest(object):
             test_feats = np.expand_dims(test_feats, 0)
 
         n_samples = test_feats.shape[0]
-        proba_preds = np.zeros((n_samples, self.classes_.shape[0]), dtype=np.float32)
-
-        for i in range(self.n_estimators):
-            preds = self.estimators[i].predict_proba(test_feats)
-            proba_preds += preds
-
-        proba_preds = np.divide(proba_preds, self.n_estimators)
+        n_classes = self.classes_.shape[0]
+        n_jobs = min(self.n_jobs, self.n_estimators)
+        # small predictions are not worth sending to processes; processes are neither created from other threads than
+        # the main one (forking a multi-threaded process is unsafe) nor from daemonic processes (which can not have
+        # children)
+        if n_samples * self.n_estimators < _PARALLEL_PREDICT_MIN_ELEMS or \
+                threading.current_thread() is not threading.main_thread() or \
+                multiprocessing.current_process().daemon:
+            n_jobs = 1
+
+        # probabilities are summed in double precision (as in sklearn forests), so that the result does not depend on
+        # the order of summation (e.g. number of processes)
+        if n_jobs == 1:
+            proba_preds = np.zeros((n_samples, n_classes), dtype=np.float64)
+            for i in range(self.n_estimators):
+                preds = self.estimators[i].predict_proba(test_feats)
+                proba_preds += preds
+
+            return np.divide(proba_preds, self.n_estimators).astype(np.float32)
+
+        # test examples are put into shared memory once per call - a memory-mapped temporary file, which processes map
+        # instead of receiving a copy (float64 features are kept as they are, so that comparisons with thresholds do
+        # not change)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            feats_path = os.path.join(tmp_dir, _PREDICT_FEATS_FILE)
+            feats_np = np.lib.format.open_memmap(feats_path, mode="w+", shape=test_feats.shape,
+                                                 dtype=np.float64 if test_feats.dtype == np.float64 else np.float32)
+            np.copyto(feats_np, test_feats)
+            feats_np.flush()
+            del feats_np
+
+            # outside of an enclosing `prediction_pool()` context, processes are terminated before returning
+            with prediction_pool():
+                if _prediction_pool["pool"] is None:
+                    _prediction_pool["pool"] = multiprocessing.Pool(processes=n_jobs)
+                pool = _prediction_pool["pool"]
+
+                async_objs = []
+                for idx_proc in range(n_jobs):
+                    # divide trees between `n_jobs` processes in the same way as when fitting
+                    start = int(float(idx_proc) * self.n_estimators / n_jobs)
+                    end = int(float(idx_proc + 1) * self.n_estimators / n_jobs)
+
+                    async_objs.append(pool.apply_async(func=RandomXOfNForest._predict_process,
+                                                       args=(self.estimators[start: end], feats_path, n_classes)))
+
+                # partial sums of probabilities, computed by processes, get added up
+                proba_preds = np.zeros((n_samples, n_classes), dtype=np.float64)
+                for obj in async_objs:
+                    proba_preds += obj.get()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        proba_preds = np.divide(proba_preds, self.n_estimators).astype(np.float32)
         return proba_preds
 
     def predict(self, test_feats):
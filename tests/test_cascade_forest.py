@@ -1,7 +1,8 @@
 import unittest
 import numpy as np
 
-from gcforest.cascade_forest import EndingLayerAverage
+from gcforest.cascade_forest import CascadeInputBuffer, CascadeLayer, EndingLayerAverage, exit_confidence, \
+    calibrate_exit_threshold, predict_proba_early_exit, truncated_n_trees
 
 
 class TestCascadeForest(unittest.TestCase):
@@ -42,3 +43,120 @@ class TestCascadeForest(unittest.TestCase):
         np.testing.assert_array_almost_equal(proba_preds2, np.array([[0.85, 0.15],
                                                                     [0.115, 0.885],
                                                                     [0.54, 0.46]]))
+
+    def test_average_dtype(self):
+        """
+        - tests that averaging keeps data type of class vectors (no upcasting of float32 vectors)
+        """
+        end_layer = EndingLayerAverage(classes_=np.array(["ClassA", "ClassB", "ClassC"]))
+        test_feats = np.random.sample((10, 24)).astype(np.float32)
+
+        proba_preds = end_layer.predict_proba(test_feats)
+
+        self.assertEqual(proba_preds.dtype, np.float32)
+        np.testing.assert_array_almost_equal(proba_preds, np.mean(test_feats.reshape((10, 8, 3)), axis=1))
+
+    def test_input_buffer(self):
+        """
+        - tests that layer inputs are [base features | class vectors] for base block `idx_layer % n_blocks`
+        - tests that buffer of a block gets reused (only class vectors are overwritten)
+        """
+        base_feats = [np.random.sample((5, 7)).astype(np.float32), np.random.sample((5, 3)).astype(np.float32)]
+        inputs = CascadeInputBuffer(base_feats)
+
+        class_vectors = [np.random.sample((5, 4)).astype(np.float32) for _ in range(3)]
+        first_input = inputs.layer_input(0, class_vectors[0])
+        np.testing.assert_array_equal(first_input, np.hstack((base_feats[0], class_vectors[0])))
+        np.testing.assert_array_equal(inputs.layer_input(1, class_vectors[1]),
+                                      np.hstack((base_feats[1], class_vectors[1])))
+
+        third_input = inputs.layer_input(2, class_vectors[2])
+        self.assertIs(third_input, first_input)
+        self.assertEqual(third_input.dtype, np.float32)
+        np.testing.assert_array_equal(third_input, np.hstack((base_feats[0], class_vectors[2])))
+
+    def test_exit_confidence(self):
+        """
+        - tests confidence and margin of averaged class vectors
+        """
+        class_vectors = np.array([[0.6, 0.3, 0.1, 0.8, 0.1, 0.1],
+                                  [0.3, 0.3, 0.4, 0.5, 0.3, 0.2]])
+
+        avg_proba, confidence = exit_confidence(class_vectors, n_classes=3)
+        np.testing.assert_array_almost_equal(avg_proba, [[0.7, 0.2, 0.1], [0.4, 0.3, 0.3]])
+        np.testing.assert_array_almost_equal(confidence, [0.7, 0.4])
+
+        _, margin = exit_confidence(class_vectors, n_classes=3, criterion="margin")
+        np.testing.assert_array_almost_equal(margin, [0.5, 0.1])
+
+        with self.assertRaises(NotImplementedError):
+            exit_confidence(class_vectors, n_classes=3, criterion="entropy")
+
+    def test_calibrate_exit_threshold(self):
+        """
+        - tests that calibrated threshold lets as many examples exit as allowed by maximum accuracy loss
+        """
+        labels = np.array([0, 1, 0, 1])
+        final_preds = np.array([0, 1, 0, 1])
+        # first layer is confidently right about examples 0 and 1 and less confidently wrong about examples 2 and 3
+        confidences = np.array([[0.9, 0.8, 0.7, 0.5]])
+        preds = np.array([[0, 1, 1, 0]])
+
+        self.assertAlmostEqual(calibrate_exit_threshold(confidences, preds, final_preds, labels, 0.0), 0.8)
+        self.assertAlmostEqual(calibrate_exit_threshold(confidences, preds, final_preds, labels, 0.3), 0.7)
+        self.assertAlmostEqual(calibrate_exit_threshold(confidences, preds, final_preds, labels, 0.5), 0.5)
+        self.assertIsNone(calibrate_exit_threshold(np.zeros((0, 4)), np.zeros((0, 4)), final_preds, labels, 0.1))
+
+    def test_early_exit_prediction(self):
+        """
+        - tests that confident examples exit after first layer and only the remaining ones are passed to next layer
+        """
+        base_feats = np.array([[0.0], [1.0], [2.0]], dtype=np.float32)
+        first_vectors = np.array([[0.9, 0.1], [0.5, 0.5], [0.2, 0.8]], dtype=np.float32)
+        passed_inputs = []
+
+        def first_layer(feats):
+            return first_vectors[feats[:, 0].astype(np.int32)]
+
+        def second_layer(feats):
+            passed_inputs.append(feats.copy())
+            return np.tile([[0.3, 0.7]], (feats.shape[0], 1)).astype(np.float32)
+
+        end_layer = EndingLayerAverage(classes_=np.array([0, 1]))
+        proba_preds = predict_proba_early_exit([first_layer, second_layer], end_layer, [base_feats], n_classes=2,
+                                               exit_threshold=0.8)
+
+        np.testing.assert_array_almost_equal(proba_preds, [[0.9, 0.1], [0.3, 0.7], [0.2, 0.8]])
+        np.testing.assert_array_equal(passed_inputs[0], [[1.0, 0.5, 0.5]])
+
+    def test_truncated_n_trees(self):
+        self.assertEqual(truncated_n_trees(100, None), 100)
+        self.assertEqual(truncated_n_trees(100, 10), 10)
+        self.assertEqual(truncated_n_trees(100, 500), 100)
+        self.assertEqual(truncated_n_trees(100, 0.25), 25)
+        self.assertEqual(truncated_n_trees(10, 0.01), 1)
+        self.assertEqual(truncated_n_trees(10, 1.0), 10)
+        with self.assertRaises(Exception):
+            truncated_n_trees(10, 0)
+        with self.assertRaises(Exception):
+            truncated_n_trees(10, 1.5)
+
+    def test_truncated_layer(self):
+        """
+        - tests that layer, truncated to first trees of each forest, produces averages of these trees' probabilities
+        """
+        rng = np.random.RandomState(0)
+        feats = rng.random_sample((60, 5)).astype(np.float32)
+        labels = (feats[:, 0] > 0.5).astype(np.int32)
+        layer = CascadeLayer(n_rf=1, n_crf=1, n_rsf=1, n_estimators_rf=4, n_estimators_crf=4, n_estimators_rsf=4,
+                             classes_=np.arange(2), labels_encoded=True)
+        layer.train_layer(feats, labels)
+
+        np.testing.assert_array_equal(layer.transform(feats, n_trees=4), layer.transform(feats))
+        np.testing.assert_array_equal(layer.transform(feats, n_trees=0.5), layer.transform(feats, n_trees=2))
+
+        class_vectors = layer.transform(feats, n_trees=1)
+        np.testing.assert_array_almost_equal(class_vectors[:, :2],
+                                             layer.crf_estimators[0].estimators_[0].predict_proba(feats))
+        np.testing.assert_array_almost_equal(class_vectors[:, 2: 4],
+                                             layer.rf_estimators[0].estimators_[0].predict_proba(feats))
@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from unittest import mock
+
+from gcforest import compiled
+from gcforest.cascade_forest import CascadeLayer
+from gcforest.compiled import CompiledLayer
+from gcforest.gc_forest import GrainedCascadeForest
+
+
+class TestCompiled(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.feats = rng.random_sample((150, 6)).astype(np.float32)
+        self.labels = np.digitize(self.feats[:, 0] + self.feats[:, 1], [0.7, 1.3]).astype(np.int32)
+
+    def test_layer_equivalence(self):
+        """
+        - tests if compiled layer produces same class vectors as the layer, compiled from all supported forests
+        """
+        layer = CascadeLayer(n_rf=1, n_crf=1, n_rsf=1, n_xonf=1, n_estimators_rf=5, n_estimators_crf=5,
+                             n_estimators_rsf=5, n_estimators_xonf=3, classes_=np.arange(3), labels_encoded=True)
+        layer.train_layer(self.feats, self.labels)
+        compiled_layer = CompiledLayer.from_layer(layer)
+
+        self.assertEqual(compiled_layer.n_forests, 4)
+        self.assertEqual(compiled_layer.n_trees, 18)
+        np.testing.assert_array_equal(compiled_layer.transform(self.feats), layer.transform(self.feats))
+        np.testing.assert_array_equal(compiled_layer.transform(self.feats[:1]), layer.transform(self.feats[:1]))
+
+        # forests, truncated to their first trees
+        for n_trees in (1, 2, 0.5):
+            np.testing.assert_array_equal(compiled_layer.transform(self.feats, n_trees=n_trees),
+                                          layer.transform(self.feats, n_trees=n_trees))
+
+        # examples, routed through blocks of fewer examples and trees than there are
+        with mock.patch.object(compiled, "_BLOCK_PAIRS", 40):
+            np.testing.assert_array_equal(compiled_layer.transform(self.feats), layer.transform(self.feats))
+
+    def test_float64_equivalence(self):
+        """
+        - tests if compiled layer of a float64 model routes examples as sklearn trees do (which compare examples, cast
+        to float32) for features at and around split thresholds and at boundaries of rounding to float32
+        """
+        feats = self.feats.astype(np.float64)
+        layer = CascadeLayer(n_rf=1, n_crf=1, n_rsf=1, n_estimators_rf=3, n_estimators_crf=3, n_estimators_rsf=3,
+                             classes_=np.arange(3), labels_encoded=True, dtype=np.float64)
+        layer.train_layer(feats, self.labels)
+        compiled_layer = CompiledLayer.from_layer(layer)
+
+        probes = []
+        for forest in (layer.rf_estimators[0], layer.crf_estimators[0]):
+            for tree in forest.estimators_:
+                is_internal = tree.tree_.children_left != -1
+                for feature, threshold in zip(tree.tree_.feature[is_internal], tree.tree_.threshold[is_internal]):
+                    values = [np.nextafter(threshold, -np.inf), threshold, np.nextafter(threshold, np.inf)]
+                    for value32 in (np.nextafter(np.float32(threshold), np.float32(-np.inf)), np.float32(threshold)):
+                        midpoint = (np.float64(value32) + np.float64(np.nextafter(value32, np.float32(np.inf)))) / 2
+                        values += [np.nextafter(midpoint, -np.inf), midpoint, np.nextafter(midpoint, np.inf)]
+
+                    rows = np.tile(feats[:1], (len(values), 1))
+                    rows[:, feature] = values
+                    probes.append(rows)
+        probes = np.vstack(probes)
+
+        # (random subspace forests return probabilities in single precision, routing to a different leaf changes
+        # them by at least 1/3)
+        np.testing.assert_allclose(compiled_layer.transform(probes), layer.transform(probes), rtol=0, atol=1e-6)
+
+    def test_not_kept_models(self):
+        layer = CascadeLayer(n_rf=1, n_crf=0, n_estimators_rf=5, classes_=np.arange(3), labels_encoded=True,
+                             keep_models=False)
+        layer.train_layer(self.feats, self.labels)
+
+        with self.assertRaises(Exception):
+            CompiledLayer.from_layer(layer)
+
+    def test_save_load(self):
+        """
+        - tests if model, loaded from compact (memory-mapped) format, predicts the same as the original model
+        """
+        rng = np.random.RandomState(1)
+        feats = rng.random_sample((80, 16)).astype(np.float32)
+        labels = np.digitize(feats[:, 5] + feats[:, 6], [0.8, 1.2])
+        model = GrainedCascadeForest(single_shape=[4, 4], window_sizes=[[2, 2]], strides=[[2, 2]], n_rsf_grain=1,
+                                     n_rf_cascade=1, n_crf_cascade=1, n_rsf_cascade=1, n_estimators_rf=5,
+                                     n_estimators_crf=5, n_estimators_rsf=5, end_layer_cascade="stack", random_state=0)
+        model.fit(feats, labels)
+        proba_preds = model.predict_proba(feats)
+
+        model_dir = tempfile.mkdtemp()
+        try:
+            model.save(model_dir)
+            loaded_model = GrainedCascadeForest.load(model_dir)
+
+            self.assertIsInstance(loaded_model._compiled.layers[0].leaf_vals, np.memmap)
+            np.testing.assert_array_equal(loaded_model.classes_, model.classes_)
+            np.testing.assert_array_equal(loaded_model.predict_proba(feats), proba_preds)
+
+            # large batches are predicted with compiled model as well (original models are not saved by default)
+            large_feats = np.tile(feats, (4, 1))
+            np.testing.assert_array_almost_equal(loaded_model.predict_proba(large_feats), np.tile(proba_preds, (4, 1)))
+            self.assertIsNone(loaded_model._casc_forest)
+            self.assertFalse(os.path.exists(os.path.join(model_dir, "models.pkl")))
+            with self.assertRaises(Exception):
+                GrainedCascadeForest.load(model_dir, load_models=True)
+            with self.assertRaises(Exception):
+                loaded_model.save(model_dir, include_models=True)
+
+            # original models are only saved and loaded on request
+            model.save(model_dir, include_models=True)
+            loaded_model = GrainedCascadeForest.load(model_dir)
+            self.assertIsNone(loaded_model._casc_forest)
+            loaded_model = GrainedCascadeForest.load(model_dir, load_models=True)
+            self.assertIsNotNone(loaded_model._casc_forest)
+            np.testing.assert_array_almost_equal(loaded_model.predict_proba(large_feats), np.tile(proba_preds, (4, 1)))
+
+            # models in an unknown version of format are not loaded
+            with open(os.path.join(model_dir, "manifest.json")) as f_manifest:
+                manifest = json.load(f_manifest)
+            manifest["format_version"] += 1
+            with open(os.path.join(model_dir, "manifest.json"), "w") as f_manifest:
+                json.dump(manifest, f_manifest)
+
+            with self.assertRaises(Exception):
+                GrainedCascadeForest.load(model_dir)
+
+            # parameters, which can not be stored in JSON manifest, are not saved (e.g. as their string representation)
+            model.window_sizes = {(2, 2)}
+            with self.assertRaises(Exception):
+                model.save(os.path.join(model_dir, "invalid"))
+            self.assertFalse(os.path.exists(os.path.join(model_dir, "invalid")))
+        finally:
+            shutil.rmtree(model_dir, ignore_errors=True)
+
+    def test_single_examples(self):
+        """
+        - tests if loaded model predicts single examples (batches of one row) the same as the original model (with
+        multi-grained scanning and with early exit)
+        """
+        rng = np.random.RandomState(2)
+        feats = rng.random_sample((80, 16)).astype(np.float32)
+        labels = np.digitize(feats[:, 5] + feats[:, 6], [0.8, 1.2])
+        model_dir = tempfile.mkdtemp()
+        try:
+            for params in ({"single_shape": [4, 4], "window_sizes": [[2, 2]], "strides": [[2, 2]], "n_rf_grain": 1},
+                           {"early_stop_iters": 2, "early_exit_loss": 0.05}):
+                model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                             random_state=0, **params)
+                model.fit(feats, labels)
+                proba_preds = model.predict_proba(feats, verbose=False)
+
+                model.save(model_dir)
+                loaded_model = GrainedCascadeForest.load(model_dir)
+                for idx_example in range(10):
+                    np.testing.assert_array_equal(loaded_model.predict_proba(feats[idx_example: idx_example + 1],
+                                                                             verbose=False)[0],
+                                                  proba_preds[idx_example])
+        finally:
+            shutil.rmtree(model_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
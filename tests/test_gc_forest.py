@@ -0,0 +1,320 @@
+import copy
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from unittest import mock
+
+from gcforest import xofn
+from gcforest.gc_forest import GrainedCascadeForest
+
+
+class TestGrainedCascadeForest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    @staticmethod
+    def _small_model(cache_dir):
+        return GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                    random_state=0, cache_dir=cache_dir)
+
+    def test_resume_from_checkpoint(self):
+        """
+        - tests if training, that is rerun with same configuration and data, resumes from checkpoints and
+        produces the same model
+        """
+        rng = np.random.RandomState(1)
+        feats = rng.random_sample((60, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(60) > 0.6).astype(np.int32)
+
+        model = self._small_model(self.cache_dir)
+        model.fit(feats, labels)
+        proba_preds = model.predict_proba(feats)
+
+        ckpt_dirs = os.listdir(self.cache_dir)
+        self.assertEqual(len(ckpt_dirs), 1)
+        stages = os.listdir(os.path.join(self.cache_dir, ckpt_dirs[0]))
+        self.assertIn("search_layer_0.pkl", stages)
+        self.assertIn("layer_0.pkl", stages)
+
+        # simulate an interruption after first retrained layer
+        for stage in stages:
+            if stage.startswith("layer_") and stage != "layer_0.pkl":
+                os.remove(os.path.join(self.cache_dir, ckpt_dirs[0], stage))
+
+        resumed_model = self._small_model(self.cache_dir)
+        resumed_model.fit(feats, labels)
+
+        self.assertEqual(os.listdir(self.cache_dir), ckpt_dirs)
+        self.assertEqual(len(resumed_model._casc_forest.layers), len(model._casc_forest.layers))
+        np.testing.assert_array_equal(resumed_model.predict_proba(feats), proba_preds)
+
+        # training with a different seed does not resume from checkpoints of another seed
+        other_seed_model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                                random_state=1, cache_dir=self.cache_dir)
+        self.assertNotEqual(other_seed_model._checkpoint_dir("fit", feats, labels),
+                            self._small_model(self.cache_dir)._checkpoint_dir("fit", feats, labels))
+
+    def test_warm_start(self):
+        """
+        - tests if warm start keeps already trained layers and only adds new ones
+        """
+        rng = np.random.RandomState(2)
+        feats = rng.random_sample((60, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(60) > 0.6).astype(np.int32)
+
+        # inputs of cascade layers are not kept by default, so warm start is not possible
+        model = self._small_model(cache_dir=None)
+        model.fit(feats, labels)
+        self.assertIsNone(model._train_router.inputs)
+        with self.assertRaises(Exception):
+            model.fit(feats, labels, warm_start=True)
+
+        model = self._small_model(cache_dir=None)
+        model.fit(feats, labels, keep_train_inputs=True)
+        trained_layers = list(model._casc_forest.layers)
+
+        model.early_stop_iters = 3
+        model.fit(feats, labels, warm_start=True, keep_train_inputs=True)
+
+        self.assertGreaterEqual(len(model._casc_forest.layers), len(trained_layers))
+        for idx_layer, layer in enumerate(trained_layers):
+            self.assertIs(model._casc_forest.layers[idx_layer], layer)
+        self.assertEqual(model._casc_forest.idx_fit_next, len(model._casc_forest.layers))
+        self.assertEqual(model.predict_proba(feats).shape, (60, 2))
+
+        with self.assertRaises(Exception):
+            model.fit(feats[:10], labels[:10], warm_start=True)
+
+
+    def test_early_exit(self):
+        """
+        - tests that early exit threshold is calibrated in fit(...) and can be disabled again
+        """
+        rng = np.random.RandomState(3)
+        feats = rng.random_sample((60, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(60) > 0.6).astype(np.int32)
+
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                     random_state=0, early_stop_iters=2, early_exit_loss=1.0)
+        model.fit(feats, labels)
+        self.assertEqual(len(model._train_exit_stats), len(model._casc_forest.layers))
+
+        if len(model._casc_forest.layers) > 1:
+            # with maximum allowed loss of accuracy, every example can exit after first layer
+            self.assertAlmostEqual(model._exit_threshold, np.min(model._train_exit_stats[0][0]))
+            np.testing.assert_array_almost_equal(
+                model.predict_proba(feats),
+                model._casc_forest.layers[0].transform(feats.astype(np.float32)).reshape((60, -1, 2)).mean(axis=1))
+
+        self.assertIsNone(model.calibrate_early_exit(None))
+        self.assertIsNone(model._exit_threshold)
+
+
+    def test_routing(self):
+        """
+        - tests that deeper layers are trained only on examples that were not confidently classified by previous
+        layers and that the same rule is used for prediction
+        """
+        rng = np.random.RandomState(4)
+        feats = rng.random_sample((90, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(90) > 0.6).astype(np.int32)
+
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                     random_state=0, early_stop_iters=2, routing_threshold=0.9)
+        model.fit(feats, labels)
+
+        n_examples = [stats["n_examples"] for stats in model._train_layer_stats]
+        self.assertEqual(len(n_examples), len(model._casc_forest.layers))
+        self.assertEqual(n_examples[0], 90)
+        self.assertEqual(sorted(n_examples, reverse=True), n_examples)
+        self.assertEqual(model._train_class_vectors.shape[0], n_examples[-1])
+        self.assertEqual(model._exit_threshold, 0.9)
+        self.assertEqual(model.predict_proba(feats).shape, (90, 2))
+
+        with self.assertRaises(Exception):
+            model.calibrate_early_exit(0.01)
+
+        preds = model.fit_predict(feats, labels, feats[:20])
+        self.assertEqual(preds.shape, (20,))
+
+    def test_chunked_prediction(self):
+        """
+        - tests that predictions, streamed in chunks through a thread pool (into a memory-mapped output), are the same
+        as predictions for the whole input at once
+        """
+        rng = np.random.RandomState(5)
+        feats = rng.random_sample((70, 16)).astype(np.float32)
+        labels = np.digitize(feats[:, 5] + feats[:, 6], [0.8, 1.2])
+        model = GrainedCascadeForest(single_shape=[4, 4], window_sizes=[[2, 2]], strides=[[2, 2]], n_rf_grain=1,
+                                     n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                     random_state=0)
+        model.fit(feats, labels)
+        proba_preds = model.predict_proba(feats)
+
+        np.testing.assert_array_equal(model.predict_proba(feats, batch_size=16, n_jobs=3), proba_preds)
+
+        out = np.lib.format.open_memmap(os.path.join(self.cache_dir, "proba.npy"), mode="w+", dtype=proba_preds.dtype,
+                                        shape=proba_preds.shape)
+        model.compile()
+        self.assertIs(model.predict_proba(feats, batch_size=9, n_jobs=2, out=out), out)
+        np.testing.assert_array_almost_equal(out, proba_preds)
+
+        with self.assertRaises(Exception):
+            model.predict_proba(feats, batch_size=9, out=np.empty((10, 3)))
+
+    def test_xonf_worker_processes(self):
+        """
+        - tests that X-of-N forests of all cascade layers share a single pool of worker processes when predicting and
+        that no worker process outlives `predict_proba(...)`
+        """
+        rng = np.random.RandomState(8)
+        feats = rng.random_sample((60, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(60) > 0.6).astype(np.int32)
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=0, n_xonf_cascade=1, n_estimators_rf=5,
+                                     n_estimators_xonf=2, random_state=0, early_stop_iters=2)
+        model.fit(feats, labels)
+        proba_preds = model.predict_proba(feats, verbose=False)
+        for layer in model._casc_forest.layers:
+            for forest in layer.xonf_estimators:
+                forest.n_jobs = 2
+
+        min_elems = xofn._PARALLEL_PREDICT_MIN_ELEMS
+        xofn._PARALLEL_PREDICT_MIN_ELEMS = 0
+        try:
+            with mock.patch("multiprocessing.Pool", side_effect=multiprocessing.Pool) as pool_cls:
+                parallel_preds = model.predict_proba(feats, verbose=False)
+        finally:
+            xofn._PARALLEL_PREDICT_MIN_ELEMS = min_elems
+
+        self.assertGreater(len(model._casc_forest.layers), 1)
+        self.assertEqual(pool_cls.call_count, 1)
+        self.assertEqual(multiprocessing.active_children(), [])
+        np.testing.assert_array_almost_equal(parallel_preds, proba_preds)
+
+    def test_calibrate_n_trees(self):
+        """
+        - tests that accuracy-vs-latency curve is measured for truncated forests and that the cheapest candidate within
+        tolerance is picked
+        """
+        rng = np.random.RandomState(6)
+        feats = rng.random_sample((80, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(80) > 0.6).astype(np.int32)
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=10, n_estimators_crf=10,
+                                     random_state=0, early_stop_iters=1)
+        model.fit(feats[:60], labels[:60])
+
+        curve = model.calibrate_n_trees(feats[60:], labels[60:], candidates=(1, 0.5), max_acc_loss=1.0)
+        self.assertEqual([point["n_trees"] for point in curve], [1, 0.5, None])
+        self.assertEqual(curve[0]["n_cascade_trees"], 2 * len(model._casc_forest.layers))
+        # with maximum allowed loss of accuracy, a single tree of each forest is enough
+        self.assertEqual(model.n_trees_predict, 1)
+        np.testing.assert_array_equal(model.predict_proba(feats), model.predict_proba(feats, n_trees=1))
+
+        curve = model.calibrate_n_trees(feats[60:], labels[60:], candidates=(1, 0.5), max_acc_loss=0.0)
+        chosen = [point for point in curve if point["n_trees"] == model.n_trees_predict][0]
+        self.assertGreaterEqual(chosen["accuracy"], curve[-1]["accuracy"])
+
+    def test_prune(self):
+        """
+        - tests that forests are removed from last layer (together with their class vectors) and truncated within
+        tolerance and that the compiled pruned model predicts the same as the pruned model
+        """
+        rng = np.random.RandomState(7)
+        feats = rng.random_sample((90, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(90) > 0.6).astype(np.int32)
+
+        for end_layer in ("avg", "stack"):
+            model = GrainedCascadeForest(n_rf_cascade=2, n_crf_cascade=2, n_estimators_rf=8, n_estimators_crf=8,
+                                         end_layer_cascade=end_layer, random_state=0, early_stop_iters=1)
+            model.fit(feats[:60], labels[:60])
+            n_layers = len(model._casc_forest.layers)
+
+            # with maximum allowed loss of accuracy, a single forest remains in last layer and forests keep a quarter
+            # of their trees
+            size = model.prune(max_acc_loss=1.0, feats=feats[60:], labels=labels[60:])
+            self.assertEqual(size["before"], {"n_forests": 4 * n_layers, "n_trees": 32 * n_layers})
+            self.assertEqual(size["after"], {"n_forests": 4 * n_layers - 3, "n_trees": 2 * (4 * n_layers - 3)})
+            self.assertEqual(len(model._casc_forest.layers[-1].forests()), 1)
+
+            proba_preds = model.predict_proba(feats)
+            self.assertEqual(proba_preds.shape, (90, 2))
+            model.compile()
+            np.testing.assert_array_almost_equal(model.predict_proba(feats), proba_preds)
+
+            # kept class vectors of training data do not match truncated forests
+            self.assertIsNone(model._train_class_vectors)
+            with self.assertRaises(Exception):
+                model.calibrate_early_exit(0.01)
+            with self.assertRaises(Exception):
+                model.prune(max_acc_loss=1.0)
+
+            # without allowed loss of accuracy, more than one forest remains in last layer and not all forests get
+            # truncated to a quarter of their trees
+            model = GrainedCascadeForest(n_rf_cascade=2, n_crf_cascade=2, n_estimators_rf=8, n_estimators_crf=8,
+                                         end_layer_cascade=end_layer, random_state=0, early_stop_iters=1)
+            model.fit(feats[:60], labels[:60])
+            size = model.prune(max_acc_loss=0.0, feats=feats[60:], labels=labels[60:])
+            self.assertGreater(len(model._casc_forest.layers[-1].forests()), 1)
+            self.assertGreater(size["after"]["n_trees"], 2 * size["after"]["n_forests"])
+
+        with self.assertRaises(Exception):
+            GrainedCascadeForest().prune()
+
+    def test_prune_inner_layers(self):
+        """
+        - tests that a forest is removed from a layer that is not the last one (with kept inputs of cascade layers)
+        and that the pruned model predicts the same as the model with the following layer retrained on the new input
+        layout
+        """
+        rng = np.random.RandomState(7)
+        feats = rng.random_sample((90, 4))
+        labels = (feats[:, 0] + 0.3 * rng.random_sample(90) > 0.6).astype(np.int32)
+
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=8, n_estimators_crf=8,
+                                     random_state=1, early_stop_iters=1)
+        model.fit(feats[:60], labels[:60], keep_train_inputs=True)
+        self.assertEqual(len(model._casc_forest.layers), 2)
+        retrained_model = copy.deepcopy(model)
+
+        # with maximum allowed loss of accuracy, first forest gets removed from first layer (and following layer gets
+        # retrained) and a single forest remains in last layer
+        np.random.seed(3)
+        size = model.prune(max_acc_loss=1.0)
+        self.assertEqual(size["after"]["n_forests"], 2)
+        self.assertEqual([len(layer.forests()) for layer in model._casc_forest.layers], [1, 1])
+
+        # second layer, retrained on class vectors of the remaining forest of first layer
+        retrained_model._casc_forest.layers[0].remove_forest(0)
+        class_vectors = retrained_model._train_layer_class_vectors[0][:, 2:]
+        np.random.seed(3)
+        retrained_layer = retrained_model._new_layer()
+        retrained_class_vectors = retrained_layer.train_layer(
+            np.hstack((np.asarray(feats[:60], dtype=model.dtype), class_vectors)), labels[:60])
+        # (same forest as in pruned model is kept in retrained last layer)
+        kept_forest = 0 if type(model._casc_forest.layers[1].forests()[0]) is type(retrained_layer.forests()[0]) else 1
+        retrained_layer.remove_forest(1 - kept_forest)
+        retrained_model._casc_forest.remove_last_layer()
+        retrained_model._casc_forest.add_layer(retrained_layer, is_trained=True)
+
+        np.testing.assert_array_almost_equal(model._train_class_vectors,
+                                             retrained_class_vectors[:, 2 * kept_forest: 2 * (kept_forest + 1)])
+        np.testing.assert_array_almost_equal(model.predict_proba(feats), retrained_model.predict_proba(feats))
+
+        # kept class vectors of all layers allow pruning again, forests of a model, trained without kept inputs of
+        # cascade layers, are only removed from the last layer
+        model.prune(max_acc_loss=1.0)
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=8, n_estimators_crf=8,
+                                     random_state=1, early_stop_iters=1)
+        model.fit(feats[:60], labels[:60])
+        model.prune(max_acc_loss=1.0)
+        self.assertEqual([len(layer.forests()) for layer in model._casc_forest.layers], [2, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
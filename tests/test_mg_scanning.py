@@ -117,4 +117,25 @@ class TestMGScanning(unittest.TestCase):
                                  [107, 108, 111, 112]])
 
         np.testing.assert_array_almost_equal(grain1.slice_data(self.sample_data_multiple), desired_out1)
-        np.testing.assert_array_almost_equal(grain2.slice_data(self.sample_data_multiple), desired_out2)
\ No newline at end of file
+        np.testing.assert_array_almost_equal(grain2.slice_data(self.sample_data_multiple), desired_out2)
+
+    def test_transform_rsf(self):
+        """
+        - test that class vectors of random subspace forests in transformed data are produced by random subspace
+        forests (and not by completely random forests)
+        """
+        rng = np.random.RandomState(0)
+        feats = rng.random_sample((40, 12)).astype(np.float32)
+        labels = (feats[:, 0] + feats[:, 5] > 1.0).astype(np.int32)
+        grain = Grain(window_size=[2, 2], single_shape=[3, 4], n_rf=0, n_crf=1, n_rsf=1, n_estimators_crf=5,
+                      n_estimators_rsf=5, classes_=[0, 1], random_state=0, labels_encoded=True)
+        grain.create(feats, labels)
+
+        # 6 positions of window with 2 classes for each forest
+        transformed = grain.transform(feats)
+        self.assertEqual(transformed.shape, (40, 24))
+        sliced_data = grain.slice_data(feats)
+        np.testing.assert_array_almost_equal(transformed[:, :12],
+                                             grain.crf_estimators[0].predict_proba(sliced_data).reshape([40, 12]))
+        np.testing.assert_array_almost_equal(transformed[:, 12:],
+                                             grain.rsf_estimators[0].predict_proba(sliced_data).reshape([40, 12]))
\ No newline at end of file
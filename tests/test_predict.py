@@ -0,0 +1,103 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from gcforest.gc_forest import GrainedCascadeForest
+from gcforest.predict import main, read_csv_batches
+
+
+class TestPredict(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        rng = np.random.RandomState(0)
+        self.feats = rng.random_sample((50, 4)).astype(np.float32)
+        labels = np.where(self.feats[:, 0] + self.feats[:, 1] > 1.0, "b", "a")
+        self.model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                          random_state=0, early_stop_iters=1)
+        self.model.fit(self.feats, labels)
+
+        self.model_dir = os.path.join(self.tmp_dir, "model")
+        self.model.save(self.model_dir)
+        self.proba_preds = self.model.predict_proba(self.feats)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_read_csv_batches(self):
+        path = os.path.join(self.tmp_dir, "feats.csv")
+        np.savetxt(path, self.feats, delimiter=",", header="f0,f1,f2,f3", comments="")
+
+        batches = list(read_csv_batches(path, 20, header=True))
+        self.assertEqual([start for start, _ in batches], [0, 20, 40])
+        np.testing.assert_array_almost_equal(np.vstack([batch for _, batch in batches]), self.feats)
+
+    def test_npy(self):
+        """
+        - tests that probabilities, scored in batches by worker processes, are written into memory-mapped output
+        """
+        input_path, out_path = os.path.join(self.tmp_dir, "feats.npy"), os.path.join(self.tmp_dir, "proba.npy")
+        np.save(input_path, self.feats)
+
+        for n_jobs in (1, 2):
+            main([input_path, "--model", self.model_dir, "-o", out_path, "--batch-size", "7", "--n-jobs", str(n_jobs)])
+            np.testing.assert_array_almost_equal(np.load(out_path), self.proba_preds)
+
+    def test_workers_load_model(self):
+        """
+        - tests that with worker processes, only they load the model (with memory-mapped arrays, without pickled
+        original models), while main process only loads its classes
+        """
+        input_path, out_path = os.path.join(self.tmp_dir, "feats.npy"), os.path.join(self.tmp_dir, "proba.npy")
+        np.save(input_path, self.feats)
+        self.model.save(self.model_dir, include_models=True)
+
+        for n_jobs, n_loads in ((1, 1), (2, 0)):
+            with mock.patch("gcforest.common_utils.load_data", side_effect=AssertionError), \
+                    mock.patch.object(GrainedCascadeForest, "load", wraps=GrainedCascadeForest.load) as load:
+                main([input_path, "--model", self.model_dir, "-o", out_path, "--batch-size", "7",
+                      "--n-jobs", str(n_jobs)])
+            self.assertEqual(load.call_count, n_loads)
+            np.testing.assert_array_almost_equal(np.load(out_path), self.proba_preds)
+
+    def test_empty_input(self):
+        """
+        - tests that output files are written for inputs without rows as well
+        """
+        input_path, out_path = os.path.join(self.tmp_dir, "empty.npy"), os.path.join(self.tmp_dir, "empty_proba.npy")
+        np.save(input_path, self.feats[:0])
+        main([input_path, "--model", self.model_dir, "-o", out_path])
+        self.assertEqual(np.load(out_path).shape, (0, 2))
+
+        input_path, out_path = os.path.join(self.tmp_dir, "empty.csv"), os.path.join(self.tmp_dir, "empty_labels.csv")
+        with open(input_path, "w") as f_input:
+            f_input.write("f0,f1,f2,f3\n")
+        main([input_path, "--model", self.model_dir, "-o", out_path, "--header", "--labels"])
+        with open(out_path) as f_out:
+            self.assertEqual(f_out.read().split(), ["label"])
+
+    def test_csv_labels(self):
+        """
+        - tests that labels of CSV inputs are written to CSV files in output directory in input order
+        """
+        input_paths = [os.path.join(self.tmp_dir, "part%d.csv" % idx) for idx in range(2)]
+        np.savetxt(input_paths[0], self.feats[:30], delimiter=",")
+        np.savetxt(input_paths[1], self.feats[30:], delimiter=",")
+        out_dir = os.path.join(self.tmp_dir, "out")
+        os.mkdir(out_dir)
+
+        main(input_paths + ["--model", self.model_dir, "-o", out_dir, "--labels", "--batch-size", "8", "--n-jobs", "2"])
+        with open(os.path.join(out_dir, "part0_labels.csv")) as f_out:
+            labels = f_out.read().split()
+        with open(os.path.join(out_dir, "part1_labels.csv")) as f_out:
+            labels += f_out.read().split()[1:]
+
+        self.assertEqual(labels[0], "label")
+        self.assertEqual(labels[1:], list(self.model.classes_[np.argmax(self.proba_preds, axis=1)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+from gcforest.gc_forest import GrainedCascadeForest
+from gcforest.serve import MicroBatcher, PredictionServer, PredictionClient
+
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_micro_batching(self):
+        """
+        - tests that concurrent requests get batched (up to maximum batch size) and receive their own predictions
+        """
+        batch_sizes = []
+
+        def predict_fn(feats):
+            batch_sizes.append(feats.shape[0])
+            return feats * 2
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=8, max_wait_ms=50.0)
+        requests = [np.full((1 + idx % 3, 2), idx, dtype=np.float32) for idx in range(12)]
+        futures = [batcher.submit(feats) for feats in requests]
+
+        for feats, future in zip(requests, futures):
+            np.testing.assert_array_equal(future.result(timeout=5), feats * 2)
+        batcher.close()
+
+        self.assertEqual(sum(batch_sizes), sum(feats.shape[0] for feats in requests))
+        self.assertLess(len(batch_sizes), len(requests))
+        self.assertLessEqual(max(batch_sizes), 8)
+
+        stats = batcher.stats()
+        self.assertEqual(stats["n_requests"], 12)
+        self.assertEqual(stats["n_batches"], len(batch_sizes))
+        self.assertGreaterEqual(stats["latency_p99_ms"], stats["latency_p50_ms"])
+
+    def test_invalid_request(self):
+        """
+        - tests that an invalid request fails only itself and not the other requests in its batch
+        """
+        def predict_fn(feats):
+            if feats.shape[1] != 3:
+                raise Exception("Expected 3 features!")
+            return feats.sum(axis=1, keepdims=True)
+
+        batcher = MicroBatcher(predict_fn, max_batch_size=16, max_wait_ms=50.0)
+        valid_future = batcher.submit(np.ones((2, 3)))
+        invalid_future = batcher.submit(np.ones((1, 4)))
+
+        np.testing.assert_array_equal(valid_future.result(timeout=5), [[3.0], [3.0]])
+        with self.assertRaises(Exception):
+            invalid_future.result(timeout=5)
+        batcher.close()
+
+    def test_server(self):
+        """
+        - tests predictions of a saved model, served on TCP and Unix sockets to concurrent clients
+        """
+        rng = np.random.RandomState(0)
+        feats = rng.random_sample((40, 4)).astype(np.float32)
+        labels = (feats[:, 0] > 0.5).astype(np.int32)
+
+        model = GrainedCascadeForest(n_rf_cascade=1, n_crf_cascade=1, n_estimators_rf=5, n_estimators_crf=5,
+                                     random_state=0)
+        model.fit(feats, labels)
+        model.save(os.path.join(self.tmp_dir, "model"))
+        loaded_model = GrainedCascadeForest.load(os.path.join(self.tmp_dir, "model"))
+        expected = loaded_model.predict_proba(feats)
+
+        for address in [("127.0.0.1", 0), os.path.join(self.tmp_dir, "gcforest.sock")]:
+            server = PredictionServer(loaded_model, address, max_batch_size=16, max_wait_ms=5.0)
+            server.start()
+
+            results = [None] * 4
+
+            def request_rows(idx_client):
+                client = PredictionClient(server.address, timeout=10)
+                results[idx_client] = np.vstack([client.predict_proba(feats[idx_row])
+                                                 for idx_row in range(idx_client, 40, 4)])
+                client.close()
+
+            threads = [threading.Thread(target=request_rows, args=(idx,)) for idx in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            for idx_client in range(4):
+                np.testing.assert_array_almost_equal(results[idx_client], expected[idx_client::4])
+
+            client = PredictionClient(server.address, timeout=10)
+            self.assertEqual(client.stats()["n_requests"], 40)
+            with self.assertRaises(Exception):
+                client.predict_proba(np.ones((2, 2, 2)))
+            client.close()
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,57 @@
 import unittest
 import numpy as np
+import multiprocessing
+import multiprocessing.pool
 
 from gcforest import xofn
 
 
+def _fit_recursive(tree, feats, labels):
+    """ Reference builder, which grows `tree` (with encoded labels) recursively and copies examples of each node (as
+    X-of-N trees were grown before they were built iteratively over a partitioned index array). """
+    tree.classes_ = np.unique(labels)
+    tree._max_feats = xofn.XOfNTree.calc_max_feats(tree.max_features, feats.shape[1])
+    tree._min_samples = xofn.XOfNTree.calc_min_samples(tree.min_samples_leaf, feats.shape[0])
+
+    def split_rec(curr_feats, curr_labels, curr_depth):
+        uniqs, class_dist = np.unique(curr_labels, return_counts=True)
+        probas = np.zeros(tree.classes_.shape[0], dtype=np.float32)
+        probas[uniqs] = class_dist / curr_labels.shape[0]
+        leaf = xofn.TreeNode.create_leaf(probas, outcome=np.argmax(probas))
+        if curr_depth == tree.max_depth or class_dist.shape[0] == 1:
+            return leaf
+
+        prior_gini = xofn._gini(class_dist, curr_labels.shape[0])
+        selected_attrs = np.random.choice(curr_feats.shape[1], size=tree._max_feats, replace=False) \
+            if tree._max_feats < curr_feats.shape[1] else np.arange(curr_feats.shape[1])
+        new_attr, new_gini = xofn.very_greedy_construct_xofn(curr_feats, curr_labels, available_attrs=selected_attrs)
+        if (len(new_attr) == 1 and new_gini >= prior_gini) or (len(new_attr) > 1 and new_gini > prior_gini):
+            return leaf
+
+        lch_mask = xofn._apply_attr(curr_feats, new_attr.idx_attr, new_attr.thresh_val) < new_attr.split_val
+        rch_mask = np.logical_not(lch_mask)
+        if np.sum(lch_mask) < tree._min_samples or np.sum(rch_mask) < tree._min_samples:
+            return leaf
+
+        lch = split_rec(curr_feats[lch_mask, :], curr_labels[lch_mask], curr_depth + 1)
+        rch = split_rec(curr_feats[rch_mask, :], curr_labels[rch_mask], curr_depth + 1)
+        return xofn.TreeNode.create_internal(attr_list=new_attr.idx_attr, thresh_list=new_attr.thresh_val,
+                                             split_val=new_attr.split_val, lch=lch, rch=rch)
+
+    return xofn.FlatXOfNTree.from_root(split_rec(feats, labels, 0), n_classes=tree.classes_.shape[0])
+
+
+def _tree_structure(flat_tree, idx_node=0):
+    """ Nested tuples of conditions, split values and leaf probabilities (independent of order of nodes in arrays). """
+    if flat_tree.children_left[idx_node] == -1:
+        return tuple(flat_tree.probas[idx_node])
+
+    conds = slice(flat_tree.attr_ptr[idx_node], flat_tree.attr_ptr[idx_node + 1])
+    return (tuple(flat_tree.attr_idx[conds]), tuple(flat_tree.thresh_val[conds]), flat_tree.split_val[idx_node],
+            _tree_structure(flat_tree, flat_tree.children_left[idx_node]),
+            _tree_structure(flat_tree, flat_tree.children_right[idx_node]))
+
+
 class TestXOfN(unittest.TestCase):
     def test_gini(self):
         # clean data set
@@ -21,3 +69,175 @@ class TestXOfN(unittest.TestCase):
         best_gini, idx_best_thresh = xofn._res_gini_numerical(feat1, lbl1, uniq_thresh1)
         self.assertAlmostEqual(best_gini, 0.57576, places=5)
         self.assertEqual(uniq_thresh1[idx_best_thresh], 3.5)
+
+    def test_thresh_search_clean(self):
+        # first threshold that cleanly splits the data set is returned
+        feat2 = np.array([0.5, 2.0, 1.0, 3.0, 2.5, 0.1])
+        lbl2 = np.array([0, 1, 0, 1, 1, 0])
+        uniq_thresh2 = np.array([0.1, 0.5, 1.0, 2.0, 2.5, 3.0])
+        best_gini, idx_best_thresh = xofn._res_gini_numerical(feat2, lbl2, uniq_thresh2)
+        self.assertAlmostEqual(best_gini, 0.0)
+        self.assertEqual(uniq_thresh2[idx_best_thresh], 2.0)
+
+    def test_thresh_search_xon_batch(self):
+        # batched search over X-of-N values gives same results as searching each row separately
+        xon_vals = np.array([[0, 1, 1, 2, 0, 2, 1],
+                             [3, 3, 1, 2, 1, 2, 3],
+                             [1, 1, 1, 1, 1, 1, 1]])
+        lbl = np.array([0, 1, 1, 2, 0, 2, 1])
+        best_gini, split_vals = xofn._res_gini_xon_batch(xon_vals, lbl)
+        for idx_row in range(xon_vals.shape[0]):
+            uniq_thresh = np.unique(xon_vals[idx_row])
+            row_gini, idx_row_thresh = xofn._res_gini_numerical(xon_vals[idx_row], lbl, uniq_thresh)
+            self.assertAlmostEqual(best_gini[idx_row], row_gini)
+            self.assertEqual(split_vals[idx_row], uniq_thresh[idx_row_thresh])
+
+    def test_flat_tree_predict(self):
+        """
+        - tests that compiled (flat) tree routes examples the same way as the tree of TreeNode objects
+        """
+        leaf_a = xofn.TreeNode.create_leaf(np.array([1, 0], dtype=np.float32), outcome=0)
+        leaf_b = xofn.TreeNode.create_leaf(np.array([0, 1], dtype=np.float32), outcome=1)
+        leaf_c = xofn.TreeNode.create_leaf(np.array([0.25, 0.75], dtype=np.float32), outcome=1)
+        # root: at least 2 of (x0 < 1.0, x1 < 2.0, x2 < 0.5); left child: at least 1 of (x1 < -1.0)
+        lch = xofn.TreeNode.create_internal(attr_list=[1], thresh_list=[-1.0], split_val=1, lch=leaf_a, rch=leaf_b)
+        root = xofn.TreeNode.create_internal(attr_list=[0, 1, 2], thresh_list=[1.0, 2.0, 0.5], split_val=2,
+                                             lch=lch, rch=leaf_c)
+        flat_tree = xofn.FlatXOfNTree.from_root(root, n_classes=2)
+
+        feats = np.array([[0.0, 0.0, 0.0],
+                          [5.0, -3.0, 1.0],
+                          [5.0, 0.0, 1.0],
+                          [0.0, 5.0, 1.0]])
+        self.assertEqual(flat_tree.n_nodes, 5)
+        np.testing.assert_array_almost_equal(flat_tree.predict_proba(feats), np.array([[0.25, 0.75],
+                                                                                       [0, 1],
+                                                                                       [1, 0],
+                                                                                       [1, 0]]))
+
+    def test_bin_feats(self):
+        """
+        - tests that conditions on bin codes are equivalent to conditions on raw values at bin edges
+        - tests that columns with few different values are binned losslessly
+        """
+        feats = np.random.sample((200, 3)).astype(np.float32)
+        feats[:, 2] = np.round(feats[:, 2] * 4)
+        bin_edges = xofn._find_bin_edges(feats, max_bins=8)
+        codes = xofn._bin_feats(feats, bin_edges)
+
+        self.assertEqual(codes.dtype, np.uint8)
+        np.testing.assert_array_equal(bin_edges[2], np.unique(feats[:, 2])[1:])
+        for idx_col in range(feats.shape[1]):
+            self.assertLessEqual(bin_edges[idx_col].shape[0], 7)
+            for code in range(1, bin_edges[idx_col].shape[0] + 1):
+                np.testing.assert_array_equal(codes[:, idx_col] < code,
+                                              feats[:, idx_col] < bin_edges[idx_col][code - 1])
+
+    def test_iterative_fit(self):
+        """
+        - tests that a tree, built iteratively over a partitioned index array, is the same as a tree, grown
+        recursively on copies of examples of each node
+        - tests that a tree, fitted with sample weights, is the same as a tree, fitted on copies of examples with
+        weights > 0 (bootstrap sample)
+        """
+        feats = np.random.RandomState(1).random_sample((300, 6))
+        labels = (feats[:, 0] + feats[:, 1] > 1).astype(np.int32) + (feats[:, 2] > 0.8)
+
+        for max_features in (None, 3):
+            np.random.seed(5)
+            tree = xofn.XOfNTree(max_features=max_features, min_samples_leaf=3)
+            tree.fit(feats, labels)
+            np.random.seed(5)
+            recursive_tree = _fit_recursive(xofn.XOfNTree(max_features=max_features, min_samples_leaf=3), feats,
+                                            labels)
+
+            self.assertEqual(tree.tree_.n_nodes, recursive_tree.n_nodes)
+            self.assertEqual(_tree_structure(tree.tree_), _tree_structure(recursive_tree))
+            np.testing.assert_array_equal(tree.predict_proba(feats), recursive_tree.predict_proba(feats))
+
+        sample_idx = np.random.RandomState(2).choice(300, size=300, replace=True)
+        sample_weight = np.bincount(sample_idx, minlength=300)
+        trees = []
+        for curr_feats, curr_labels, curr_weight in ((feats, labels, sample_weight),
+                                                     (feats[sample_idx], labels[sample_idx], None)):
+            np.random.seed(6)
+            tree = xofn.XOfNTree(max_features=3, min_samples_leaf=2, labels_encoded=True, classes_=np.arange(3))
+            tree.fit(curr_feats, curr_labels, sample_weight=curr_weight)
+            trees.append(tree)
+
+        self.assertEqual(_tree_structure(trees[0].tree_), _tree_structure(trees[1].tree_))
+        np.testing.assert_array_equal(trees[0].predict_proba(feats), trees[1].predict_proba(feats))
+
+    def test_presorted_fit(self):
+        """
+        - tests that a tree, fitted with shared presorted column order (kept as 32-bit indices), is the same as a tree
+        that sorts its nodes
+        """
+        feats = np.round(np.random.sample((400, 6)) * 20).astype(np.float32)
+        labels = (feats[:, 0] + feats[:, 1] > 20).astype(np.int32) + (feats[:, 2] > 15)
+        sample_weight = np.bincount(np.random.choice(400, size=400), minlength=400)
+        sort_order = xofn._presort_columns(feats)
+        self.assertEqual(sort_order.dtype, np.int32)
+        np.testing.assert_array_equal(sort_order, np.argsort(feats, axis=0, kind="stable"))
+
+        trees = []
+        for curr_sort_order in (None, sort_order):
+            np.random.seed(7)
+            tree = xofn.XOfNTree(max_features=3)
+            tree.fit(feats, labels, sample_weight=sample_weight, sort_order=curr_sort_order)
+            trees.append(tree)
+
+        self.assertEqual(trees[0].tree_.n_nodes, trees[1].tree_.n_nodes)
+        np.testing.assert_array_equal(trees[0].predict_proba(feats), trees[1].predict_proba(feats))
+
+    def test_parallel_forest_predict(self):
+        """
+        - tests that predictions of a forest are the same when trees get evaluated in multiple processes
+        - tests that no worker process outlives a prediction, unless predictions share a pool in `prediction_pool()`
+        context (until context is left), and that processes are not used for small predictions or in other threads
+        """
+        feats = np.random.sample((200, 4)).astype(np.float32)
+        labels = (feats[:, 0] + feats[:, 1] > 1).astype(np.int32)
+        forest = xofn.RandomXOfNForest(n_estimators=4, max_depth=3, n_jobs=2)
+        forest.fit(feats, labels)
+        self.assertEqual(multiprocessing.active_children(), [])
+
+        serial_preds = forest.predict_proba(feats)
+        self.assertIsNone(xofn._prediction_pool["pool"])
+
+        min_elems = xofn._PARALLEL_PREDICT_MIN_ELEMS
+        xofn._PARALLEL_PREDICT_MIN_ELEMS = 0
+        try:
+            np.testing.assert_array_almost_equal(forest.predict_proba(feats), serial_preds)
+            np.testing.assert_array_almost_equal(forest.predict_proba(feats.astype(np.float64)), serial_preds)
+            self.assertIsNone(xofn._prediction_pool["pool"])
+            self.assertEqual(multiprocessing.active_children(), [])
+
+            with xofn.prediction_pool():
+                np.testing.assert_array_almost_equal(forest.predict_proba(feats), serial_preds)
+                pool = xofn._prediction_pool["pool"]
+                self.assertIsNotNone(pool)
+                np.testing.assert_array_almost_equal(forest.predict_proba(feats[:50]), serial_preds[:50])
+                self.assertIs(xofn._prediction_pool["pool"], pool)
+
+                with multiprocessing.pool.ThreadPool(processes=1) as thread_pool:
+                    thread_preds = thread_pool.apply(forest.predict_proba, (feats,))
+                np.testing.assert_array_almost_equal(thread_preds, serial_preds)
+            self.assertIsNone(xofn._prediction_pool["pool"])
+            self.assertEqual(multiprocessing.active_children(), [])
+        finally:
+            xofn._PARALLEL_PREDICT_MIN_ELEMS = min_elems
+
+    def test_threaded_construction(self):
+        """
+        - tests that X-of-N attribute, constructed with a thread pool, is the same as one constructed in a single thread
+        """
+        feats = np.random.sample((300, 10))
+        labels = (feats[:, 0] + feats[:, 1] > 1).astype(np.int32) + (feats[:, 2] > 0.8)
+        single_attr, single_gini = xofn.very_greedy_construct_xofn(feats, labels)
+        with multiprocessing.pool.ThreadPool(processes=2) as pool:
+            pool_attr, pool_gini = xofn.very_greedy_construct_xofn(feats, labels, pool=pool)
+
+        self.assertEqual(single_attr.idx_attr, pool_attr.idx_attr)
+        self.assertEqual(single_attr.thresh_val, pool_attr.thresh_val)
+        self.assertEqual(single_gini, pool_gini)